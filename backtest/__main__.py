@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:46:52 2026
+
+@author: alex shakaev
+"""
+
+''' python -m backtest: runs the call spread backtest on a bar store and
+reports wall time, bars per second and peak memory '''
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import psutil
+import pyqstrat as pq
+
+from utils.bar_store import BarStore
+from backtest.strategy import SpreadBacktest, default_params
+from backtest.walk_forward import walk_forward
+
+def peak_memory():
+    ''' Peak resident memory of this process, or of its largest finished
+    worker process when that is higher, in MB '''
+    try:
+        import resource
+    except ImportError: # windows
+        return psutil.Process().memory_info().peak_wset / 2**20
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m backtest',
+                                     description = 'Runs the call spread backtest on a bar store and reports '
+                                                   'wall time, bars per second and peak memory.')
+    parser.add_argument('--store', default = 'data/SPY_2min', help = 'bar store directory')
+    parser.add_argument('--start', help = 'first bar date, e.g. 2023-04-03')
+    parser.add_argument('--end', help = 'date after the last bar')
+    parser.add_argument('--lookback', type = int, default = default_params['lookback_period'])
+    parser.add_argument('--lambda', dest = 'lambda_', type = float, default = default_params['lambda_'])
+    parser.add_argument('--max-run-length', type = int, default = default_params['max_run_length'])
+    parser.add_argument('--qty', type = int, default = default_params['qty'])
+    parser.add_argument('--hold-days', type = float, default = default_params['hold_days'])
+    parser.add_argument('--trades', action = 'store_true', help = 'print every trade')
+    parser.add_argument('--walk-forward', action = 'store_true',
+                        help = 'fit sma lookback and BOCD lambda on rolling train windows, trade the following test windows')
+    parser.add_argument('--train-days', type = int, default = 120)
+    parser.add_argument('--test-days', type = int, default = 30)
+    parser.add_argument('--workers', type = int, help = 'processes, all cores by default')
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parse_args(argv)
+    params = { 'lookback_period' : args.lookback, 'lambda_' : args.lambda_,
+               'max_run_length' : args.max_run_length, 'qty' : args.qty, 'hold_days' : args.hold_days }
+    calendar = pq.Calendar.get_calendar(pq.Calendar.NYSE)
+
+    start = time.perf_counter()
+    bars = BarStore(args.store).read(args.start, args.end)
+    if not len(bars):
+        print(f'No bars in {args.store}')
+        return 1
+    loaded = time.perf_counter()
+    if args.walk_forward:
+        return report_walk_forward(args, bars, params, start, loaded)
+    backtest = SpreadBacktest(bars, calendar, params)
+    prepared = time.perf_counter()
+    backtest.run()
+    done = time.perf_counter()
+
+    if args.trades:
+        with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.max_columns', None):
+            print(backtest.trade_frame(), '\n')
+    for name, value in backtest.summary().items():
+        print(f'{name:>16} : {value:,.4f}' if isinstance(value, float) else f'{name:>16} : {value:,}')
+    wall = done - start
+    print()
+    for name, value in [('load bars', f'{loaded - start:.3f}s'), ('signals, BOCD', f'{prepared - loaded:.3f}s'),
+                        ('run', f'{done - prepared:.3f}s'), ('wall time', f'{wall:.3f}s'),
+                        ('bars/sec', f'{len(bars) / wall:,.0f}'), ('peak memory', f'{peak_memory():.1f} MB')]:
+        print(f'{name:>16} : {value}')
+    return 0
+
+def report_walk_forward(args, bars, params, start, loaded):
+    summary, equity, trades = walk_forward(bars, train_days = args.train_days, test_days = args.test_days,
+                                           params = params, n_workers = args.workers)
+    done = time.perf_counter()
+    with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.max_columns', None):
+        print(summary, '\n')
+        if args.trades:
+            print(trades, '\n')
+    peak = np.maximum.accumulate(equity.values)
+    print(f'{"windows":>16} : {len(summary)}')
+    print(f'{"n_trades":>16} : {len(trades)}')
+    print(f'{"test pnl":>16} : {equity.iloc[-1] - equity.iloc[0]:,.4f}')
+    print(f'{"max_drawdown":>16} : {((equity.values - peak) / peak).min():,.4f}')
+    wall = done - start
+    print()
+    for name, value in [('load bars', f'{loaded - start:.3f}s'), ('walk forward', f'{done - loaded:.3f}s'),
+                        ('wall time', f'{wall:.3f}s'), ('bars/sec', f'{len(bars) / wall:,.0f}'),
+                        ('peak memory', f'{peak_memory():.1f} MB')]:
+        print(f'{name:>16} : {value}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
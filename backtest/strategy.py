@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:21:37 2026
+
+@author: alex shakaev
+"""
+
+''' SMA + BOCD call spread strategy of the backtesting notebook, on arrays '''
+
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from utils.chains import monthly_expiries
+from utils.pricing import black_scholes
+from utils.sweep import detect_changepoints
+
+default_params = { 'lookback_period' : 50, 'lambda_' : 150, 'alpha' : 1, 'beta' : 1, 'kappa' : 1,
+                   'mu' : 0, 'cp_threshold' : 0.35, 'max_run_length' : 2000,
+                   'qty' : 10, 'width' : 5, 'min_expiry_days' : 20, 'hold_days' : 6,
+                   'exit_after' : 15 * 60 + 30, 'r' : 0.02, 'commission' : 1.0, 'multiplier' : 100,
+                   'starting_equity' : 1e7 }
+
+def changepoints(bars, params):
+    ''' BOCD changepoint indices of the differenced closes '''
+    close = np.asarray(bars['c'], dtype = 'f8')
+    return detect_changepoints(np.diff(close, prepend = close[0]) * 100, params)
+
+def signals(bars, params, cps = None):
+    ''' Boolean arrays over the bars: entry (close above its sma), exit window
+    (after exit_after minutes past midnight) and down (a changepoint where
+    close fell over the last two bars). cps are the changepoints when
+    already known '''
+    close = np.asarray(bars['c'], dtype = 'f8')
+    timestamps = np.asarray(bars['date']).astype('M8[s]')
+
+    # as in the notebook, bars before the sma exists count as above it
+    sma = pd.Series(close).rolling(window = params['lookback_period']).mean().values
+    entry = np.nan_to_num(sma) < close
+
+    minutes = (timestamps - timestamps.astype('M8[D]')) / np.timedelta64(1, 'm')
+    exit_window = minutes > params['exit_after']
+
+    if cps is None:
+        cps = changepoints(bars, params)
+    cps = cps[cps >= 2]
+    down = np.zeros(len(close), dtype = bool)
+    down[cps[close[cps] <= close[cps - 2]]] = True
+    return SimpleNamespace(entry = entry, exit_window = exit_window, down = down, n_changepoints = len(cps))
+
+def first_at_or_after(indices, i):
+    ''' First value of the sorted indices that is >= i, or None '''
+    k = np.searchsorted(indices, i)
+    return indices[k] if k < len(indices) else None
+
+class SpreadBacktest:
+    ''' Buys qty ATM / ATM + width call spreads when the entry signal is on,
+    not on the day of the last exit, on the first expiry at least
+    min_expiry_days trading days out. The spread is sold in the exit window
+    on a down changepoint or once it has been held hold_days. Orders fill on
+    the next bar (the notebook's trade_lag of 1) at Black-Scholes prices from
+    the bar's close and implied vol, with commission per contract.
+
+    Instead of running rules on every bar the backtest jumps between events:
+    the next entry or exit bar is found by searchsorted over the indices
+    where the precomputed signal arrays are set. Legs are priced only over
+    the bars they are held '''
+
+    def __init__(self, bars, calendar, params = None, expiries = None, cps = None):
+        self.params = { **default_params, **(params or {}) }
+        self.calendar = calendar
+        self.timestamps = np.asarray(bars['date']).astype('M8[s]')
+        self.close = np.asarray(bars['c'], dtype = 'f8')
+        # missing implied vols carry the last known one
+        self.iv = pd.Series(np.asarray(bars['iv'], dtype = 'f8')).ffill().values
+        if expiries is None:
+            expiries = monthly_expiries(calendar, self.timestamps[0], self.timestamps[-1])
+        self.expiries = np.sort(np.asarray(expiries).astype('M8[s]'))
+        self.signals = signals(bars, self.params, cps)
+        self.trades = []
+        self.equity = None
+
+    def entry_bar(self, start, not_before):
+        ''' First bar >= start with the entry signal on, at or after not_before '''
+        i = max(start, np.searchsorted(self.timestamps, not_before))
+        return first_at_or_after(self.entry_bars, i)
+
+    def exit_bar(self, start, held_from):
+        ''' First bar >= start in the exit window that is a down changepoint
+        or at least hold_days after held_from '''
+        on_down = first_at_or_after(self.down_bars, start)
+        held = np.searchsorted(self.timestamps, held_from + np.timedelta64(self.params['hold_days'], 'D'))
+        on_held = first_at_or_after(self.window_bars, max(start, held))
+        candidates = [i for i in (on_down, on_held) if i is not None]
+        return min(candidates) if candidates else None
+
+    def price(self, strike, expiry, bars):
+        t = (expiry - self.timestamps[bars]) / np.timedelta64(1, 'D') / 365.0
+        return black_scholes(True, self.close[bars], strike, t, self.params['r'], self.iv[bars])['price']
+
+    def open_spread(self, order_bar):
+        p = self.params
+        timestamp = self.timestamps[order_bar]
+        min_expiry = self.calendar.add_trading_days(timestamp, p['min_expiry_days'])
+        k = np.searchsorted(self.expiries, min_expiry)
+        if k == len(self.expiries):
+            raise ValueError(f'no expiry after {min_expiry}, pass more expiries')
+        long_strike = float(np.round(self.close[order_bar]))
+        return SimpleNamespace(order_bar = order_bar, fill_bar = order_bar + 1, expiry = self.expiries[k],
+                               long_strike = long_strike, short_strike = long_strike + p['width'])
+
+    def run(self, start = 0):
+        ''' Trade from bar start on, earlier bars only warm up the signals '''
+        p = self.params
+        s = self.signals
+        n = len(self.close)
+        self.entry_bars = np.flatnonzero(s.entry)
+        self.down_bars = np.flatnonzero(s.down & s.exit_window)
+        self.window_bars = np.flatnonzero(s.exit_window)
+
+        # equity is the starting equity plus realized pnl, plus the marked value
+        # of the open spread while it is held
+        realized = np.zeros(n + 1)
+        marked = np.zeros(n)
+        scale = p['qty'] * p['multiplier']
+        fee = 2 * p['qty'] * p['commission']
+
+        not_before = self.timestamps[start]
+        while True:
+            order_bar = self.entry_bar(start, not_before)
+            if order_bar is None or order_bar + 1 >= n:
+                break
+            spread = self.open_spread(order_bar)
+            entry = spread.fill_bar
+            exit_order = self.exit_bar(entry, self.timestamps[entry])
+            # a spread still open at the end is marked to the last bar
+            exit = n - 1 if exit_order is None or exit_order + 1 >= n else exit_order + 1
+            held = np.arange(entry, exit + 1)
+            value = scale * (self.price(spread.long_strike, spread.expiry, held)
+                             - self.price(spread.short_strike, spread.expiry, held))
+            cost = value[0] + fee
+            closed = exit_order is not None and exit_order + 1 < n
+            marked[entry : exit + (not closed)] += value[: len(value) - closed] - cost
+            if closed:
+                realized[exit] += value[-1] - cost - fee
+            self.trades.append({ 'entry_time' : self.timestamps[entry], 'exit_time' : self.timestamps[exit] if closed else None,
+                                 'expiry' : spread.expiry, 'long_strike' : spread.long_strike,
+                                 'short_strike' : spread.short_strike,
+                                 'entry_price' : value[0] / scale, 'exit_price' : value[-1] / scale,
+                                 'pnl' : value[-1] - cost - (fee if closed else 0.0),
+                                 'on_changepoint' : bool(closed and s.down[exit_order]) })
+            if not closed:
+                break
+            start, not_before = exit, self.timestamps[exit] + np.timedelta64(1, 'D')
+
+        self.equity = p['starting_equity'] + np.cumsum(realized[:n]) + marked
+        return self
+
+    def trade_frame(self):
+        return pd.DataFrame(self.trades, columns = ['entry_time', 'exit_time', 'expiry', 'long_strike', 'short_strike',
+                                                   'entry_price', 'exit_price', 'pnl', 'on_changepoint'])
+
+    def summary(self):
+        pnl = np.array([trade['pnl'] for trade in self.trades])
+        peak = np.maximum.accumulate(self.equity)
+        return { 'bars' : len(self.close), 'n_changepoints' : self.signals.n_changepoints,
+                 'n_trades' : len(pnl), 'total_pnl' : pnl.sum(),
+                 'win_rate' : (pnl > 0).mean() if len(pnl) else np.nan,
+                 'final_equity' : self.equity[-1],
+                 'return' : self.equity[-1] / self.params['starting_equity'] - 1,
+                 'max_drawdown' : ((self.equity - peak) / peak).min() }
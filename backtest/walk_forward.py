@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:08:25 2026
+
+@author: alex shakaev
+"""
+
+''' Walk-forward runs of the spread backtest over a process pool '''
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pyqstrat as pq
+
+from utils.sweep import attach, shared, param_grid
+from backtest.strategy import SpreadBacktest, changepoints, default_params
+
+# parameters that change the changepoints, the rest only change the trading
+bocd_params = ('lambda_', 'alpha', 'beta', 'kappa', 'mu', 'cp_threshold', 'max_run_length')
+
+default_grid = param_grid(lookback_period = [30, 50, 100], lambda_ = [100, 150, 250])
+
+def windows(timestamps, train_days, test_days):
+    ''' (train_start, test_start, test_end) bar indices of rolling windows:
+    train_days of history followed by test_days of test, moved forward by
+    test_days so the test windows tile the history after the first train
+    window '''
+    timestamps = np.asarray(timestamps).astype('M8[s]')
+    train, test = np.timedelta64(train_days, 'D'), np.timedelta64(test_days, 'D')
+    result = []
+    test_start = timestamps[0] + train
+    while test_start <= timestamps[-1]:
+        i, j, k = np.searchsorted(timestamps, [test_start - train, test_start, test_start + test])
+        if j < k:
+            result.append((int(i), int(j), int(k)))
+        test_start += test
+    return result
+
+def run_window(window, grid, objective, params):
+    ''' Fit on the train bars of window, the combination of grid with the
+    highest objective is then run on the test bars. Runs in the worker on
+    the shared arrays '''
+    train_start, test_start, test_end = window
+    calendar = pq.Calendar.get_calendar(pq.Calendar.NYSE)
+    train = { name : values[train_start : test_start] for name, values in shared.items() }
+
+    # changepoints only depend on the bocd parameters, they are computed once per set
+    cps = {}
+    best, best_value = None, -np.inf
+    for combination in grid:
+        combination = { **params, **combination }
+        key = tuple(combination[name] for name in bocd_params)
+        if key not in cps:
+            cps[key] = changepoints(train, combination)
+        value = SpreadBacktest(train, calendar, combination, cps = cps[key]).run().summary()[objective]
+        if best is None or value > best_value:
+            best, best_value = combination, value
+
+    # the train bars warm up the sma and BOCD, trading starts with the test bars
+    bars = { name : values[train_start : test_end] for name, values in shared.items() }
+    test = SpreadBacktest(bars, calendar, best).run(start = test_start - train_start)
+    trades = test.trade_frame()
+    return { 'best' : { name : best[name] for name in grid[0] }, 'train_' + objective : best_value,
+             'equity' : test.equity[test_start - train_start :] - best['starting_equity'],
+             'trades' : trades, 'n_trades' : len(trades), 'test_pnl' : trades['pnl'].sum() }
+
+def walk_forward(bars, grid = default_grid, train_days = 120, test_days = 30, objective = 'total_pnl',
+                 params = None, n_workers = None):
+    ''' Walk-forward backtest of bars (a DataFrame or dict of arrays with date,
+    c and iv). Windows run in parallel, the bars are written to .npy files once
+    and memory mapped by the workers as in utils.sweep. A spread still open at
+    the end of a test window is marked there and not carried into the next.
+    Returns one row per window, the merged equity curve and all trades '''
+    params = { **default_params, **(params or {}) }
+    timestamps = np.asarray(bars['date']).astype('M8[s]')
+    splits = windows(timestamps, train_days, test_days)
+    if not splits:
+        raise ValueError(f'less than {train_days} days of bars')
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'walk_forward_')
+    try:
+        files = {}
+        for name, values in [('date', timestamps), ('c', bars['c']), ('iv', bars['iv'])]:
+            files[name] = os.path.join(tmp_dir, f'{name}.npy')
+            np.save(files[name], np.ascontiguousarray(values))
+
+        with ProcessPoolExecutor(n_workers, initializer = attach, initargs = (files,)) as pool:
+            results = list(pool.map(partial(run_window, grid = grid, objective = objective, params = params), splits))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+
+    # each window's test pnl continues from where the previous one ended
+    curves, rows, offset = [], [], 0.0
+    for (train_start, test_start, test_end), result in zip(splits, results):
+        curves.append(result['equity'] + offset)
+        offset = curves[-1][-1]
+        rows.append({ 'train_start' : timestamps[train_start], 'test_start' : timestamps[test_start],
+                      'test_end' : timestamps[test_end - 1], **result['best'],
+                      'train_' + objective : result['train_' + objective],
+                      'n_trades' : result['n_trades'], 'test_pnl' : result['test_pnl'] })
+    first = splits[0][1]
+    equity = pd.Series(params['starting_equity'] + np.concatenate(curves), index = timestamps[first : splits[-1][2]])
+    trades = pd.concat([result['trades'] for result in results], ignore_index = True)
+    return pd.DataFrame(rows), equity, trades
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:41:09 2026
+
+@author: alex shakaev
+"""
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:17:45 2026
+
+@author: alex shakaev
+"""
+
+''' python -m benchmarks: runs the benchmark cases over input sizes, prints
+a table and saves the results as json. With --compare the run is set
+against an earlier results file '''
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+from benchmarks.harness import bench, environment, save, load
+from benchmarks.cases import all_cases
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m benchmarks',
+                                     description = 'Runs the benchmark cases over input sizes, prints a table and '
+                                                   'saves the results as json. With --compare the run is set '
+                                                   'against an earlier results file.')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [1000, 10000, 100000],
+                        help = 'input sizes in bars')
+    parser.add_argument('--only', nargs = '+', help = 'run the cases whose name contains one of these')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs of batch cases')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the traced peak memory pass')
+    parser.add_argument('--out', help = 'results file, data/benchmarks/<time>_<commit>.json by default')
+    parser.add_argument('--compare', help = 'earlier results file to compare against')
+    return parser.parse_args(argv)
+
+def compare(results, baseline):
+    ''' p50 and throughput of this run relative to baseline, below 1 is faster '''
+    new = pd.DataFrame(results).set_index(['case', 'size'])
+    old = pd.DataFrame(baseline['results']).set_index(['case', 'size'])
+    both = new.join(old, how = 'inner', lsuffix = '', rsuffix = '_base')
+    return pd.DataFrame({ 'p50_us' : both['p50_us'], 'p50_us_base' : both['p50_us_base'],
+                          'p50_ratio' : both['p50_us'] / both['p50_us_base'],
+                          'per_sec_ratio' : both['per_sec'] / both['per_sec_base'],
+                          'peak_mb_ratio' : both['peak_mb'] / both['peak_mb_base'] })
+
+def main(argv = None):
+    args = parse_args(argv)
+    cases = [case for case in all_cases()
+             if not args.only or any(pattern in case.name for pattern in args.only)]
+    env = environment()
+    results = []
+    for case in cases:
+        for size in args.sizes:
+            if case.max_size is not None and size > case.max_size:
+                continue
+            result = bench(case, size, args.repeat, not args.no_memory)
+            results.append(result)
+            print(f"{result['case']:>32} {size:>7} : p50 {result['p50_us']:>10.2f} us/{result['unit']}"
+                  f"  p99 {result['p99_us']:>10.2f}  {result['per_sec']:>12,.0f} bars/s"
+                  f"  peak {result['peak_mb']:>8.1f} MB")
+
+    out = args.out or os.path.join('data', 'benchmarks', f"{env['time'].replace(':', '')}_{env['commit']}.json")
+    save(out, env, results)
+    print(f'\nResults saved to {out}')
+
+    if args.compare:
+        with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.max_columns', None,
+                               'display.float_format', '{:.3f}'.format):
+            print(f'\nAgainst {args.compare}:\n')
+            print(compare(results, load(args.compare)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
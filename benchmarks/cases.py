@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:58:13 2026
+
+@author: alex shakaev
+"""
+
+''' Benchmark cases on synthetic data: detector, client callbacks, indicators and backtest '''
+
+from functools import partial
+
+import numpy as np
+import pyqstrat as pq
+
+from ibapi.common import BarData, TickAttrib
+from ibapi.contract import Contract
+from ibapi.execution import Execution
+
+from utils.bocd import (BOCD, TruncatedBOCD, PreallocatedStudentT, StudentT,
+                        constant_hazard, generate_normal_time_series)
+from utils.streaming import BarIndicators
+from utils.spy_client import Client
+from backtest.strategy import SpreadBacktest, changepoints, default_params
+from benchmarks.harness import Case
+
+def series(size, seed = 0):
+    ''' size values of piecewise normal segments '''
+    np.random.seed(seed)
+    data = generate_normal_time_series(size // 50 + 2)
+    while len(data) < size:
+        data = np.concatenate((data, generate_normal_time_series(size // 50 + 2)))
+    return data[:size]
+
+def bar_times(size):
+    ''' 2 min regular trading hours bars from 2023-01-03 on '''
+    days = np.arange(np.datetime64('2023-01-03'), np.datetime64('2023-01-03') + size // 100 + 30)
+    days = days[np.is_busday(days)]
+    times = (days.astype('M8[s]')[:, None] + np.timedelta64(9 * 3600 + 1800, 's')
+             + np.arange(195) * np.timedelta64(120, 's')).ravel()
+    return times[:size]
+
+def closes(size, seed = 0):
+    rng = np.random.default_rng(seed)
+    return 400 * np.exp(np.cumsum(rng.normal(0, 0.0008, size)))
+
+class BocdUpdate(Case):
+    ''' TruncatedBOCD.update per bar, run length capped at max_run_length '''
+
+    def __init__(self, max_run_length = 1000):
+        self.name = f'bocd_update_truncated_{max_run_length}'
+        self.max_run_length = max_run_length
+
+    def setup(self, size):
+        self.n_ops = size
+        self.data = series(size)
+        m = self.max_run_length
+        self.bocd = TruncatedBOCD(partial(constant_hazard, 150), PreallocatedStudentT(1, 1, 1, 0, m + 1), m)
+
+    def op(self, i):
+        self.bocd.update(self.data[i])
+
+class FullBocdUpdate(Case):
+    ''' BOCD.update with the full run length matrix, quadratic in size '''
+
+    name = 'bocd_update_full'
+    max_size = 5000
+
+    def setup(self, size):
+        self.n_ops = size
+        self.data = series(size)
+        self.bocd = BOCD(partial(constant_hazard, 150), StudentT(1, 1, 1, 0), size + 1)
+
+    def op(self, i):
+        self.bocd.update(self.data[i])
+
+class BocdFit(Case):
+    ''' TruncatedBOCD.fit over the whole series '''
+
+    name = 'bocd_fit_truncated_1000'
+    batch = True
+
+    def setup(self, size):
+        self.n_ops = 1
+        self.data = series(size)
+
+    def prepare(self):
+        self.bocd = TruncatedBOCD(partial(constant_hazard, 150), PreallocatedStudentT(1, 1, 1, 0, 1001), 1000)
+
+    def op(self, i):
+        self.bocd.fit(self.data)
+
+class StudentTUpdate(Case):
+    ''' PreallocatedStudentT.update_theta, pruned to max_run_length as the
+    truncated detector does '''
+
+    def __init__(self, max_run_length = 1000):
+        self.name = f'studentt_update_theta_{max_run_length}'
+        self.max_run_length = max_run_length
+
+    def setup(self, size):
+        self.n_ops = size
+        self.data = series(size)
+        self.model = PreallocatedStudentT(1, 1, 1, 0, self.max_run_length + 1)
+
+    def op(self, i):
+        self.model.update_theta(self.data[i])
+        self.model.prune(self.max_run_length, keep_longest = True)
+
+class ClientCase(Case):
+    ''' One callback of an unconnected Client fed synthetic payloads. The
+    client is made once, setup empties its tables '''
+
+    client = None
+
+    def setup(self, size):
+        if ClientCase.client is None:
+            ClientCase.client = Client(None, None, 0)
+        client = ClientCase.client
+        for name in client.tables:
+            setattr(client, name, getattr(client, name)[0:0])
+        client.raw_bars = []
+        self.payloads = self.make_payloads(size)
+        self.n_ops = len(self.payloads)
+        self.callback = getattr(client, self.callback_name)
+
+    def op(self, i):
+        self.callback(*self.payloads[i])
+
+class TickPrice(ClientCase):
+    name = 'client_tickPrice'
+    callback_name = 'tickPrice'
+
+    def make_payloads(self, size):
+        attrib = TickAttrib()
+        prices = closes(size)
+        return [(3, 4, prices[i], attrib) for i in range(size)]
+
+class ExecDetails(ClientCase):
+    name = 'client_execDetails'
+    callback_name = 'execDetails'
+
+    def make_payloads(self, size):
+        payloads = []
+        for i in range(size):
+            con = Contract()
+            con.symbol, con.secType, con.conId, con.currency = 'SPY', 'OPT', 1000 + i % 20, 'USD'
+            execution = Execution()
+            execution.execId, execution.orderId, execution.permId = f'0001.{i}', i, i
+            execution.time, execution.acctNumber, execution.exchange = '20231006 10:00:00 US/Eastern', 'DU1', 'BOX'
+            execution.side, execution.shares, execution.price = 'BOT', 1, 2.5
+            payloads.append((-1, con, execution))
+        return payloads
+
+class OrderStatus(ClientCase):
+    name = 'client_orderStatus'
+    callback_name = 'orderStatus'
+
+    def make_payloads(self, size):
+        return [(i, 'Submitted', 0.0, 1.0, 0.0, i, 0, 0.0, 0, '', 0.0) for i in range(size)]
+
+class UpdatePortfolio(ClientCase):
+    ''' Upserts into acc_df, keyed by conId over 50 contracts '''
+
+    name = 'client_updatePortfolio'
+    callback_name = 'updatePortfolio'
+
+    def make_payloads(self, size):
+        payloads = []
+        for i in range(size):
+            con = Contract()
+            con.symbol, con.secType, con.conId, con.strike, con.right = 'SPY', 'OPT', 1000 + i % 50, 430.0, 'C'
+            payloads.append((con, 1.0, 2.5, 250.0, 240.0, 10.0, 0.0, 'DU1'))
+        return payloads
+
+def bar_payloads(size):
+    times = bar_times(size)
+    prices = closes(size)
+    payloads = []
+    for i in range(size):
+        bar = BarData()
+        bar.date = f'{times[i].item():%Y%m%d %H:%M:%S} US/Eastern'
+        bar.open = bar.high = bar.low = bar.close = prices[i]
+        bar.volume = 100
+        payloads.append((2, bar))
+    return payloads
+
+class HistoricalData(ClientCase):
+    ''' Bars of a request without a handler, kept until historicalDataEnd
+    parses their dates '''
+
+    name = 'client_historicalData'
+    callback_name = 'historicalData'
+
+    def make_payloads(self, size):
+        return bar_payloads(size)
+
+class HistoricalDataEnd(ClientCase):
+    ''' historicalDataEnd parsing the dates of size bars at once, inserting
+    them and recomputing diff, sma and signal '''
+
+    name = 'client_historicalDataEnd'
+    callback_name = 'historicalDataEnd'
+    batch = True
+
+    def make_payloads(self, size):
+        self.bars = [(bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume)
+                     for _, bar in bar_payloads(size)]
+        return [(2, '', '')]
+
+    def prepare(self):
+        client = ClientCase.client
+        client.data = client.data[0:0]
+        client.raw_bars = list(self.bars)
+
+class IndicatorUpdate(Case):
+    ''' The streaming replacement of historicalDataEnd: BarIndicators.update per bar '''
+
+    name = 'bar_indicators_update'
+
+    def setup(self, size):
+        self.n_ops = size
+        self.closes = closes(size)
+        self.indicators = BarIndicators(50)
+
+    def op(self, i):
+        self.indicators.update(self.closes[i])
+
+class Backtest(Case):
+    ''' SpreadBacktest from signals to equity curve, changepoints precomputed
+    so only the strategy is timed '''
+
+    name = 'backtest_run'
+    batch = True
+
+    def setup(self, size):
+        self.n_ops = 1
+        self.calendar = pq.Calendar.get_calendar(pq.Calendar.NYSE)
+        self.bars = { 'date' : bar_times(size), 'c' : closes(size), 'iv' : np.full(size, 0.15) }
+        self.params = { **default_params, 'max_run_length' : 300 }
+        self.cps = changepoints(self.bars, self.params)
+
+    def op(self, i):
+        SpreadBacktest(self.bars, self.calendar, self.params, cps = self.cps).run()
+
+def all_cases():
+    return [BocdUpdate(), FullBocdUpdate(), BocdFit(), StudentTUpdate(),
+            TickPrice(), ExecDetails(), OrderStatus(), UpdatePortfolio(), HistoricalData(),
+            HistoricalDataEnd(), IndicatorUpdate(), Backtest()]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:42:30 2026
+
+@author: alex shakaev
+"""
+
+''' Times benchmark cases and collects their latency percentiles and peak memory '''
+
+import contextlib
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+class Case(ABC):
+    ''' A benchmark over an input of size bars. setup builds the input, then
+    either op(i) is timed once per call for i in range(n_ops) or, for batch
+    cases, run() is timed as a whole repeat times with prepare() called
+    untimed before each run. run calls op for every i, a batch case doing
+    one call over the whole input makes that its op with n_ops = 1.
+    max_size skips sizes the case can't handle '''
+
+    name = None
+    batch = False
+    max_size = None
+
+    def setup(self, size):
+        self.n_ops = size
+
+    @abstractmethod
+    def op(self, i):
+        ''' The timed unit of work, i in range(n_ops) '''
+
+    def prepare(self):
+        pass
+
+    def run(self):
+        for i in range(self.n_ops):
+            self.op(i)
+
+def time_ops(op, n):
+    ''' Seconds taken by each of op(0) ... op(n - 1) '''
+    clock = time.perf_counter_ns
+    times = np.empty(n, dtype = np.int64)
+    for i in range(n):
+        start = clock()
+        op(i)
+        times[i] = clock() - start
+    return times * 1e-9
+
+def time_runs(case, repeat):
+    times = np.empty(repeat)
+    for k in range(repeat):
+        case.prepare()
+        start = time.perf_counter()
+        case.run()
+        times[k] = time.perf_counter() - start
+    return times
+
+def traced_peak(case, size):
+    ''' Peak MB allocated by setup and one pass of the case, as seen by
+    tracemalloc. Measured in a separate pass since tracing slows it down '''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        case.setup(size)
+        case.prepare()
+        case.run()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+def bench(case, size, repeat = 3, memory = True):
+    ''' One result row: per op (or per run for batch cases) latency
+    percentiles in microseconds, throughput in bars per second and peak MB.
+    Anything the case prints is discarded '''
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        case.setup(size)
+        if case.batch:
+            times = time_runs(case, repeat)
+            throughput = size / np.median(times)
+        else:
+            times = time_ops(case.op, case.n_ops)
+            throughput = case.n_ops / times.sum()
+        peak = traced_peak(case, size) if memory else np.nan
+    p50, p90, p99 = np.percentile(times, [50, 90, 99]) * 1e6
+    return { 'case' : case.name, 'size' : size, 'unit' : 'run' if case.batch else 'op',
+             'n' : len(times), 'total_s' : float(times.sum()), 'per_sec' : float(throughput),
+             'p50_us' : float(p50), 'p90_us' : float(p90), 'p99_us' : float(p99),
+             'max_us' : float(times.max() * 1e6), 'peak_mb' : float(peak) }
+
+def environment():
+    ''' Where and on what the results were taken, stored with them '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True,
+                                text = True, cwd = os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = ''
+    return { 'time' : datetime.datetime.now().isoformat(timespec = 'seconds'), 'commit' : commit,
+             'python' : platform.python_version(), 'numpy' : np.__version__,
+             'platform' : platform.platform(), 'cpus' : os.cpu_count() }
+
+def save(path, env, results):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with open(path, 'w') as f:
+        json.dump({ 'environment' : env, 'results' : results }, f, indent = 1)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -25,28 +25,56 @@ from ibapi.contract import Contract
 from ibapi.execution import ExecutionFilter
 
 from utils.spy_client import Client, spy_con
-from utils.bocd import BOCD, constant_hazard, StudentT
+from utils.bar_store import BarStore
+from utils.bocd import TruncatedBOCD, constant_hazard, PreallocatedStudentT
+from utils.orders import TimeSchedule
+from utils.chains import monthly_expiries
+from utils.metrics import Registry
+from utils.snapshot import Snapshot, detector_state, restore_detector, account_matches
 
-from utils.utils import (check_signal, get_exec_info, get_trade_details, get_current_price, get_portfolio,
-                   request_chain, get_legs_info, create_combo, get_spread_price, get_order_id, place_order)
+from utils.utils import (check_signal, get_trade_details, get_current_price, request_chain,
+                   get_legs_info, create_combo, get_spread_price)
  
 calendar = pq.Calendar.get_calendar(pq.Calendar.NYSE)    
     
 def main():      
     # Create the client and connect to TWS  
     
-    client = Client('127.0.0.1', 7497, 0)  # 4002 for gateway, 7497 for tws
+    # every callback of the session is journaled, see utils/journal.py to replay it
+    journal = f'data/journal/{datetime.now():%Y%m%d}.ibj'
+    # stage and callback latencies are served at http://127.0.0.1:9108/metrics
+    metrics = Registry()
+    metrics.serve(9108)
+    stage = lambda name: metrics.timer('loop_stage_seconds', stage = name)
+    # tables keep their latest rows in memory, the rest of the day goes to data/tables
+    spill = f'data/tables/{datetime.now():%Y%m%d}'
+    client = Client('127.0.0.1', 7497, 0, dispatch = True, journal = journal, metrics = metrics,
+                    spill = spill)  # 4002 for gateway, 7497 for tws
     
     print("serverVersion:%s connectionTime:%s" % (client.serverVersion(),
                                                   client.twsConnectionTime()))    
-    client.reqCurrentTime()
-    time.sleep(1)
-    print(client.time)    
+    # Position, recent bars and detector of the last run are saved after every candle
+    snapshot = Snapshot('data/state/spy.pkl')
+    state = snapshot.load()
     
-    # Access available funds
-    client.reqAccountSummary(0, 'All', 'AvailableFunds')
-    time.sleep(3)
-    client.cancelAccountSummary(0)        
+    # Seed bars from the snapshot or the local store, new completed bars are appended to the store
+    client.bar_store = BarStore('data/SPY_2min')
+    if state is not None:
+        client.data = state['bars']
+        client.signal = state['signal']
+    else:
+        client.load_history(client.bar_store)
+    
+    # Current time, available funds, positions and executions are requested together,
+    # with a snapshot only the executions since it was taken
+    spy_filter = ExecutionFilter()
+    spy_filter.symbol = 'SPY'
+    spy_filter.secType = ['OPT', 'BAG']
+    if state is not None:
+        spy_filter.time = datetime.fromtimestamp(state['time'], pytz.utc).strftime('%Y%m%d-%H:%M:%S')
+    client.exec_df = client.exec_df[0:0]
+    ib = client.aio
+    ib.gather(ib.current_time(), ib.funds(), ib.portfolio(), ib.executions(spy_filter))
     #=============================================================  
     # Convert unaware Datetime to UTC/Eastern timezone aware Datetime
     ny = pytz.timezone('America/New_York')
@@ -56,19 +84,26 @@ def main():
     RTH_end = RTH_start + timedelta(hours=6, minutes=15)  
     RTH_end = RTH_end.replace(tzinfo=ny)
     
-    get_portfolio(client)    
-          
-    spy_filter = ExecutionFilter()
-    spy_filter.symbol = 'SPY'
-    spy_filter.secType = ['OPT', 'BAG']
-    client.exec_df = client.exec_df[0:0]
-    get_exec_info(client, spy_filter)    
-    
     # check if we got existing position in spy
     spy_df = client.acc_df[(client.acc_df['Symbol'] == 'SPY') & (client.acc_df['SecType'] == 'OPT')]
     acc = client.acc_df
     trade_time = datetime.now(ny)
-    if any(spy_df.loc[:, 'position']): 
+    premium = 0.0
+    restored = state is not None and account_matches(state, acc, client.exec_df)
+    if restored:
+        client.con_ids.update(state['con_ids'])
+        client.spread.update(state['spread'])
+        client.entered = state['entered']
+        premium, trade_time = state['premium'], state['trade_time']
+        if client.entered:
+            bag_con = create_combo(client)
+            print(f"\nGot position in SPY from snapshot, {client.spread['long_leg']}-{client.spread['short_leg']} call spread \n")
+    elif any(spy_df.loc[:, 'position']): 
+        if state is not None:
+            # the account moved on since the snapshot, all executions are needed
+            spy_filter.time = ''
+            client.exec_df = client.exec_df[0:0]
+            ib.run(ib.executions(spy_filter))
         l = acc.loc[:, 'position'].loc[lambda x: x == 1].index
         long_con_id = int(acc.loc[l].ConID.values[0])
         long_cost = acc.loc[l].AvgCost.values[0]
@@ -102,11 +137,8 @@ def main():
     #===================================================
     # Find an expiration date just over a month away
     current_date = np.datetime64(datetime.now()).astype('M8[s]')
-    expiries = []
-    for i in range(9,13):        
-        expiries.append(calendar.third_friday_of_month(i, 2023).astype('M8[s]') + np.timedelta64(8, 'h'))
-    
     max_expiry = calendar.add_trading_days(current_date, 30) # At least 30 trading days out   
+    expiries = monthly_expiries(calendar, current_date, max_expiry)
         
     expiry = expiries[np.searchsorted(expiries, max_expiry)] 
     client.expiry = expiry.item().strftime('%Y%m%d')
@@ -119,23 +151,60 @@ def main():
     spy_opt.right = "C"
     spy_opt.lastTradeDateOrContractMonth = client.expiry   
     
-    get_current_price(client)  
-    request_chain(client, spy_opt)                      
+    client.quotes.subscribe(spy_con) # streams while the chain is requested
+    request_chain(client, spy_opt)
+    get_current_price(client)
     #=============================================================        
     exit_event = threading.Event()
     data_Thread = threading.Thread(target = check_signal, args =(client, spy_con, exit_event))
-    data_Thread.start() # starts requesting hist data
-    time.sleep(10)
+    data_Thread.start() # starts streaming hist data
+    if state is None:
+        client.bar_event.wait(60)
     #=============================================================     
-    lambda_ = 150 # initialize 150*150 matrix for bocd algorithm
+    lambda_ = 150
+    max_run_length = 1000 # about 5 trading days of 2 min bars
     alpha = 0.1
     beta = alpha * client.data['c'].rolling(50).var().iloc[-1] 
     kappa = 1
     mu = 0
-    bocd = BOCD(partial(constant_hazard, lambda_),
-                 StudentT(alpha, beta, kappa, mu), lambda_)                
+    bocd = TruncatedBOCD(partial(constant_hazard, lambda_),
+                 PreallocatedStudentT(alpha, beta, kappa, mu, max_run_length + 1), max_run_length)                
+    bocd.on_changepoint = lambda t, x: print(f'cp detected at index {t}, value {x}')
+    # the detector carries on from the snapshot, catching up on the bars closed since
+    fed_date = None
+    if state is not None:
+        restore_detector(bocd, state['bocd'])
+        fed_date = state['fed_date']
+    
+    def save_state():
+        snapshot.save({ 'entered' : client.entered, 'con_ids' : dict(client.con_ids),
+                        'spread' : dict(client.spread), 'premium' : premium, 'trade_time' : trade_time,
+                        'signal' : client.signal, 'bars' : client.data.tail(1000), 'fed_date' : fed_date,
+                        'bocd' : detector_state(bocd) })
+    # unfilled orders are moved a cent toward the other side every 5 seconds
+    reprice = TimeSchedule(step = 0.01, interval = 5)
+    fill_timeout = 120 # an order not filled within a candle is cancelled and retried on the next
+    
+    def work(order):
+        ''' Wait for the fill, an order still working after fill_timeout is cancelled.
+        True if it was filled '''
+        with stage('order_fill'):
+            if order.wait(fill_timeout):
+                return True
+            if not order.is_done():
+                client.orders.cancel(order)
+                order.wait(10)
+        print(f'Order {order.order_id} {order.status}, filled {order.filled}, errors {order.errors}\n')
+        return order.status == 'Filled'
+    
+    cadence = 120 # seconds between candles
+    iteration_time = metrics.histogram('loop_iteration_seconds', 'main loop work per candle')
+    candle_interval = metrics.histogram('candle_interval_seconds', 'time between candles seen by the main loop')
+    missed = metrics.counter('candles_missed_total', 'candles that came late or not at all')
+    last_candle = time.perf_counter()
     
     while True:        
+        iteration_start = time.perf_counter()
                 
         current_time = datetime.now(ny)       
        
@@ -144,57 +213,60 @@ def main():
             exit_event.set()
             break
         
+        client.bar_event.clear()
+        data = client.data
         try:
-            last_value = client.data['diff'].iloc[-1]
+            last_value = data['diff'].iloc[-1]
         except:
             print('Data is not available yet. Waiting for next candle')
             time.sleep(10)
             continue
         
-        print(client.data.iloc[-10:])        
-        bocd.update(last_value)    
+        print(data.iloc[-10:])        
+        # every bar closed since the detector last saw one, more than one after a restart
+        new_values = data['diff'][data['date'] > fed_date].dropna().values if fed_date is not None else [last_value]
+        with stage('bocd_update'):
+            for value in new_values:
+                bocd.update(value)    
+        fed_date = data['date'].iloc[-1]
+        save_state()
                                                    
         #exit if spread can be repurchased for more than we paid
         pnl = False
+        priced = True # without a spread price the exit waits for the next candle
         if client.entered:
-            spread_price = get_spread_price(client, bag_con)*100 
-            pnl = np.abs(spread_price) >= premium *1.5   
+            with stage('spread_price'):
+                spread_price = get_spread_price(client, bag_con)
+            priced = spread_price is not None
+            pnl = priced and np.abs(spread_price*100) >= premium *1.5   
                                   
-        if pnl or (bocd.cp_detected and client.data['c'].iloc[-1] < client.data['c'].iloc[-3]) or (current_time - trade_time) / pd.Timedelta(5, "d") > 5:    
+        if priced and (pnl or (bocd.cp_detected and client.data['c'].iloc[-1] < client.data['c'].iloc[-3]) or (current_time - trade_time) / pd.Timedelta(5, "d") > 5):    
             if client.entered: 
                 print('Selling spread')
                 client.reqAccountUpdates(True, "")
                 client.reqGlobalCancel()                
-                lmt_price = get_spread_price(client, bag_con)              
-             
-                order_id = get_order_id(client)                
-                print(f'Placing order with lmt price {lmt_price}')
-                place_order(client, order_id, bag_con, lmt_price, "SELL") 
-                time.sleep(10)    
-                
-                while not client.filled and (client.con_ids['short_leg'] in client.acc_df.loc[:,'ConID'].values 
-                     and (not 
-                     (int(client.acc_df[client.acc_df['ConID'] == client.con_ids['short_leg']].loc[:,'position'].values[0]) == 0))):
-                    
-                    lmt_price = round(lmt_price - 0.01, 2)                    
-                    
-                    if not client.filled and client.error_code != 104:    
-                        print(f'Adjusting to bid... Placing order with lmt price {lmt_price}')
-                        place_order(client, order_id, bag_con, lmt_price, "SELL") 
-                        time.sleep(15) 
-                    else:
-                        print("Order is filled")
-                        break              
-                
-                print('Succesfully placed order\n')                                     
-                client.entered = False
-                client.filled = False          
-                trade_time, comm, premium = get_trade_details(client, False)                
-                print(f"Sold SPY call spread at {trade_time : %Y-%m-%d %X}, for {premium}, commission - {comm}\n")
-                print(client.acc_df)
-                bocd.cp_detected = False
+                with stage('spread_price'):
+                    lmt_price = get_spread_price(client, bag_con)              
+                if lmt_price is None:
+                    print('No price for the spread\n')
+                    order = None
+                else:
+                    print(f'Placing order with lmt price {lmt_price}')
+                    with stage('order_submit'):
+                        order = client.orders.submit(bag_con, 'SELL', lmt_price, schedule = reprice)
+                if order is not None and work(order):
+                    print('Succesfully placed order\n')                                     
+                    client.entered = False
+                    client.filled = False          
+                    trade_time, comm, premium = get_trade_details(client, False)                
+                    print(f"Sold SPY call spread at {trade_time : %Y-%m-%d %X}, for {premium}, commission - {comm}\n")
+                    print(client.acc_df)
+                    bocd.cp_detected = False
+                    client.reqAccountUpdates(False, "")
+                    save_state()
+                    continue  
+                # still holding the spread, the exit is tried again once the next candle closes
                 client.reqAccountUpdates(False, "")
-                continue  
         
         if client.signal and not client.entered: # place trade            
             print('Buying spread \n')
@@ -202,43 +274,43 @@ def main():
             get_current_price(client)  
             get_legs_info(client)            
             bag_con = create_combo(client)
-            lmt_price = get_spread_price(client, bag_con)    
-            
-            order_id = get_order_id(client)
-            print(f'Placing order with lmt price {lmt_price}')
-            place_order(client, order_id, bag_con, lmt_price) 
-            time.sleep(10)     
+            with stage('spread_price'):
+                lmt_price = get_spread_price(client, bag_con)    
             
-            while not client.filled or not (client.con_ids['short_leg'] in client.acc_df.loc[:,'ConID'].values 
-                and (int(client.acc_df[client.acc_df['ConID'] == client.con_ids['short_leg']].loc[:,'position'].values[0]) != 0)):
-                lmt_price = round(lmt_price + 0.01, 2)                 
-               
-                if not client.filled and client.error_code != 104:
-                    print(f'Adjusting to ask... Placing order with lmt price {lmt_price}')               
-                    place_order(client, order_id, bag_con, lmt_price) 
-                    time.sleep(15) 
-                else:
-                    print("Order is filled")
-                    break  
-                                                     
-            print('Succesfully placed order!\n') 
-            client.entered = True   
-            client.filled = False            
-            trade_time, comm, premium = get_trade_details(client)              
-            print(f'Bought SPY call spread at {trade_time : %Y-%m-%d %X}, debit - {premium}, commission - {comm}\n')
-            print(client.acc_df)
+            if lmt_price is None:
+                print('No price for the spread, no order on this candle\n')
+                order = None
+            else:
+                print(f'Placing order with lmt price {lmt_price}')
+                with stage('order_submit'):
+                    order = client.orders.submit(bag_con, 'BUY', lmt_price, schedule = reprice)
+            if order is not None and work(order):
+                print('Succesfully placed order!\n') 
+                client.entered = True   
+                client.filled = False            
+                trade_time, comm, premium = get_trade_details(client)              
+                print(f'Bought SPY call spread at {trade_time : %Y-%m-%d %X}, debit - {premium}, commission - {comm}\n')
+                print(client.acc_df)
+                save_state()
             client.reqAccountUpdates(False, "")
                                     
-        end_time = datetime.now(ny) 
-        if end_time - current_time < np.timedelta64(2, 'm'):
-            string = 'No signal' if not client.signal else ''
-            if client.entered and client.signal:
-                string = 'Signal detected but already got position'    
-            print(string + '\nWaiting for next candle...\n')            
-            time.sleep(120 - ((end_time - current_time).total_seconds() % 120.0))            
+        string = 'No signal' if not client.signal else ''
+        if client.entered and client.signal:
+            string = 'Signal detected but already got position'    
+        print(string + '\nWaiting for next candle...\n')            
+        iteration_time.record(time.perf_counter() - iteration_start)
+        got_candle = client.bar_event.wait(150) # set as soon as the next candle closes
+        now = time.perf_counter()
+        if got_candle:
+            candle_interval.record(now - last_candle)
+        if not got_candle or now - last_candle > 1.25 * cadence:
+            missed.inc()
+        last_candle = now
      
     client.reqAccountUpdates(False, "")  
     client.reqGlobalCancel()
+    if len(client.orders.orders):
+        print(client.orders.records())
     # Disconnect from TWS
     client.disconnect()
     sys.exit()
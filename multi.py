@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:31:17 2026
+
+@author: alex shakaev
+"""
+
+''' Runs the SPY strategy of main.py on a list of ETFs from one TWS connection.
+Symbols can be given as SYMBOL or SYMBOL:WIDTH, width being how far above the
+ATM strike the short leg may be '''
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from utils.spy_client import Client
+from utils.bar_store import BarStore
+from utils.metrics import Registry
+from utils.runner import Runner, Instrument, ny
+
+etfs = ['SPY', 'QQQ', 'IWM', 'DIA', 'XLK', 'XLF', 'XLE', 'XLV', 'XLI', 'XLY', 'XLP', 'XLU',
+        'SMH', 'GLD', 'TLT', 'EEM', 'EFA', 'HYG', 'XBI', 'KRE']
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = 'Runs the SPY strategy of main.py on a list of ETFs from '
+                                                   'one TWS connection.')
+    parser.add_argument('symbols', nargs = '*', default = etfs, help = 'SYMBOL or SYMBOL:WIDTH')
+    parser.add_argument('--width', type = float, default = 5, help = 'spread width of symbols without one')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 7497, help = '4002 for gateway, 7497 for tws')
+    parser.add_argument('--client-id', type = int, default = 1)
+    parser.add_argument('--metrics-port', type = int, default = 9109)
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parse_args(argv)
+    now = datetime.now(ny)
+    if now.weekday() in [5, 6]:
+        print('Non trading day!')
+        return 0
+    RTH_end = now.replace(hour = 9, minute = 30, second = 0, microsecond = 0) + timedelta(hours = 6, minutes = 15)
+
+    metrics = Registry()
+    metrics.serve(args.metrics_port)
+    journal = f'data/journal/{now:%Y%m%d}_multi.ibj'
+    client = Client(args.host, args.port, args.client_id, dispatch = True, journal = journal, metrics = metrics)
+
+    instruments = []
+    for item in args.symbols:
+        symbol, _, width = item.partition(':')
+        instruments.append(Instrument(symbol, float(width or args.width), BarStore(f'data/{symbol}_2min')))
+    runner = Runner(client, instruments, metrics = metrics)
+    try:
+        runner.setup()
+        runner.run(RTH_end)
+        print('End of trading day. Disconnecting!')
+    except KeyboardInterrupt:
+        print('Aborted')
+    finally:
+        runner.close()
+        print(runner.positions())
+        if len(client.orders.orders):
+            print(client.orders.records())
+        client.disconnect()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
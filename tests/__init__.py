@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:41:52 2026
+
+@author: alex shakaev
+"""
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:42:10 2026
+
+@author: alex shakaev
+"""
+
+''' Fixtures shared by the tests, which run against utils.fake_tws '''
+
+import numpy as np
+import pytest
+
+from utils.fake_tws import FakeTWS
+from utils.spy_client import Client
+
+def rth_bars(start, days, close = 100.0):
+    ''' 2 minute bars of the regular session on the weekdays of days
+    calendar days from start, closes rising by 0.01 a bar '''
+    day = np.datetime64(start, 'D')
+    days = np.arange(day, day + days)
+    days = days[np.is_busday(days)]
+    session = np.arange(np.timedelta64(9 * 60 + 30, 'm'), np.timedelta64(16 * 60, 'm'), np.timedelta64(2, 'm'))
+    dates = (days[:, None] + session[None, :]).ravel().astype('M8[s]')
+    c = close + 0.01 * np.arange(len(dates))
+    return { 'date' : dates, 'o' : c - 0.005, 'h' : c + 0.01, 'l' : c - 0.01, 'c' : c,
+             'v' : np.full(len(dates), 100.0) }
+
+@pytest.fixture
+def connect():
+    ''' connect(scenario) starts a FakeTWS serving scenario and returns a
+    Client connected to it, both are shut down after the test '''
+    opened = []
+
+    def connect(scenario, **kwargs):
+        tws = FakeTWS(scenario)
+        client = Client('127.0.0.1', tws.port, 0, **kwargs)
+        opened.append((tws, client))
+        assert client.id_event.wait(5), 'no nextValidId from the fake TWS'
+        return client
+
+    yield connect
+    for tws, client in opened:
+        client.disconnect()
+        tws.close()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:48:23 2026
+
+@author: alex shakaev
+"""
+
+''' BarStore repair after interrupted writes and lost files '''
+
+import os
+
+import numpy as np
+import pytest
+
+from utils.bar_store import BarStore
+from tests.conftest import rth_bars
+
+def filled(path):
+    store = BarStore(path)
+    store.append(rth_bars('2026-10-15', 1))
+    return store
+
+def test_torn_append_cut_to_shortest_column(tmp_path):
+    store = filled(str(tmp_path))
+    n = len(store)
+    with open(store.file('c'), 'ab') as f:
+        f.write(np.zeros(3).tobytes())
+    with open(store.file('date'), 'ab') as f:
+        f.write(np.zeros(2, dtype = 'M8[s]').tobytes())
+    assert len(BarStore(store.path)) == n
+
+def test_missing_column_rebuilt(tmp_path):
+    store = filled(str(tmp_path))
+    n = len(store)
+    closes = store.read()['c'].values
+    os.remove(store.file('c'))
+    store = BarStore(store.path)
+    assert len(store) == n and store.rows('c') == n
+    assert np.isnan(store.read()['c']).all()
+    np.testing.assert_array_equal(store.read()['o'].values, closes - 0.005)
+
+def test_missing_dates_raise(tmp_path):
+    store = filled(str(tmp_path))
+    os.remove(store.file('date'))
+    with pytest.raises(ValueError):
+        BarStore(store.path)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:44 2026
+
+@author: alex shakaev
+"""
+
+''' The truncated and stacked detectors against the reference BOCD '''
+
+from functools import partial
+
+import numpy as np
+
+from utils.bocd import BOCD, TruncatedBOCD, BOCDBank, StudentT, PreallocatedStudentT, constant_hazard
+
+hazard = partial(constant_hazard, 150)
+
+def step_series(n = 200, at = 100, jump = 10.0, seed = 0):
+    ''' Unit normal noise whose mean jumps at index at '''
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 1, n) + np.where(np.arange(n) < at, 0.0, jump)
+
+def test_truncated_matches_full():
+    data = step_series()
+    n = len(data)
+    full = BOCD(hazard, StudentT(1, 1, 1, 0), n + 1)
+    # the buffer never fills, so nothing is merged or pruned
+    truncated = TruncatedBOCD(hazard, PreallocatedStudentT(1, 1, 1, 0, n + 2), n + 1)
+    for x in data:
+        full.update(x)
+        truncated.update(x)
+    np.testing.assert_allclose(truncated.cp_probs, full.cp_probs, atol = 1e-12)
+    assert truncated.changepoints == full.changepoints
+    np.testing.assert_allclose(truncated.R[: truncated.n], full.R[: n + 1, n], atol = 1e-12)
+
+def test_bank_matches_one_detector_per_series():
+    mus = [0.0, 5.0, -3.0]
+    data = np.stack([step_series(seed = seed) + mu for seed, mu in enumerate(mus)], axis = 1)
+    # a short buffer, so the merging of the longest runs is compared too
+    max_run_length = 50
+    bank = BOCDBank(hazard, len(mus), max_run_length, 1, 1, 1, mus)
+    detectors = [TruncatedBOCD(hazard, PreallocatedStudentT(1, 1, 1, mu, max_run_length + 1), max_run_length)
+                 for mu in mus]
+    for row in data:
+        bank.update(row)
+        for detector, x in zip(detectors, row):
+            detector.update(x)
+    for i, detector in enumerate(detectors):
+        np.testing.assert_allclose(np.array(bank.cp_probs)[:, i], detector.cp_probs, atol = 1e-12)
+        assert bank.changepoints[i] == detector.changepoints
+        np.testing.assert_allclose(bank.R[i, : bank.n], detector.R[: detector.n], atol = 1e-12)
+
+def test_on_changepoint_fires_on_step():
+    data = step_series()
+    bocd = TruncatedBOCD(hazard, PreallocatedStudentT(1, 1, 1, 0, 301), 300)
+    calls = []
+    bocd.on_changepoint = lambda t, x: calls.append((t, x))
+    for x in data:
+        bocd.update(x)
+    assert [t for t, _ in calls] == bocd.changepoints
+    assert all(x == data[t] for t, x in calls)
+    assert any(100 <= t <= 103 for t, _ in calls)
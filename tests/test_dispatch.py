@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 01:06:52 2026
+
+@author: alex shakaev
+"""
+
+''' Sharding of callbacks over dispatcher workers '''
+
+import time
+from threading import current_thread
+from types import SimpleNamespace
+
+from utils.dispatch import Dispatcher
+from utils.spy_client import Client
+
+class Recorder:
+    ''' Client stand in that records which worker ran each callback '''
+
+    def __init__(self):
+        self.orders = SimpleNamespace(orders = { 7 : None })
+        self.calls = []
+
+    def record(name):
+        def callback(self, *args):
+            self.calls.append((name, args[0], current_thread().name))
+        return callback
+
+    orderStatus = record('orderStatus')
+    execDetails = record('execDetails')
+    commissionReport = record('commissionReport')
+    historicalData = record('historicalData')
+    historicalDataEnd = record('historicalDataEnd')
+    error = record('error')
+
+def test_order_callbacks_share_a_worker():
+    client = Recorder()
+    names = ['orderStatus', 'execDetails', 'commissionReport', 'historicalData', 'historicalDataEnd', 'error']
+    dispatcher = Dispatcher(client, names, n_workers = 4)
+    client.orderStatus(7, 'Submitted')
+    client.execDetails(-1, None)
+    client.commissionReport(None)
+    client.error(7, 202, 'Order Canceled')
+    for req_id in (1001, 1002):
+        client.historicalData(req_id, None)
+        client.error(req_id, 162, 'no data')
+    deadline = time.monotonic() + 5
+    while dispatcher.depth() or len(client.calls) < 8:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    workers = {}
+    for name, key, thread in client.calls:
+        workers.setdefault(key if name in ('historicalData', 'error') and key != 7 else 'order', set()).add(thread)
+    assert all(len(threads) == 1 for threads in workers.values())
+    assert workers[1001] != workers[1002] and workers[1001] != workers['order']
+
+def test_client_dispatches_only_callbacks():
+    client = Client(None, None, 0, dispatch = True)
+    names = set(client.dispatcher.callbacks)
+    assert { 'orderStatus', 'historicalData', 'error' } <= names
+    assert not [name for name in names if name.startswith('_')]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:44:37 2026
+
+@author: alex shakaev
+"""
+
+''' HistoricalDownloader against the fake TWS '''
+
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from utils.bar_store import BarStore
+from utils.downloader import HistoricalDownloader, TokenBucket, acquire
+from utils.fake_tws import Scenario
+from utils.spy_client import spy_con
+from tests.conftest import rth_bars
+
+start, end = datetime(2026, 9, 1), datetime(2026, 9, 11)
+
+def downloader(client, tmp_path, **kwargs):
+    kwargs.setdefault('buckets', [TokenBucket(100, 100)])
+    return HistoricalDownloader(client, BarStore(str(tmp_path / 'SPY')), spy_con, start, end,
+                                chunk_days = 2, **kwargs)
+
+def expected(bars):
+    ''' Bars of [start, end) '''
+    keep = (bars['date'] >= np.datetime64(start)) & (bars['date'] < np.datetime64(end))
+    return { name : values[keep] for name, values in bars.items() }
+
+def test_token_bucket_bursts_then_paces():
+    buckets = [TokenBucket(3, 20)]
+    begin = time.monotonic()
+    for _ in range(3):
+        acquire(buckets)
+    assert time.monotonic() - begin < 0.03
+    for _ in range(2):
+        acquire(buckets)
+    assert time.monotonic() - begin >= 2 / 20 - 0.01
+
+def test_chunks_written_in_order(connect, tmp_path):
+    bars = rth_bars('2026-08-28', 18)
+    client = connect(Scenario(bars))
+    dl = downloader(client, tmp_path)
+    # 2 trading days each, the fake counts days as IB does
+    assert dl.ends == [datetime(2026, 9, 3), datetime(2026, 9, 7), datetime(2026, 9, 9), end]
+    received = []
+    def historicalData(req_id, bar):
+        received.append(bar.date)
+        HistoricalDownloader.historicalData(dl, req_id, bar)
+    dl.historicalData = historicalData
+
+    assert dl.run() == 4
+    assert dl.next_req_id - 1000 == 8 # bars and implied vol of every chunk
+    stored = dl.store.read()
+    want = expected(bars)
+    # chunks don't overlap, every bar came once for bars and once for implied vol
+    assert len(received) == 2 * len(want['date'])
+    np.testing.assert_array_equal(stored['date'].values, want['date'])
+    np.testing.assert_array_equal(stored['c'].values, want['c'])
+    # the fake serves the same bars for implied vol
+    np.testing.assert_array_equal(stored['iv'].values, want['c'])
+    assert not client.req_handlers and not os.listdir(dl.checkpoint_dir)
+
+def test_requests_paced_by_buckets(connect, tmp_path):
+    client = connect(Scenario(rth_bars('2026-08-28', 18)))
+    dl = downloader(client, tmp_path, implied_vol = False, buckets = [TokenBucket(2, 10)])
+    begin = time.monotonic()
+    dl.run()
+    # 4 requests, 2 from the burst and 2 at 10 per second
+    assert time.monotonic() - begin >= 2 / 10 - 0.01
+
+def test_resumes_from_checkpoint_and_store(connect, tmp_path):
+    bars = rth_bars('2026-08-28', 18)
+    client = connect(Scenario(bars))
+    dl = downloader(client, tmp_path)
+
+    # a chunk completed by an interrupted run, marked by its closes
+    done = 2
+    window = (bars['date'] > np.datetime64(dl.ends[done - 1])) & (bars['date'] <= np.datetime64(dl.ends[done]))
+    rows = [(f'{d.astype(datetime):%Y%m%d %H:%M:%S}', 1.0, 1.0, 1.0, -1.0, 1.0) for d in bars['date'][window]]
+    dl.results[done] = { what : dl.to_array(rows) for what in dl.what }
+    dl.save_checkpoint(done)
+    dl.results.clear()
+
+    assert dl.run() == 4
+    assert dl.next_req_id - 1000 == 6 # the checkpointed chunk was not asked for
+    stored = dl.store.read()
+    assert len(stored) == len(expected(bars)['date'])
+    assert (stored['c'] == -1).sum() == window.sum()
+    assert not os.path.exists(dl.checkpoint_file(done))
+
+    # a new run starts from the store, only the chunk ending after its last
+    # bar is asked for again and adds nothing
+    again = downloader(client, tmp_path)
+    assert again.run() == 1
+    assert again.next_req_id - 1000 == 2 and len(again.store) == len(stored)
+
+def test_timed_out_request_retried_and_late_bars_dropped(connect, tmp_path):
+    bars = rth_bars('2026-08-28', 18)
+    client = connect(Scenario(bars, delays = [3]))
+    dl = downloader(client, tmp_path, implied_vol = False, timeout = 0.2)
+
+    assert dl.run() == 4
+    assert dl.next_req_id - 1000 == 5 # the slow request was sent again
+    np.testing.assert_array_equal(dl.store.read()['date'].values, expected(bars)['date'])
+    assert dl.cancelled == { 1000 }
+
+    # the late answer is dropped instead of reaching the live bars
+    deadline = time.monotonic() + 5
+    while dl.cancelled and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not dl.cancelled and not client.req_handlers
+    assert len(client.data) == 0
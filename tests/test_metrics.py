@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:40 2026
+
+@author: alex shakaev
+"""
+
+''' Callback timings exported by the metrics registry '''
+
+from utils.metrics import Registry
+from utils.spy_client import Client
+
+def test_only_called_callbacks_exported():
+    registry = Registry()
+    client = Client(None, None, 0, metrics = registry)
+    assert 'callback_seconds' not in registry.render()
+    client.currentTime(1760000000)
+    client.nextValidId(5)
+    text = registry.render()
+    exported = { line.split('callback="')[1].split('"')[0] for line in text.splitlines()
+                 if line.startswith('spy_callback_seconds{') }
+    assert exported == { 'currentTime', 'nextValidId' }
+    assert 'nan' not in text
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:21:06 2026
+
+@author: alex shakaev
+"""
+
+''' Client tables exposed as DataFrames '''
+
+import numpy as np
+import pandas as pd
+
+from utils.spy_client import Client, bar_table
+from utils.tables import SpillLog
+
+def bar(i, **indicators):
+    return { 'date' : pd.Timestamp('2026-10-01 09:30') + pd.Timedelta(minutes = 2 * i),
+             'o' : 1.0, 'h' : 1.0, 'l' : 1.0, 'c' : float(i), 'v' : 1.0, **indicators }
+
+def test_frames_are_copies():
+    client = Client(None, None, 0)
+    for i in range(5):
+        client.tables['data'].insert(bar(i))
+    data = client.data
+    data['c'] = 99.0
+    data['x'] = 1
+    assert client.data['c'].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert 'x' not in client.data
+
+    df = client.data
+    client.data = df
+    df['c'] = -1.0
+    assert client.data['c'].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+def test_append_extends_narrower_table():
+    client = Client(None, None, 0)
+    client.data = pd.DataFrame([bar(i) for i in range(3)])
+    assert 'sma' not in client.data
+    client.tables['data'].insert(bar(3, diff = 100.0, sma = 1.5, signal = 1))
+    data = client.data
+    assert data['sma'].iloc[-1] == 1.5 and data['signal'].iloc[-1] == 1
+    assert np.isnan(data['sma'].iloc[0]) and data['signal'].dtype == np.int64
+
+def test_spilled_keys_stay_taken(tmp_path):
+    spill = SpillLog(str(tmp_path))
+    table = bar_table()
+    table.bound(4, spill, 'data')
+    for i in range(130):
+        table.insert(bar(i))
+    assert table.spilled and len(table) < 130
+    assert bar(0)['date'] in table
+    assert not table.insert(bar(0, sma = 1.0))
+    table.upsert(bar(1, sma = 1.0))
+    table.clear()
+    assert not table.insert(bar(2))
+    assert table.insert(bar(130))
+    history = table.history()
+    spill.close()
+    assert history['c'].tolist() == [float(i) for i in range(table.spilled)] + [130.0]
+    assert history['sma'].isna().all()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:58:14 2026
+
+@author: alex shakaev
+"""
+
+''' The live loop of main.py against a scripted fake TWS: bars streamed into
+check_signal, the spread priced from the chain, one order filled and one
+cancelled '''
+
+import time
+from types import SimpleNamespace
+from threading import Event, Thread
+
+import numpy as np
+import pytest
+
+from ibapi.contract import Contract
+
+from utils.chains import ChainCache
+from utils.fake_tws import Scenario
+from utils.spy_client import spy_con
+from utils.utils import check_signal, request_chain, get_legs_info, create_combo, get_spread_price
+from tests.conftest import rth_bars
+
+expiry = '20261120'
+chain = [{ 'symbol' : f'SPY   261120C00{strike}000', 'expiry' : expiry, 'strike' : float(strike),
+           'con_id' : 700000 + strike } for strike in range(495, 516)]
+
+def wait_for(condition, timeout = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_signal_spread_fill_and_cancel(connect, tmp_path):
+    bars = rth_bars('2026-10-15', 2, close = 503.0)
+    scenario = Scenario(bars, history = len(bars['date']) - 4, stream_interval = 0.1, chain = chain,
+                        default_quote = { 'bid' : 1.0, 'ask' : 1.1, 'last' : 1.05 })
+    client = connect(scenario)
+    client.chains = ChainCache(str(tmp_path / 'chains'))
+
+    # bars: the history loads at once, the rest closes one by one
+    exit_event = Event()
+    thread = Thread(target = check_signal, args = (client, spy_con, exit_event))
+    thread.start()
+    try:
+        assert client.bar_event.wait(5)
+        assert client.signal # closes rise above their sma
+        # the last bar of the history is still forming, it closes with the first
+        # update, which leaves the last streamed bar forming
+        closed = scenario.history + 2
+        assert wait_for(lambda: len(client.data) == closed)
+    finally:
+        exit_event.set()
+        thread.join(5)
+    data = client.data
+    closes = bars['c'][: closed]
+    np.testing.assert_allclose(data['c'].values, closes)
+    np.testing.assert_allclose(data['sma'].iloc[-1], closes[-50:].mean())
+    assert (data['signal'].iloc[-3:] == 1).all()
+
+    # the spread: chain, legs and quote
+    spy_opt = Contract()
+    spy_opt.symbol, spy_opt.secType, spy_opt.currency = 'SPY', 'OPT', 'USD'
+    spy_opt.exchange, spy_opt.right, spy_opt.lastTradeDateOrContractMonth = 'BOX', 'C', expiry
+    client.expiry = expiry
+    request_chain(client, spy_opt)
+    assert len(client.option_chain) == len(chain)
+    # details of a routed request stay out of client.chain
+    assert len(client.aio.run(client.aio.contract_details(spy_opt))) == len(chain)
+    assert len(client.chain) == len(chain)
+    client.current_price = 503.2
+    get_legs_info(client)
+    assert client.spread == { 'long_leg' : 503.0, 'short_leg' : 508.0 }
+    bag_con = create_combo(client)
+    assert get_spread_price(client, bag_con) == pytest.approx(1.05)
+
+    # a marketable order fills with both legs executed
+    order = client.orders.submit(bag_con, 'BUY', 1.1)
+    assert order.wait(5)
+    assert order.status == 'Filled' and order.avg_fill_price == pytest.approx(1.1)
+    assert scenario.positions == { 700503 : 1, 700508 : -1 }
+    assert wait_for(lambda: len(client.exec_df) == 3) # the legs and the combo
+
+    # one that is not works until cancelled, which TWS reports with 202
+    order = client.orders.submit(bag_con, 'SELL', 2.0)
+    assert not order.wait(0.5)
+    assert order.status == 'Submitted' and order.ack_time is not None
+    client.orders.cancel(order)
+    assert not order.wait(5)
+    assert order.status == 'Cancelled'
+    assert 202 in [code for code, _ in order.errors]
+    assert scenario.positions == { 700503 : 1, 700508 : -1 }
+
+def test_spread_price_gives_up(connect):
+    # TWS sends -1 for a side without orders, so the quote never gets two sided
+    client = connect(Scenario(chain = chain, default_quote = { 'bid' : -1, 'ask' : -1, 'last' : 1.0 }))
+    bag_con = create_combo(client, con_ids = { 'long_leg' : 700503, 'short_leg' : 700508 })
+    begin = time.monotonic()
+    assert get_spread_price(client, bag_con, timeout = 0.5) is None
+    assert time.monotonic() - begin < 2
+
+    # a rejected subscription
+    quote = client.quotes.get(bag_con)
+    quote.error(quote.req_id, 200, 'No security definition has been found for the request')
+    assert get_spread_price(client, bag_con, timeout = 5) is None
+
+def test_polled_history(connect):
+    # the legacy path of check_signal, a request without a handler polled every candle
+    bars = rth_bars('2026-10-15', 2, close = 503.0)
+    client = connect(Scenario(bars))
+    # the end of each request asks for the time, its answer comes after the end is handled
+    ends = []
+    client.listeners.append(SimpleNamespace(currentTime = ends.append))
+    for _ in range(2):
+        client.reqHistoricalData(2, spy_con, '', '2 D', '2 mins', 'ADJUSTED_LAST', 1, 1, False, [])
+    assert wait_for(lambda: len(ends) == 2)
+    assert not client.raw_bars and len(client.data) == len(bars['date']) - 1
+    data = client.data
+    np.testing.assert_array_equal(data['date'].values.astype('M8[s]'), bars['date'][:-1])
+    np.testing.assert_allclose(data['sma'].iloc[-1], bars['c'][-51:-1].mean())
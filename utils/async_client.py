@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:02:44 2026
+
+@author: alex shakaev
+"""
+
+''' asyncio facade over Client: every request gets its own reqId and future '''
+
+import asyncio
+from itertools import count
+from threading import Thread, Lock
+
+class RequestError(Exception):
+    ''' TWS answered a request with an error '''
+
+    def __init__(self, req_id, error_code, error_string):
+        super().__init__(f'request {req_id} failed: {error_code} {error_string}')
+        self.req_id = req_id
+        self.error_code = error_code
+        self.error_string = error_string
+
+def is_warning(error_code):
+    # 2100-2199 are farm connection and other informational messages, 10167
+    # means delayed market data is shown instead of live
+    return 2100 <= error_code < 2200 or error_code == 10167
+
+class Pending:
+    ''' A request waiting for its callbacks, which arrive on the client thread.
+    Subclasses resolve the future from the callbacks they care about '''
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self, method, value):
+        if not self.future.done():
+            method(value)
+
+    def resolve(self, value):
+        self.loop.call_soon_threadsafe(self.set, self.future.set_result, value)
+
+    def fail(self, exc):
+        self.loop.call_soon_threadsafe(self.set, self.future.set_exception, exc)
+
+    def error(self, req_id, error_code, error_string):
+        if not is_warning(error_code):
+            self.fail(RequestError(req_id, error_code, error_string))
+
+    def tickPrice(self, req_id, tick_type, price, attrib):
+        pass
+
+    def contractDetails(self, req_id, details):
+        pass
+
+    def contractDetailsEnd(self, req_id):
+        pass
+
+    def execDetailsEnd(self, req_id):
+        pass
+
+    def accountSummaryEnd(self, req_id):
+        pass
+
+class LastPrice(Pending):
+    def tickPrice(self, req_id, tick_type, price, attrib):
+        if tick_type == 4 and price > 0:
+            self.resolve(price)
+
+class MidPrice(Pending):
+    ''' Resolves with the bid/ask midpoint once both sides are in and the
+    mid is positive '''
+
+    def __init__(self, loop):
+        super().__init__(loop)
+        self.quote = {}
+
+    def tickPrice(self, req_id, tick_type, price, attrib):
+        if tick_type in (1, 2):
+            self.quote[tick_type] = price
+            if len(self.quote) == 2:
+                mid = round(sum(self.quote.values()) / 2, 2)
+                if mid > 0:
+                    self.resolve(mid)
+
+class End(Pending):
+    ''' Resolves with result() when the request's End callback arrives '''
+
+    def __init__(self, loop, result):
+        super().__init__(loop)
+        self.result = result
+
+    def end(self, req_id):
+        self.resolve(self.result())
+
+    execDetailsEnd = accountSummaryEnd = end
+
+class Details(Pending):
+    ''' Collects contract details, resolves with the list at the End callback '''
+
+    def __init__(self, loop):
+        super().__init__(loop)
+        self.details = []
+
+    def contractDetails(self, req_id, details):
+        self.details.append(details)
+
+    def contractDetailsEnd(self, req_id):
+        self.resolve(self.details)
+
+class AsyncClient:
+    ''' Runs an event loop on its own thread. The coroutines below can be
+    awaited on that loop, or driven from plain threads with run and gather.
+    Each request gets a fresh reqId so concurrent requests don't mix up
+    their callbacks, and each takes a timeout in seconds '''
+
+    def __init__(self, client, req_id_start = 10000):
+        self.client = client
+        self.req_ids = count(req_id_start)
+        self.waiting = {} # callback name -> futures of requests without a reqId
+        self.lock = Lock()
+        self.loop = asyncio.new_event_loop()
+        Thread(target = self.loop.run_forever, daemon = True).start()
+        client.listeners.append(self)
+
+    def next_req_id(self):
+        return next(self.req_ids)
+
+    def run(self, coro):
+        ''' Run a coroutine on the loop and block until it is done '''
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def gather(self, *coros):
+        ''' Run coroutines concurrently and block until all are done '''
+        async def gather():
+            return await asyncio.gather(*coros)
+        return self.run(gather())
+
+    async def request(self, pending, send, cancel = None, timeout = 30):
+        ''' Route callbacks of a new reqId to pending, send the request and wait '''
+        req_id = self.next_req_id()
+        self.client.req_handlers[req_id] = pending
+        try:
+            send(req_id)
+            return await asyncio.wait_for(pending.future, timeout)
+        finally:
+            self.client.req_handlers.pop(req_id, None)
+            if cancel is not None:
+                cancel(req_id)
+
+    async def wait_for(self, name, send, timeout = 30):
+        ''' Send a request answered by a callback without a reqId and wait for it '''
+        future = self.loop.create_future()
+        with self.lock:
+            self.waiting.setdefault(name, []).append(future)
+        try:
+            send()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            with self.lock:
+                if future in self.waiting.get(name, []):
+                    self.waiting[name].remove(future)
+
+    def wake(self, name, value):
+        with self.lock:
+            futures = self.waiting.pop(name, [])
+        for future in futures:
+            self.loop.call_soon_threadsafe(
+                lambda future = future: future.done() or future.set_result(value))
+
+    # requests
+
+    async def last_price(self, contract, timeout = 30):
+        return await self.request(LastPrice(self.loop),
+                                  lambda req_id: self.client.reqMktData(req_id, contract, '', False, False, []),
+                                  self.client.cancelMktData, timeout)
+
+    async def mid_price(self, contract, timeout = 30):
+        return await self.request(MidPrice(self.loop),
+                                  lambda req_id: self.client.reqMktData(req_id, contract, '', False, False, []),
+                                  self.client.cancelMktData, timeout)
+
+    async def chain(self, contract, timeout = 120):
+        ''' Contract details are appended to client.chain, which is returned '''
+        for details in await self.contract_details(contract, timeout):
+            self.client.add_to_chain(details)
+        return self.client.chain
+
+    async def contract_details(self, contract, timeout = 120):
+        ''' ContractDetails of every contract matching contract. They are
+        kept per request, so chains of several symbols can be requested at
+        once without mixing in client.chain '''
+        return await self.request(Details(self.loop),
+                                  lambda req_id: self.client.reqContractDetails(req_id, contract),
+                                  timeout = timeout)
+
+    async def executions(self, exec_filter, timeout = 30):
+        ''' Executions land in client.exec_df, which is returned '''
+        return await self.request(End(self.loop, lambda: self.client.exec_df),
+                                  lambda req_id: self.client.reqExecutions(req_id, exec_filter),
+                                  timeout = timeout)
+
+    async def funds(self, timeout = 30):
+        return await self.request(End(self.loop, lambda: self.client.funds),
+                                  lambda req_id: self.client.reqAccountSummary(req_id, 'All', 'AvailableFunds'),
+                                  self.client.cancelAccountSummary, timeout)
+
+    async def portfolio(self, timeout = 30):
+        ''' Account updates land in client.acc_df, which is returned '''
+        try:
+            await self.wait_for('accountDownloadEnd',
+                                lambda: self.client.reqAccountUpdates(True, ''), timeout)
+        finally:
+            self.client.reqAccountUpdates(False, '')
+        return self.client.acc_df
+
+    async def order_id(self, timeout = 30):
+        return await self.wait_for('nextValidId', lambda: self.client.reqIds(-1), timeout)
+
+    async def current_time(self, timeout = 30):
+        return await self.wait_for('currentTime', self.client.reqCurrentTime, timeout)
+
+    # callbacks without a reqId, passed on by the client
+
+    def nextValidId(self, order_id):
+        self.wake('nextValidId', order_id)
+
+    def accountDownloadEnd(self, account):
+        self.wake('accountDownloadEnd', account)
+
+    def currentTime(self, time):
+        self.wake('currentTime', self.client.time)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:02:17 2026
+
+@author: alex shakaev
+"""
+
+''' Columnar on-disk store for historical bars '''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+columns = { 'date' : np.dtype('M8[s]'), 'o' : np.dtype('f8'), 'h' : np.dtype('f8'),
+            'l' : np.dtype('f8'), 'c' : np.dtype('f8'), 'v' : np.dtype('f8'),
+            'iv' : np.dtype('f8') }
+
+def parse_ib_dates(dates):
+    ''' Vectorized version of spy_client.process_date, returns datetime64[s] '''
+    dates = pd.Series(dates, dtype = str)
+    return pd.to_datetime(dates.str.split().str[:2].str.join(' ')).values.astype('M8[s]')
+
+class BarStore:
+    ''' Directory with one raw binary file per column. Reads are memory mapped,
+    writes only append bars newer than the last stored one '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self.repair()
+
+    def file(self, name):
+        return os.path.join(self.path, f'{name}.bin')
+
+    def rows(self, name):
+        path = self.file(name)
+        return os.path.getsize(path) // columns[name].itemsize if os.path.exists(path) else 0
+
+    def repair(self):
+        ''' Cut all columns to the same length after an interrupted append.
+        A missing column file is rebuilt as NaN, as append stores columns it
+        isn't given, but the bars can't be recovered without their dates '''
+        present = [name for name in columns if os.path.exists(self.file(name))]
+        if not any(self.rows(name) for name in present):
+            return
+        if 'date' not in present:
+            raise ValueError(f'{self.path} has bars but no {self.file("date")}')
+        n = min(self.rows(name) for name in present)
+        for name in columns:
+            if name not in present:
+                print(f'{self.file(name)} is missing, rebuilt as {n} NaN values')
+                with open(self.file(name), 'wb') as f:
+                    f.write(np.full(n, np.nan, dtype = columns[name]).tobytes())
+            elif self.rows(name) > n:
+                with open(self.file(name), 'r+b') as f:
+                    f.truncate(n * columns[name].itemsize)
+
+    def __len__(self):
+        return self.rows('date')
+
+    def column(self, name):
+        ''' Memory mapped column, read only '''
+        if not len(self):
+            return np.empty(0, dtype = columns[name])
+        return np.memmap(self.file(name), dtype = columns[name], mode = 'r')
+
+    def last_date(self):
+        return self.column('date')[-1] if len(self) else None
+
+    def locate(self, start = None, end = None):
+        ''' Row range of bars with start <= date < end '''
+        dates = self.column('date')
+        i = 0 if start is None else np.searchsorted(dates, np.datetime64(start, 's'))
+        j = len(dates) if end is None else np.searchsorted(dates, np.datetime64(end, 's'))
+        return i, j
+
+    def arrays(self, start = None, end = None, names = None):
+        ''' Dict of memory mapped column slices, nothing is copied '''
+        i, j = self.locate(start, end)
+        return { name : self.column(name)[i : j] for name in (names or columns) }
+
+    def read(self, start = None, end = None, names = None):
+        ''' Bars with start <= date < end as a DataFrame '''
+        return pd.DataFrame({ name : np.array(values) for name, values
+                              in self.arrays(start, end, names).items() })
+
+    def tail(self, n, names = None):
+        ''' Last n bars as a DataFrame '''
+        i = max(len(self) - n, 0)
+        return pd.DataFrame({ name : np.array(self.column(name)[i:]) for name in (names or columns) })
+
+    def append(self, bars):
+        ''' Append bars (DataFrame or dict of arrays with a date column) that are
+        newer than the last stored bar. Missing columns are stored as NaN.
+        Returns the number of bars written '''
+        dates = np.asarray(bars['date'])
+        if dates.dtype.kind != 'M':
+            dates = parse_ib_dates(dates)
+        dates = dates.astype('M8[s]')
+        order = np.argsort(dates, kind = 'stable')
+        dates = dates[order]
+        keep = np.ones(len(dates), dtype = bool)
+        keep[1:] = dates[1:] != dates[:-1]
+        last = self.last_date()
+        if last is not None:
+            keep &= dates > last
+        if not keep.any():
+            return 0
+        rows = order[keep]
+
+        for name, dtype in columns.items():
+            if name == 'date':
+                values = dates[keep]
+            elif name in bars:
+                values = np.asarray(bars[name], dtype = dtype)[rows]
+            else:
+                values = np.full(len(rows), np.nan, dtype = dtype)
+            with open(self.file(name), 'ab') as f:
+                f.write(np.ascontiguousarray(values, dtype = dtype).tobytes())
+        return len(rows)
+
+    @classmethod
+    def from_csv(cls, path, prices_csv, imp_vol_csv = None):
+        ''' Build a store from the csv files written by the historical data notebook '''
+        store = cls(path)
+        prices = pd.read_csv(prices_csv)
+        bars = { name : prices[name].values for name in ['o', 'h', 'l', 'c', 'v'] }
+        bars['date'] = parse_ib_dates(prices['date'])
+        if imp_vol_csv is not None:
+            imp_vol = pd.read_csv(imp_vol_csv)
+            iv = pd.Series(imp_vol['c'].values, index = parse_ib_dates(imp_vol['date']))
+            iv = iv[~iv.index.duplicated()]
+            bars['iv'] = iv.reindex(bars['date']).values
+        store.append(bars)
+        return store
@@ -5,15 +5,34 @@
 # under the MIT license.
 """
 
+import math
+from abc import ABC, abstractmethod
 import numpy as np
 from scipy import stats
+from scipy.special import gammaln
 from functools import partial 
+from collections import namedtuple
 import matplotlib.pyplot as plt
 
 def constant_hazard(lam, r):
     return 1/lam * np.ones(r.shape)
 
 
+def logsumexp(a):
+    ''' log(sum(exp(a))) without overflow '''
+    m = a.max()
+    if not math.isfinite(m):
+        return m
+    return m + math.log(np.exp(a - m).sum())
+
+
+def logsumexp_rows(a):
+    ''' logsumexp of every row of a 2d array '''
+    m = a.max(axis = 1)
+    m[~np.isfinite(m)] = 0
+    return m + np.log(np.exp(a - m[:, None]).sum(axis = 1))
+
+
 class StudentT:
     def __init__(self, alpha, beta, kappa, mu):
         self.alpha0 = self.alpha = np.array([alpha])
@@ -28,6 +47,15 @@ class StudentT:
                            scale=np.sqrt(self.beta * (self.kappa+1) / (self.alpha *
                                self.kappa)))
 
+    def logpdf(self, data):
+        ''' Closed form log density of the predictive t distribution '''
+        alpha = self.alpha
+        nu = 2 * alpha
+        scale2 = self.beta * (self.kappa + 1) / (alpha * self.kappa)
+        z = (data - self.mu)**2 / (nu * scale2)
+        return (gammaln(alpha + 0.5) - gammaln(alpha) - 0.5 * np.log(np.pi * nu * scale2)
+                - (alpha + 0.5) * np.log1p(z))
+
     def update_theta(self, data):
         muT0 = np.concatenate((self.mu0, (self.kappa * self.mu + data) / (self.kappa + 1)))
         kappaT0 = np.concatenate((self.kappa0, self.kappa + 1.))
@@ -39,64 +67,528 @@ class StudentT:
         self.kappa = kappaT0
         self.alpha = alphaT0
         self.beta = betaT0
+
+    def prune(self, n, keep_longest = False):
+        ''' Keep parameters for the first n run lengths only. With keep_longest
+        the longest run takes the place of the last kept one '''
+        if keep_longest and n < len(self.mu):
+            ind = np.r_[0 : n - 1, len(self.mu) - 1]
+            self.mu = self.mu[ind]
+            self.kappa = self.kappa[ind]
+            self.alpha = self.alpha[ind]
+            self.beta = self.beta[ind]
+        else:
+            self.mu = self.mu[:n]
+            self.kappa = self.kappa[:n]
+            self.alpha = self.alpha[:n]
+            self.beta = self.beta[:n]
         
 
-class BOCD:
-    def __init__(self, hazard_function, observation_likelihood, length):   
+class PreallocatedStudentT(StudentT):
+    ''' StudentT with the sufficient statistics kept in preallocated arrays '''
+
+    def __init__(self, alpha, beta, kappa, mu, capacity = 256):
+        self.alpha0 = np.array([alpha])
+        self.beta0 = np.array([beta])
+        self.kappa0 = np.array([kappa])
+        self.mu0 = np.array([mu])
+        # log gamma(alpha + 1/2) - log gamma(alpha) is carried along with the
+        # other statistics, see update_theta
+        self.prior = np.array([mu, kappa, alpha, beta,
+                               gammaln(alpha + 0.5) - gammaln(alpha)], dtype = np.float64)
+        # Rows are mu, kappa, alpha, beta, lg. Run length r lives in column head + r,
+        # so a new observation moves the head one step left instead of
+        # shifting the whole array
+        self.theta = np.empty((5, 2 * capacity))
+        self.tmp = np.empty(capacity)
+        self.tmp2 = np.empty(capacity)
+        self.capacity = capacity
+        self.head = capacity
+        self.n = 1
+        self.theta[:, self.head] = self.prior
+
+    @property
+    def mu(self):
+        return self.theta[0, self.head : self.head + self.n]
+
+    @property
+    def kappa(self):
+        return self.theta[1, self.head : self.head + self.n]
+
+    @property
+    def alpha(self):
+        return self.theta[2, self.head : self.head + self.n]
+
+    @property
+    def beta(self):
+        return self.theta[3, self.head : self.head + self.n]
+
+    def logpdf(self, data):
+        ''' Closed form log density of the predictive t distribution '''
+        n = self.n
+        mu, kappa, alpha, beta, lg = self.theta[:, self.head : self.head + n]
+        w = self.tmp[:n]
+        z = self.tmp2[:n]
+
+        # w = nu * scale**2 = 2 * beta * (kappa + 1) / kappa
+        np.add(kappa, 1., out = w)
+        np.multiply(w, beta, out = w)
+        np.divide(w, kappa, out = w)
+        np.multiply(w, 2., out = w)
+
+        # log1p((x - mu)**2 / w)
+        np.subtract(data, mu, out = z)
+        np.square(z, out = z)
+        np.divide(z, w, out = z)
+        np.log1p(z, out = z)
+
+        # 0.5 * log(pi * w)
+        np.multiply(w, np.pi, out = w)
+        np.log(w, out = w)
+        np.multiply(w, 0.5, out = w)
+
+        logp = np.add(alpha, 0.5)
+        np.multiply(logp, z, out = logp)
+        np.add(logp, w, out = logp)
+        np.subtract(lg, logp, out = logp)
+        return logp
+
+    def expand(self):
+        ''' Double the capacity, only needed when run length isn't truncated '''
+        theta = np.empty((5, 4 * self.capacity))
+        head = 2 * self.capacity
+        theta[:, head : head + self.n] = self.theta[:, self.head : self.head + self.n]
+        self.theta = theta
+        self.tmp = np.empty(2 * self.capacity)
+        self.tmp2 = np.empty(2 * self.capacity)
+        self.capacity *= 2
+        self.head = head
+
+    def update_theta(self, data):
+        n = self.n
+        if n == self.capacity:
+            self.expand()
+        if self.head == 0:
+            # Move the active window back to the middle of the buffer
+            head = self.capacity
+            self.theta[:, head : head + n] = self.theta[:, : n]
+            self.head = head
+
+        mu, kappa, alpha, beta, lg = self.theta[:, self.head : self.head + n]
+        tmp = self.tmp[:n]
+
+        # lg(alpha + 1/2) = log(alpha) - lg(alpha), so no gamma functions
+        # are evaluated after the prior
+        np.log(alpha, out = tmp)
+        np.subtract(tmp, lg, out = lg)
+
+        # beta + kappa * (x - mu)**2 / (2 * (kappa + 1))
+        np.subtract(data, mu, out = tmp)
+        np.square(tmp, out = tmp)
+        np.multiply(tmp, kappa, out = tmp)
+        np.add(kappa, 1., out = kappa)
+        np.divide(tmp, kappa, out = tmp)
+        np.multiply(tmp, 0.5, out = tmp)
+        np.add(beta, tmp, out = beta)
+
+        # (kappa * mu + x) / (kappa + 1), kappa is already incremented
+        np.subtract(data, mu, out = tmp)
+        np.divide(tmp, kappa, out = tmp)
+        np.add(mu, tmp, out = mu)
+
+        np.add(alpha, 0.5, out = alpha)
+
+        self.head -= 1
+        self.theta[:, self.head] = self.prior
+        self.n = n + 1
+
+    def prune(self, n, keep_longest = False):
+        ''' Keep parameters for the first n run lengths only. With keep_longest
+        the longest run takes the place of the last kept one '''
+        if n >= self.n:
+            return
+        if keep_longest:
+            self.theta[:, self.head + n - 1] = self.theta[:, self.head + self.n - 1]
+        self.n = n
+
+
+BOCDResult = namedtuple('BOCDResult', ['changepoints', 'cp_probs', 'run_length'])
+
+
+class BaseBOCD(ABC):
+    ''' Changepoint bookkeeping shared by the detectors, subclasses implement
+    step and map_run_length. When set, on_changepoint(t, x) is called by
+    update for every changepoint detected '''
+
+    on_changepoint = None
+
+    @abstractmethod
+    def step(self, x):
+        ''' Update the run length posterior with x, returns the cp probability '''
+
+    @abstractmethod
+    def map_run_length(self):
+        ''' Most likely current run length '''
+
+    def update(self, x):
+        self.cp_detected = False
+        t = self.t
+        cp = self.step(x)
+        self.cp_probs.append(cp)
+        if cp > self.cp_threshold:
+            if not t == 1:
+                self.changepoints.append(t)
+                self.cp_detected = True
+                if self.on_changepoint is not None:
+                    self.on_changepoint(t, x)
+        self.t += 1
+
+    def fit(self, series, run_length = False):
+        ''' Run the detector over a whole series in one call. Same as calling
+        update for every value, without the per call bookkeeping. Returns
+        changepoint indices, cp probabilities and optionally the most likely
+        run length after each observation as arrays '''
+        series = np.asarray(series, dtype = np.float64)
+        N = len(series)
+        t0 = self.t
+        cp_probs = np.empty(N)
+        rl = np.empty(N, dtype = np.int64) if run_length else None
+
+        self.reserve(N)
+        step = self.step
+        if run_length:
+            map_run_length = self.map_run_length
+            for i in range(N):
+                cp_probs[i] = step(series[i])
+                rl[i] = map_run_length()
+                self.t += 1
+        else:
+            for i in range(N):
+                cp_probs[i] = step(series[i])
+                self.t += 1
+
+        detected = cp_probs > self.cp_threshold
+        if t0 <= 1 < t0 + N:
+            detected[1 - t0] = False
+        changepoints = np.flatnonzero(detected) + t0
+
+        self.cp_probs.extend(cp_probs.tolist())
+        self.changepoints.extend(changepoints.tolist())
+        self.cp_detected = N > 0 and bool(detected[-1])
+        return BOCDResult(changepoints, cp_probs, rl)
+
+    def reserve(self, n):
+        ''' Called by fit before processing n more observations '''
+        pass
+
+
+class BOCD(BaseBOCD):
+    def __init__(self, hazard_function, observation_likelihood, length, cp_threshold = 0.35):   
         self.t = 0
         self.R = np.zeros((length, length))
         self.H = hazard_function
         self.observation_likelihood = observation_likelihood
         self.R[0, 0] = 1     
+        # log of the current column of R, the recursion runs in log space
+        self.log_r = np.zeros(1)
         self.changepoints = []
         self.cp_probs = []    
         self.length = length
+        self.cp_threshold = cp_threshold
         self.cp_detected = False
     
     def expand_matrix(self):
         L = self.R.shape[0]    
         self.R = np.pad(self.R, ((0,L),(0,L)))
         self.length  = self.R.shape[0]
+
+    def reserve(self, n):
+        # Grow R once for the whole series instead of doubling along the way
+        if self.t + n >= self.length:
+            L = self.t + n + 1
+            self.R = np.pad(self.R, ((0, L - self.length), (0, L - self.length)))
+            self.length = L
+
+    def map_run_length(self):
+        return int(self.log_r.argmax())
         
-    def update(self, x):   
-        self.cp_detected = False
-        
+    def step(self, x):   
         if self.t == self.length - 1:
             self.expand_matrix()
                       
         t  = self.t
         
-        predprobs = np.round(self.observation_likelihood.pdf(x), 16)
+        log_pred = self.observation_likelihood.logpdf(x)
         # Evaluate the hazard function for this interval
-        H = self.H(np.array(range(t + 1)))
+        H = self.H(np.arange(t + 1))
 
         # Evaluate the growth probabilities - shift the probabilities down and to
         # the right, scaled by the hazard function and the predictive
         # probabilities.
-        self.R[1 : t + 2, t + 1] = self.R[0 : t + 1, t] * predprobs * (1 - H)
+        log_growth = self.log_r + log_pred
+        log_r = np.empty(t + 2)
+        log_r[1:] = log_growth + np.log1p(-H)
 
         # Evaluate the probability that there *was* a changepoint and we're
         # accumulating the mass back down at r = 0.
-        self.R[0, t + 1] = np.sum(self.R[0    : t + 1, t] * predprobs * H)
+        log_r[0] = logsumexp(log_growth + np.log(H))
 
-        # Renormalize the run length probabilities for improved numerical
-        # stability.
-        self.R[:, t + 1] = self.R[:, t + 1] / np.sum(self.R[:, t + 1])
+        # Renormalize the run length probabilities
+        log_r -= logsumexp(log_r)
+        self.log_r = log_r
+        self.R[: t + 2, t + 1] = np.exp(log_r)
         
         # Update the parameter sets for each possible run length.
         self.observation_likelihood.update_theta(x)    
         
-        cp = self.R[1, t]
-        self.cp_probs.append(cp)                         
-        if cp > 0.35:
-            if not t == 1:
-                self.changepoints.append(t)
-                self.cp_detected = True
-                print(f'cp detected at index {self.t}, value {x}')                   
-        
-        self.t += 1                                
+        return self.R[1, t]
+
+
+class TruncatedBOCD(BaseBOCD):
+    ''' BOCD with the run length posterior kept in a fixed size buffer '''
+
+    def __init__(self, hazard_function, observation_likelihood, max_run_length, threshold = 0.0,
+                 cp_threshold = 0.35):
+        if max_run_length < 2:
+            raise ValueError('max_run_length must be at least 2')
+        self.t = 0
+        # R[r] is the probability of the current run length being r, only
+        # the first n entries are active. The recursion runs on log_R
+        self.R = np.zeros(max_run_length)
+        self.R[0] = 1
+        self.log_R = np.full(max_run_length, -np.inf)
+        self.log_R[0] = 0
+        self.n = 1
+        self.H = hazard_function
+        self.observation_likelihood = observation_likelihood
+        self.run_lengths = np.arange(max_run_length)
+        H = hazard_function(self.run_lengths)
+        self.log_H = np.log(H)
+        self.log_1mH = np.log1p(-H)
+        self.log_growth = np.empty(max_run_length)
+        self.tmp = np.empty(max_run_length)
+        self.changepoints = []
+        self.cp_probs = []
+        self.length = max_run_length
+        self.threshold = threshold
+        self.cp_threshold = cp_threshold
+        self.cp_detected = False
+
+    def map_run_length(self):
+        return int(self.log_R[: self.n].argmax())
+
+    def step(self, x):
+        n = self.n
+        R = self.R
+        log_R = self.log_R
+
+        # same quantity as BOCD.R[1, t]
+        cp = R[1] if n > 1 else 0.0
+
+        log_pred = self.observation_likelihood.logpdf(x)
+        log_growth = self.log_growth[:n]
+        np.add(log_R[:n], log_pred, out = log_growth)
+
+        tmp = self.tmp[:n]
+        np.add(log_growth, self.log_H[:n], out = tmp)
+        log_cp = logsumexp(tmp)
+
+        capped = n == self.length
+        if capped:
+            # Runs can't grow past max_run_length, the two longest runs are
+            # merged into the last slot
+            m = n
+            np.add(log_growth[: m - 1], self.log_1mH[: m - 1], out = log_R[1 : m])
+            log_R[m - 1] = np.logaddexp(log_R[m - 1], log_growth[m - 1] + self.log_1mH[m - 1])
+        else:
+            m = n + 1
+            np.add(log_growth, self.log_1mH[:n], out = log_R[1 : m])
+        log_R[0] = log_cp
+        log_R[:m] -= logsumexp(log_R[:m])
+
+        # Drop unlikely long runs from the tail of the posterior
+        if self.threshold > 0:
+            log_threshold = math.log(self.threshold)
+            k = m
+            while k > 1 and log_R[k - 1] < log_threshold:
+                k -= 1
+            if k < m:
+                log_R[k : m] = -np.inf
+                log_R[:k] -= logsumexp(log_R[:k])
+                m = k
+        np.exp(log_R[:m], out = R[:m])
+        R[m : n] = 0
+        self.n = m
+
+        self.observation_likelihood.update_theta(x)
+        self.observation_likelihood.prune(m, capped and m == n)
+
+        return cp
         
         
+class BOCDBank:
+    ''' Truncated BOCD with a StudentT model for several series at once. Takes
+    one value per series on each update and keeps a stacked
+    (n_series, max_run_length) posterior, so all series are updated with
+    the same handful of NumPy operations '''
+
+    def __init__(self, hazard_function, n_series, max_run_length, alpha, beta, kappa, mu,
+                 cp_threshold = 0.35):
+        if max_run_length < 2:
+            raise ValueError('max_run_length must be at least 2')
+        # Hyperparameters are scalars or one value per series
+        hyper = [np.broadcast_to(np.asarray(p, dtype = np.float64), (n_series,))
+                 for p in (mu, kappa, alpha, beta)]
+        self.prior = np.array(hyper + [gammaln(hyper[2] + 0.5) - gammaln(hyper[2])])
+        self.t = 0
+        self.n = 1
+        self.n_series = n_series
+        self.length = max_run_length
+        self.R = np.zeros((n_series, max_run_length))
+        self.R[:, 0] = 1
+        self.log_R = np.full((n_series, max_run_length), -np.inf)
+        self.log_R[:, 0] = 0
+        H = hazard_function(np.arange(max_run_length))
+        self.log_H = np.log(H)
+        self.log_1mH = np.log1p(-H)
+
+        # Rows are mu, kappa, alpha, beta, lg as in PreallocatedStudentT, run
+        # length r of every series lives in column head + r
+        capacity = max_run_length + 1
+        self.theta = np.empty((5, n_series, 2 * capacity))
+        self.tmp = np.empty((n_series, capacity))
+        self.tmp2 = np.empty((n_series, capacity))
+        self.capacity = capacity
+        self.head = capacity
+        self.theta[:, :, self.head] = self.prior
+
+        self.cp_threshold = cp_threshold
+        self.changepoints = [[] for _ in range(n_series)]
+        self.cp_probs = []
+        self.cp_detected = np.zeros(n_series, dtype = bool)
+
+    def logpdf(self, x):
+        ''' Log predictive density of x[i] under every run length of series i '''
+        n = self.n
+        mu, kappa, alpha, beta, lg = self.theta[:, :, self.head : self.head + n]
+        w = self.tmp[:, :n]
+        z = self.tmp2[:, :n]
+
+        np.add(kappa, 1., out = w)
+        np.multiply(w, beta, out = w)
+        np.divide(w, kappa, out = w)
+        np.multiply(w, 2., out = w)
+
+        np.subtract(x[:, None], mu, out = z)
+        np.square(z, out = z)
+        np.divide(z, w, out = z)
+        np.log1p(z, out = z)
+
+        np.multiply(w, np.pi, out = w)
+        np.log(w, out = w)
+        np.multiply(w, 0.5, out = w)
+
+        logp = np.add(alpha, 0.5)
+        np.multiply(logp, z, out = logp)
+        np.add(logp, w, out = logp)
+        np.subtract(lg, logp, out = logp)
+        return logp
+
+    def update_theta(self, x):
+        n = self.n
+        if self.head == 0:
+            head = self.capacity
+            self.theta[:, :, head : head + n] = self.theta[:, :, : n]
+            self.head = head
+
+        mu, kappa, alpha, beta, lg = self.theta[:, :, self.head : self.head + n]
+        tmp = self.tmp[:, :n]
+        x = x[:, None]
+
+        np.log(alpha, out = tmp)
+        np.subtract(tmp, lg, out = lg)
+
+        np.subtract(x, mu, out = tmp)
+        np.square(tmp, out = tmp)
+        np.multiply(tmp, kappa, out = tmp)
+        np.add(kappa, 1., out = kappa)
+        np.divide(tmp, kappa, out = tmp)
+        np.multiply(tmp, 0.5, out = tmp)
+        np.add(beta, tmp, out = beta)
+
+        np.subtract(x, mu, out = tmp)
+        np.divide(tmp, kappa, out = tmp)
+        np.add(mu, tmp, out = mu)
+
+        np.add(alpha, 0.5, out = alpha)
+
+        self.head -= 1
+        self.theta[:, :, self.head] = self.prior
+
+    def step(self, x):
+        ''' Update every posterior with x, returns the cp probability per series '''
+        n = self.n
+        log_R = self.log_R
+
+        # same quantity as BOCD.R[1, t]
+        cp = self.R[:, 1].copy()
+
+        log_growth = self.logpdf(x)
+        np.add(log_growth, log_R[:, :n], out = log_growth)
+        log_cp = logsumexp_rows(log_growth + self.log_H[:n])
+
+        capped = n == self.length
+        if capped:
+            m = n
+            np.add(log_growth[:, : m - 1], self.log_1mH[: m - 1], out = log_R[:, 1 : m])
+            np.logaddexp(log_R[:, m - 1], log_growth[:, m - 1] + self.log_1mH[m - 1],
+                         out = log_R[:, m - 1])
+        else:
+            m = n + 1
+            np.add(log_growth, self.log_1mH[:n], out = log_R[:, 1 : m])
+        log_R[:, 0] = log_cp
+        log_R[:, :m] -= logsumexp_rows(log_R[:, :m])[:, None]
+        np.exp(log_R[:, :m], out = self.R[:, :m])
+
+        self.update_theta(x)
+        if capped:
+            # the longest run takes the place of the last kept one
+            self.theta[:, :, self.head + m - 1] = self.theta[:, :, self.head + m]
+        self.n = m
+        return cp
+
+    def update(self, x):
+        x = np.asarray(x, dtype = np.float64)
+        t = self.t
+        cp = self.step(x)
+        self.cp_probs.append(cp)
+        self.cp_detected = cp > self.cp_threshold
+        if t == 1:
+            self.cp_detected[:] = False
+        for i in np.flatnonzero(self.cp_detected):
+            self.changepoints[i].append(t)
+        self.t += 1
+
+    def fit(self, data):
+        ''' Run the bank over a (time, n_series) array, returns the
+        (time, n_series) cp probabilities and the boolean detections '''
+        data = np.asarray(data, dtype = np.float64)
+        t0 = self.t
+        cp_probs = np.empty(data.shape)
+        for i in range(len(data)):
+            cp_probs[i] = self.step(data[i])
+            self.t += 1
+        detected = cp_probs > self.cp_threshold
+        if t0 <= 1 < self.t:
+            detected[1 - t0] = False
+        for i in range(self.n_series):
+            self.changepoints[i].extend((np.flatnonzero(detected[:, i]) + t0).tolist())
+        self.cp_probs.extend(cp_probs)
+        if len(data):
+            self.cp_detected = detected[-1].copy()
+        return cp_probs, detected
+
+
 def generate_normal_time_series(num, minl=50, maxl=1000):
     data = np.array([], dtype=np.float64)
     partition = np.random.randint(minl, maxl, num)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:31:44 2026
+
+@author: alex shakaev
+"""
+
+''' Option chains indexed by strike, cached in memory and on disk '''
+
+import os
+import time
+
+import numpy as np
+
+def monthly_expiries(calendar, start, end, months_ahead = 3):
+    ''' Third Fridays at 16:00 of every month from start until months_ahead
+    months past end, as datetime64[s] '''
+    first = np.datetime64(start, 'M')
+    last = np.datetime64(end, 'M') + months_ahead
+    months = np.arange(first, last + 1)
+    return np.array([calendar.third_friday_of_month(int(str(m)[5:7]), int(str(m)[:4])).astype('M8[s]')
+                     + np.timedelta64(16, 'h') for m in months])
+
+class OptionChain:
+    ''' Strikes of one (symbol, expiry, right) sorted ascending, with their
+    conIds and local symbols in the same order and a strike -> conId dict '''
+
+    def __init__(self, symbol, expiry, right, strikes, con_ids, local_symbols = None, fetched = None):
+        self.symbol = symbol
+        self.expiry = expiry
+        self.right = right
+        order = np.argsort(np.asarray(strikes, dtype = 'f8'), kind = 'stable')
+        self.strikes = np.asarray(strikes, dtype = 'f8')[order]
+        self.con_ids = np.asarray(con_ids, dtype = 'i8')[order]
+        self.local_symbols = (np.asarray(local_symbols, dtype = str)[order] if local_symbols is not None
+                              else np.full(len(order), '', dtype = str))
+        self.fetched = time.time() if fetched is None else fetched
+        self.index = dict(zip(self.strikes.tolist(), self.con_ids.tolist()))
+
+    @classmethod
+    def from_frame(cls, symbol, expiry, right, chain):
+        ''' Build from client.chain, one row per contract '''
+        chain = chain.drop_duplicates(subset = ['con_id'])
+        return cls(symbol, expiry, right, chain['strike'].values, chain['con_id'].values, chain['symbol'].values)
+
+    def key(self):
+        return (self.symbol, self.expiry, self.right)
+
+    def __len__(self):
+        return len(self.strikes)
+
+    def __contains__(self, strike):
+        return float(strike) in self.index
+
+    def con_id(self, strike):
+        return self.index[float(strike)]
+
+    def closest(self, price):
+        ''' Listed strike nearest to price, the lower one on a tie '''
+        i = np.searchsorted(self.strikes, price)
+        if i == len(self.strikes) or (i > 0 and price - self.strikes[i - 1] <= self.strikes[i] - price):
+            i -= 1
+        return self.strikes[i]
+
+    def floor(self, price):
+        ''' Highest listed strike at or below price '''
+        i = np.searchsorted(self.strikes, price, side = 'right')
+        if i == 0:
+            raise KeyError(f'no strike at or below {price}')
+        return self.strikes[i - 1]
+
+class ChainCache:
+    ''' Chains keyed by (symbol, expiry, right), each kept in one .npz file
+    under path. A chain older than ttl seconds is treated as missing so it
+    is downloaded again '''
+
+    def __init__(self, path = 'data/chains', ttl = 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.chains = {}
+
+    def file(self, key):
+        return os.path.join(self.path, '{}_{}_{}.npz'.format(*key))
+
+    def fresh(self, chain):
+        return chain is not None and time.time() - chain.fetched < self.ttl
+
+    def get(self, key):
+        ''' The cached chain of key if it is fresh, else None '''
+        chain = self.chains.get(key)
+        if chain is None and os.path.exists(self.file(key)):
+            with np.load(self.file(key)) as f:
+                chain = OptionChain(*key, f['strike'], f['con_id'], f['local_symbol'], float(f['fetched']))
+            self.chains[key] = chain
+        return chain if self.fresh(chain) else None
+
+    def put(self, chain):
+        self.chains[chain.key()] = chain
+        os.makedirs(self.path, exist_ok = True)
+        # written aside and renamed so a reader never sees half a file
+        path = self.file(chain.key())
+        np.savez(path + '.tmp.npz', strike = chain.strikes, con_id = chain.con_ids,
+                 local_symbol = chain.local_symbols, fetched = chain.fetched)
+        os.replace(path + '.tmp.npz', path)
+
+    def invalidate(self, key):
+        self.chains.pop(key, None)
+        if os.path.exists(self.file(key)):
+            os.remove(self.file(key))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:48:20 2026
+
+@author: alex shakaev
+"""
+
+''' Moves Client callbacks off the thread that decodes TWS messages '''
+
+import queue
+import time
+from threading import Thread, Lock
+
+# Callbacks about orders and their fills. They don't all lead with the order
+# id, execDetails has reqId -1 and commissionReport only an execId, so they
+# all go to the first worker to be applied in the order TWS sent them
+order_callbacks = { 'nextValidId', 'openOrder', 'openOrderEnd', 'orderStatus', 'orderBound',
+                    'execDetails', 'execDetailsEnd', 'commissionReport',
+                    'completedOrder', 'completedOrdersEnd' }
+
+class DispatchStats:
+    ''' Queue lag and processing time of one worker, in seconds '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.processed = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.busy = 0.0
+
+    def record(self, lag, busy):
+        with self.lock:
+            self.processed += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            self.busy += busy
+
+class Dispatcher:
+    ''' Replaces the given callbacks of client with stubs that only put
+    (name, args, time) on a bounded queue, so the reader thread goes straight
+    back to decoding. Worker threads apply the callbacks to client state.
+    With several workers events are sharded by their first argument when it
+    is an int reqId, which keeps each request's callbacks in order. Order
+    callbacks, errors about orders of client.orders and everything else go
+    to the first worker. A full queue blocks the reader rather than
+    dropping events '''
+
+    def __init__(self, client, names, n_workers = 1, maxsize = 10000):
+        self.client = client
+        self.queues = [queue.Queue(maxsize) for _ in range(n_workers)]
+        self.stats = [DispatchStats() for _ in range(n_workers)]
+        self.callbacks = { name : getattr(client, name) for name in names }
+        for name in names:
+            setattr(client, name, self.stub(name))
+        for i in range(n_workers):
+            Thread(target = self.work, args = (i,), daemon = True).start()
+
+    def stub(self, name):
+        queues = self.queues
+        n_workers = len(queues)
+        stats = self.stats
+        ordered = name in order_callbacks
+        orders = self.client.orders.orders if name == 'error' else {}
+        def enqueue(*args):
+            i = (args[0] % n_workers if n_workers > 1 and not ordered and args and type(args[0]) is int
+                 and args[0] not in orders else 0)
+            q = queues[i]
+            q.put((name, args, time.perf_counter()))
+            depth = q.qsize()
+            if depth > stats[i].max_depth:
+                stats[i].max_depth = depth
+        return enqueue
+
+    def work(self, i):
+        q = self.queues[i]
+        stats = self.stats[i]
+        callbacks = self.callbacks
+        while True:
+            name, args, stamp = q.get()
+            start = time.perf_counter()
+            try:
+                callbacks[name](*args)
+            except Exception as e:
+                # a failing callback must not stop the worker
+                print(f'Error in {name} callback: {e!r}')
+            stats.record(start - stamp, time.perf_counter() - start)
+
+    def depth(self):
+        ''' Events waiting to be processed '''
+        return sum(q.qsize() for q in self.queues)
+
+    def metrics(self):
+        ''' Queue depth, lag between decoding and processing and worker busy
+        time, summed or maxed over the workers '''
+        processed = sum(s.processed for s in self.stats)
+        return { 'depth' : self.depth(),
+                 'max_depth' : max(s.max_depth for s in self.stats),
+                 'processed' : processed,
+                 'last_lag' : max(s.last_lag for s in self.stats),
+                 'max_lag' : max(s.max_lag for s in self.stats),
+                 'mean_lag' : sum(s.total_lag for s in self.stats) / processed if processed else 0.0,
+                 'busy' : sum(s.busy for s in self.stats) }
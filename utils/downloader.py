@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:20:05 2026
+
+@author: alex shakaev
+"""
+
+''' Chunked historical data download that respects IB pacing limits and resumes '''
+
+import os
+import time
+import queue
+from threading import Lock
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from utils.bar_store import parse_ib_dates
+from utils.async_client import is_warning
+
+class TokenBucket:
+    ''' Allows bursts of capacity requests, refilled at rate requests per second '''
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.lock = Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self):
+        ''' Seconds until a token is available '''
+        with self.lock:
+            self.refill()
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+
+def acquire(buckets):
+    ''' Block until every bucket has a token, then take them '''
+    while True:
+        wait = max(bucket.wait_time() for bucket in buckets)
+        if wait <= 0:
+            for bucket in buckets:
+                bucket.take()
+            return
+        time.sleep(wait)
+
+# IB allows 60 historical requests in any 10 minutes and 6 within 2 seconds for
+# the same contract. A burst of 6 refilled at 54 per 10 minutes stays within both
+def ib_pacing():
+    return [TokenBucket(6, 54 / 600)]
+
+class HistoricalDownloader:
+    ''' Splits [start, end) into chunks of chunk_days trading days and
+    downloads them with up to max_in_flight requests open at once. IB counts
+    the days of a duration in trading days, busdaycal (a np.busdaycalendar)
+    tells which those are, weekdays when not given. Its holidays keep
+    neighbouring chunks from overlapping. Implied vol is requested for
+    every chunk alongside the bars. Completed chunks are checkpointed next
+    to the store and written to it in date order, so an interrupted download
+    resumes where it stopped '''
+
+    def __init__(self, client, store, contract, start, end, bar_size = '2 mins',
+                 chunk_days = 5, busdaycal = None, what_to_show = 'TRADES', implied_vol = True,
+                 use_rth = 1, max_in_flight = 6, buckets = None, timeout = 120,
+                 retries = 3, req_id_start = 1000):
+        self.client = client
+        self.store = store
+        self.contract = contract
+        self.bar_size = bar_size
+        self.use_rth = use_rth
+        self.max_in_flight = max_in_flight
+        self.buckets = buckets if buckets is not None else ib_pacing()
+        self.timeout = timeout
+        self.retries = retries
+        self.next_req_id = req_id_start
+        self.what = [what_to_show] + (['OPTION_IMPLIED_VOLATILITY'] if implied_vol else [])
+        self.checkpoint_dir = os.path.join(store.path, 'download')
+        os.makedirs(self.checkpoint_dir, exist_ok = True)
+
+        # chunk ends, oldest first. Each chunk starts at the midnight
+        # chunk_days trading days back, which is where the one before ends
+        self.chunk_days = chunk_days
+        self.busdaycal = busdaycal if busdaycal is not None else np.busdaycalendar()
+        self.ends = []
+        chunk_end = end
+        while chunk_end > start:
+            self.ends.append(chunk_end)
+            day = np.datetime64(chunk_end, 'D')
+            if np.datetime64(chunk_end) > day:
+                day += 1 # the session of chunk_end is one of the days
+            day = np.busday_offset(day, -chunk_days, roll = 'forward', busdaycal = self.busdaycal)
+            chunk_end = day.astype('M8[s]').item()
+        self.ends.reverse()
+
+        self.events = queue.Queue()
+        self.bars = {}      # req_id -> list of bars
+        self.requests = {}  # req_id -> (chunk, what)
+        self.results = {}   # chunk -> {what : bars}
+        self.cancelled = set() # timed out req_ids, dropped until their end or error
+        self.errors = []
+
+    def checkpoint_file(self, chunk):
+        return os.path.join(self.checkpoint_dir, f'{self.ends[chunk]:%Y%m%d-%H%M%S}.npz')
+
+    def load_checkpoints(self):
+        ''' Chunks completed by an earlier run that are not in the store yet '''
+        for chunk in range(len(self.ends)):
+            path = self.checkpoint_file(chunk)
+            if os.path.exists(path):
+                with np.load(path) as f:
+                    self.results[chunk] = { what : f[what] for what in self.what }
+
+    def save_checkpoint(self, chunk):
+        np.savez(self.checkpoint_file(chunk), **self.results[chunk])
+
+    # callbacks, called from the client thread
+
+    def historicalData(self, req_id, bar):
+        bars = self.bars.get(req_id)
+        if bars is not None:
+            bars.append((bar.date, bar.open, bar.high, bar.low, bar.close, float(bar.volume)))
+
+    def historicalDataEnd(self, req_id, start, end):
+        if not self.release(req_id):
+            self.events.put(('end', req_id, None))
+
+    def error(self, req_id, error_code, error_string):
+        if is_warning(error_code) or self.release(req_id):
+            return
+        self.events.put(('error', req_id, (error_code, error_string)))
+
+    def release(self, req_id):
+        ''' True if req_id timed out, it is then unregistered as its last
+        callback has arrived '''
+        if req_id not in self.cancelled:
+            return False
+        self.cancelled.discard(req_id)
+        self.client.req_handlers.pop(req_id, None)
+        return True
+
+    # scheduler
+
+    def send(self, chunk, what):
+        acquire(self.buckets)
+        req_id = self.next_req_id
+        self.next_req_id += 1
+        self.bars[req_id] = []
+        self.requests[req_id] = (chunk, what, time.monotonic())
+        self.client.req_handlers[req_id] = self
+        end = self.ends[chunk].strftime('%Y%m%d %H:%M:%S') + ' US/Eastern'
+        self.client.reqHistoricalData(req_id, self.contract, end, f'{self.chunk_days} D',
+                                      self.bar_size, what, self.use_rth, 1, False, [])
+
+    def finish(self, req_id):
+        chunk, what, _ = self.requests.pop(req_id)
+        self.client.req_handlers.pop(req_id, None)
+        return chunk, what, self.bars.pop(req_id)
+
+    def abandon(self, req_id):
+        ''' Cancel a request that did not answer in time. The downloader stays
+        its handler, so bars still on the way are dropped instead of reaching
+        the client tables '''
+        self.cancelled.add(req_id)
+        chunk, what, _ = self.requests.pop(req_id)
+        self.bars.pop(req_id)
+        self.client.cancelHistoricalData(req_id)
+        return chunk, what
+
+    def flush(self, first):
+        ''' Append completed chunks to the store in date order '''
+        while first < len(self.ends) and len(self.results.get(first, {})) == len(self.what):
+            result = self.results.pop(first)
+            bars = result[self.what[0]]
+            if len(bars):
+                bars = { 'date' : bars['date'], 'o' : bars['o'], 'h' : bars['h'],
+                         'l' : bars['l'], 'c' : bars['c'], 'v' : bars['v'] }
+                if len(self.what) > 1:
+                    # implied vol bars matched on date
+                    iv = result[self.what[1]]
+                    ind = np.searchsorted(iv['date'], bars['date'])
+                    found = ind < len(iv)
+                    found[found] = iv['date'][ind[found]] == bars['date'][found]
+                    bars['iv'] = np.full(len(ind), np.nan)
+                    bars['iv'][found] = iv['c'][ind[found]]
+                self.store.append(bars)
+            path = self.checkpoint_file(first)
+            if os.path.exists(path):
+                os.remove(path)
+            first += 1
+        return first
+
+    def to_array(self, bars):
+        dates = parse_ib_dates([b[0] for b in bars]) if bars else np.empty(0, dtype = 'M8[s]')
+        values = np.array([b[1:] for b in bars], dtype = np.float64).reshape(-1, 5)
+        arr = np.empty(len(bars), dtype = [('date', 'M8[s]'), ('o', 'f8'), ('h', 'f8'),
+                                           ('l', 'f8'), ('c', 'f8'), ('v', 'f8')])
+        arr['date'] = dates
+        for i, name in enumerate(['o', 'h', 'l', 'c', 'v']):
+            arr[name] = values[:, i]
+        return np.sort(arr, order = 'date')
+
+    def run(self):
+        ''' Download all chunks not yet in the store, returns the number of chunks written '''
+        last = self.store.last_date()
+        first = 0
+        if last is not None:
+            last = last.astype(datetime)
+            while first < len(self.ends) and self.ends[first] <= last:
+                first += 1
+        start_chunk = first
+        self.load_checkpoints()
+
+        todo = [(chunk, what) for chunk in range(first, len(self.ends)) for what in self.what
+                if what not in self.results.get(chunk, {})]
+        todo.reverse()
+        attempts = {}
+
+        while todo or self.requests:
+            while todo and len(self.requests) < self.max_in_flight:
+                self.send(*todo.pop())
+
+            try:
+                kind, req_id, info = self.events.get(timeout = 1)
+            except queue.Empty:
+                # give up on requests that never answered and send them again
+                now = time.monotonic()
+                for req_id, (chunk, what, sent) in list(self.requests.items()):
+                    if now - sent > self.timeout:
+                        todo.append(self.abandon(req_id))
+                continue
+
+            if req_id not in self.requests:
+                continue
+            if kind == 'end':
+                chunk, what, bars = self.finish(req_id)
+                self.results.setdefault(chunk, {})[what] = self.to_array(bars)
+                if len(self.results[chunk]) == len(self.what):
+                    self.save_checkpoint(chunk)
+                first = self.flush(first)
+            else:
+                error_code, error_string = info
+                chunk, what, _ = self.finish(req_id)
+                attempts[chunk, what] = attempts.get((chunk, what), 0) + 1
+                if 'no data' in error_string.lower():
+                    # nothing traded in this chunk, e.g. holidays
+                    self.results.setdefault(chunk, {})[what] = self.to_array([])
+                    first = self.flush(first)
+                elif 'pacing' in error_string.lower() or attempts[chunk, what] <= self.retries:
+                    if 'pacing' in error_string.lower():
+                        time.sleep(10)
+                    todo.append((chunk, what))
+                else:
+                    print(f'Giving up on {what} chunk ending {self.ends[chunk]}: {error_code} {error_string}')
+                    self.errors.append((self.ends[chunk], what, error_code, error_string))
+                    # an empty result keeps the chunks after it flowing into the store
+                    self.results.setdefault(chunk, {})[what] = self.to_array([])
+                    first = self.flush(first)
+
+        return first - start_chunk
+
+if __name__ == "__main__":
+    from utils.spy_client import Client, spy_con
+    from utils.bar_store import BarStore
+
+    client = Client('127.0.0.1', 7497, 0)
+    store = BarStore('data/SPY_2min')
+    end = datetime.now().replace(second = 0, microsecond = 0)
+    downloader = HistoricalDownloader(client, store, spy_con, end - timedelta(days = 182), end)
+    print(f'Wrote {downloader.run()} chunks, {len(store)} bars in store')
+    client.disconnect()
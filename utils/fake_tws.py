@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:02:37 2026
+
+@author: alex shakaev
+"""
+
+''' Local stand in for TWS that speaks the API wire protocol. It serves a
+scripted Scenario and has a firehose mode for callback throughput tests '''
+
+import socket
+import struct
+import time
+from datetime import datetime
+from threading import Thread, Lock, Event
+
+import numpy as np
+
+from ibapi.comm import make_field, read_msg, read_fields
+from ibapi.contract import Contract, ComboLeg
+from ibapi.message import IN, OUT
+
+from utils.quotes import contract_key
+
+# Message layouts below follow this version. It is recent enough for
+# keepUpToDate
+SERVER_VERSION = 151
+# openOrder carries this many fields after the limit price at SERVER_VERSION,
+# the order state status being one of them
+OPEN_ORDER_TAIL = 103
+OPEN_ORDER_STATUS = 69
+
+# durationStr units of historical data requests, days are counted apart
+durations = { 'S' : np.timedelta64(1, 's'), 'W' : np.timedelta64(7, 'D') }
+
+def window_start(end, count, unit):
+    ''' Start of a durationStr window ending at end. As IB does, N D means N
+    trading days, the day of end being one of them unless end is its midnight '''
+    if unit != 'D':
+        return end - count * durations[unit]
+    day = end.astype('M8[D]')
+    if end > day:
+        day += 1
+    return np.busday_offset(day, -count, roll = 'forward').astype('M8[s]')
+
+def message(*fields):
+    ''' Length prefixed message of null terminated fields '''
+    text = ''.join(make_field(field) for field in fields).encode()
+    return struct.pack('!I', len(text)) + text
+
+def ib_time(dt):
+    return dt.strftime('%Y%m%d %H:%M:%S')
+
+def execution_message(req_id, order_id, con, side, shares, price, exec_id, when, account):
+    return message(IN.EXECUTION_DATA, req_id, order_id, con.conId, con.symbol, con.secType,
+                   con.lastTradeDateOrContractMonth, con.strike, con.right, con.multiplier,
+                   con.exchange or 'BOX', con.currency, con.localSymbol, con.tradingClass,
+                   exec_id, when.strftime('%Y%m%d  %H:%M:%S'), account, 'BOX',
+                   side, shares, price, order_id, 0, 0, shares, price, '', '', '', '', 0)
+
+class Scenario:
+    ''' What the fake TWS answers with.
+
+    bars         dict of arrays (date, o, h, l, c, v) served to historical data
+                 requests, or a dict of them by symbol. Bars from history on
+                 are streamed to keepUpToDate requests, one every
+                 stream_interval seconds
+    chain        list of dicts (symbol, expiry, strike, con_id, right) served
+                 to contract details requests for the first word of symbol
+    quotes       contract_key -> dict(bid, ask, last), default_quote otherwise
+    executions   list of dicts replayed to execution requests
+    positions    con_id -> position, with the contract taken from the chain
+    delays       seconds each historical data request waits for its answer,
+                 in request order, later requests are answered at once
+
+    Limit orders fill at once if marketable against the quote of their
+    contract, otherwise they work until modified into the market '''
+
+    def __init__(self, bars = None, history = None, stream_interval = 0.05, chain = None,
+                 quotes = None, default_quote = None, executions = None, positions = None,
+                 funds = 100000.0, account = 'DU0000001', commission = 0.65, delays = None):
+        self.bars = bars
+        self.history = history
+        self.stream_interval = stream_interval
+        self.chain = chain or []
+        self.quotes = quotes or {}
+        self.default_quote = default_quote or { 'bid' : 1.0, 'ask' : 1.1, 'last' : 1.05 }
+        self.executions = executions or []
+        self.positions = positions or {}
+        self.funds = funds
+        self.account = account
+        self.commission = commission
+        self.delays = list(delays or [])
+
+    @classmethod
+    def from_store(cls, store, start = None, end = None, history = None, **kwargs):
+        ''' Scenario serving recorded bars from a BarStore '''
+        bars = { name : np.array(values) for name, values
+                 in store.arrays(start, end, ['date', 'o', 'h', 'l', 'c', 'v']).items() }
+        return cls(bars, history, **kwargs)
+
+    def bars_of(self, symbol):
+        ''' Bars served for symbol, None if there are none '''
+        if self.bars is None or 'date' in self.bars:
+            return self.bars
+        return self.bars.get(symbol)
+
+    def start(self, bars):
+        ''' Number of bars sent as history, the rest are streamed '''
+        return len(bars['date']) if self.history is None else self.history
+
+    def quote(self, key):
+        return self.quotes.get(key, self.default_quote)
+
+    def contract(self, con_id):
+        con = Contract()
+        con.conId = con_id
+        for item in self.chain:
+            if item['con_id'] == con_id:
+                con.symbol = item['symbol'].split()[0]
+                con.secType = 'OPT'
+                con.lastTradeDateOrContractMonth = item['expiry']
+                con.strike = item['strike']
+                con.right = item.get('right', 'C')
+                con.currency = 'USD'
+                con.localSymbol = item['symbol']
+        return con
+
+class Session:
+    ''' One API connection '''
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.scenario = server.scenario
+        self.sock = sock
+        self.send_lock = Lock()
+        self.closed = Event()
+        self.next_order_id = server.next_order_id
+        self.next_exec_id = 0
+        self.orders = {}
+        self.account_updates = False
+        self.streams = {}
+        self.handlers = { OUT.START_API : self.start_api, OUT.REQ_IDS : self.req_ids,
+                          OUT.REQ_CURRENT_TIME : self.req_current_time,
+                          OUT.REQ_ACCOUNT_SUMMARY : self.req_account_summary,
+                          OUT.REQ_ACCT_DATA : self.req_account_updates,
+                          OUT.REQ_EXECUTIONS : self.req_executions,
+                          OUT.REQ_CONTRACT_DATA : self.req_contract_details,
+                          OUT.REQ_MKT_DATA : self.req_mkt_data,
+                          OUT.REQ_HISTORICAL_DATA : self.req_historical_data,
+                          OUT.CANCEL_HISTORICAL_DATA : self.cancel_historical_data,
+                          OUT.PLACE_ORDER : self.place_order, OUT.CANCEL_ORDER : self.cancel_order,
+                          OUT.REQ_GLOBAL_CANCEL : self.global_cancel }
+
+    def send(self, data):
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def send_after(self, delay, data):
+        ''' Send data delay seconds from now unless the connection closed by then '''
+        if not delay:
+            self.send(data)
+            return
+        def send():
+            if not self.closed.wait(delay):
+                self.send(data)
+        Thread(target = send, daemon = True).start()
+
+    def serve(self):
+        buf = b''
+        try:
+            while len(buf) < 4:
+                buf += self.sock.recv(4096)
+            assert buf[:4] == b'API\0', 'not an API client'
+            buf = buf[4:]
+            handshake = True
+            while True:
+                size, text, rest = read_msg(buf)
+                if len(buf) < 4 or len(buf) - 4 < size:
+                    chunk = self.sock.recv(65536)
+                    if not chunk:
+                        break
+                    buf += chunk
+                    continue
+                buf = rest
+                if handshake:
+                    # "v100..157" without a terminator, answer with the version we speak and the time
+                    client_max = int(text.decode().split('..')[-1].split()[0])
+                    self.version = min(SERVER_VERSION, client_max)
+                    self.send(message(self.version, ib_time(datetime.now()) + ' EST'))
+                    handshake = False
+                    continue
+                fields = [field.decode() for field in read_fields(text)]
+                handler = self.handlers.get(int(fields[0]))
+                if handler is not None:
+                    handler(fields)
+        except (OSError, AssertionError):
+            pass
+        finally:
+            self.closed.set()
+            self.sock.close()
+
+    # helpers
+
+    @staticmethod
+    def parse_contract(fields, i, legs_at = None, leg_width = 4):
+        ''' Contract from the conId, symbol, ... fields starting at i. Combo
+        legs start at legs_at with leg_width fields each '''
+        con = Contract()
+        con.conId = int(fields[i] or 0)
+        con.symbol, con.secType, con.lastTradeDateOrContractMonth = fields[i + 1 : i + 4]
+        con.strike = float(fields[i + 4] or 0)
+        con.right, con.multiplier, con.exchange, con.primaryExchange, con.currency, con.localSymbol = fields[i + 5 : i + 11]
+        if con.secType == 'BAG' and legs_at is not None:
+            con.comboLegs = []
+            for k in range(int(fields[legs_at])):
+                leg = ComboLeg()
+                j = legs_at + 1 + k * leg_width
+                leg.conId, leg.ratio, leg.action = int(fields[j]), int(fields[j + 1]), fields[j + 2]
+                con.comboLegs.append(leg)
+        return con
+
+    def tick(self, req_id, tick_type, price):
+        return message(IN.TICK_PRICE, 6, req_id, tick_type, price, 1, 0)
+
+    def open_order(self, order, status):
+        ''' openOrder with the contract, action, quantity, type and limit of
+        the order, its other fields left empty '''
+        con = order['contract']
+        tail = [''] * OPEN_ORDER_TAIL
+        tail[OPEN_ORDER_STATUS] = status
+        return message(IN.OPEN_ORDER, order['id'], con.conId, con.symbol, con.secType,
+                       con.lastTradeDateOrContractMonth, con.strike, con.right, con.multiplier,
+                       con.exchange, con.currency, con.localSymbol, con.tradingClass,
+                       order['action'], order['qty'], order['type'], order['lmt'], *tail)
+
+    def order_status(self, order, status):
+        filled = order['qty'] if status == 'Filled' else 0
+        return message(IN.ORDER_STATUS, order['id'], status, filled, order['qty'] - filled,
+                       order['fill'] if filled else 0, order['id'], 0, order['fill'] if filled else 0,
+                       0, '', 0)
+
+    def execution(self, req_id, order_id, con, side, shares, price, exec_id, when):
+        return execution_message(req_id, order_id, con, side, shares, price, exec_id, when,
+                                 self.scenario.account)
+
+    def portfolio(self, con_id, position):
+        con = self.scenario.contract(con_id)
+        return message(IN.PORTFOLIO_VALUE, 8, con.conId, con.symbol, con.secType,
+                       con.lastTradeDateOrContractMonth, con.strike, con.right, '100', '', 'USD',
+                       con.localSymbol, con.symbol, position, 1.0, 100.0 * position, 100.0, 0.0, 0.0,
+                       self.scenario.account)
+
+    # requests
+
+    def start_api(self, fields):
+        self.send(message(IN.NEXT_VALID_ID, 1, self.next_order_id)
+                  + message(IN.MANAGED_ACCTS, 1, self.scenario.account))
+
+    def req_ids(self, fields):
+        self.send(message(IN.NEXT_VALID_ID, 1, self.next_order_id))
+
+    def req_current_time(self, fields):
+        self.send(message(IN.CURRENT_TIME, 1, int(time.time())))
+
+    def req_account_summary(self, fields):
+        req_id = int(fields[2])
+        self.send(message(IN.ACCOUNT_SUMMARY, 1, req_id, self.scenario.account, 'AvailableFunds',
+                          self.scenario.funds, 'USD')
+                  + message(IN.ACCOUNT_SUMMARY_END, 1, req_id))
+
+    def req_account_updates(self, fields):
+        self.account_updates = fields[2] == '1'
+        if self.account_updates:
+            self.send(b''.join(self.portfolio(con_id, position) for con_id, position
+                               in self.scenario.positions.items())
+                      + message(IN.ACCT_DOWNLOAD_END, 1, self.scenario.account))
+
+    def req_executions(self, fields):
+        req_id = int(fields[2])
+        out = []
+        for e in self.scenario.executions:
+            con = self.scenario.contract(e['con_id']) if 'con_id' in e else e['contract']
+            out.append(self.execution(req_id, e['order_id'], con, e['side'], e['shares'], e['price'],
+                                      e['exec_id'], e['time']))
+            out.append(message(IN.COMMISSION_REPORT, 1, e['exec_id'], e.get('commission', 0.0),
+                               'USD', 0.0, 0.0, 0))
+        self.send(b''.join(out) + message(IN.EXECUTION_DATA_END, 1, req_id))
+
+    def req_contract_details(self, fields):
+        req_id = int(fields[2])
+        symbol = fields[4]
+        out = []
+        for item in self.scenario.chain:
+            underlying = item['symbol'].split()[0]
+            if underlying != symbol:
+                continue
+            out.append(message(IN.CONTRACT_DATA, 8, req_id, underlying, 'OPT',
+                               item['expiry'], item['strike'], item.get('right', 'C'), 'BOX', 'USD',
+                               item['symbol'], underlying, underlying, item['con_id'], 0.01, 1, '100', 'LMT',
+                               'BOX', 1, 0, '', '', '', '', '', '', 'US/Eastern', '', '', '', '',
+                               0, 0, underlying, 'STK', '', ''))
+        self.send(b''.join(out) + message(IN.CONTRACT_DATA_END, 1, req_id))
+
+    def req_mkt_data(self, fields):
+        req_id = int(fields[2])
+        con = self.parse_contract(fields, 3, legs_at = 15)
+        quote = self.scenario.quote(contract_key(con))
+        self.send(self.tick(req_id, 1, quote['bid']) + self.tick(req_id, 2, quote['ask'])
+                  + self.tick(req_id, 4, quote['last']))
+
+    def req_historical_data(self, fields):
+        req_id = int(fields[1])
+        keep_up_to_date = fields[-2] == '1'
+        bars = self.scenario.bars_of(fields[3])
+        if bars is None:
+            self.send(message(IN.ERR_MSG, 2, req_id, 162, 'Historical Market Data Service error message:HMDS query returned no data'))
+            return
+        if fields[15]:
+            # a fixed window ending at endDateTime, the time zone is ignored
+            end = np.datetime64(datetime.strptime(fields[15][:17], '%Y%m%d %H:%M:%S'), 's')
+            count, unit = fields[17].split()
+            i, j = np.searchsorted(bars['date'].astype('M8[s]'), [window_start(end, int(count), unit), end],
+                                   side = 'right')
+            history = { name : values[i : j] for name, values in bars.items() }
+            n = j - i
+        else:
+            history = bars
+            n = self.scenario.start(bars)
+        dates = [ib_time(d) for d in history['date'][:n].astype('M8[s]').astype(datetime)]
+        out = [IN.HISTORICAL_DATA, req_id, dates[0] if dates else '', dates[-1] if dates else '', n]
+        for i in range(n):
+            out += [dates[i], history['o'][i], history['h'][i], history['l'][i], history['c'][i],
+                    int(history['v'][i]), history['c'][i], 1]
+        delay = self.scenario.delays.pop(0) if self.scenario.delays else 0
+        self.send_after(delay, message(*out))
+        if keep_up_to_date:
+            stop = Event()
+            self.streams[req_id] = stop
+            Thread(target = self.stream_bars, args = (req_id, bars, stop), daemon = True).start()
+
+    def stream_bars(self, req_id, bars, stop):
+        for i in range(self.scenario.start(bars), len(bars['date'])):
+            if stop.wait(self.scenario.stream_interval) or self.closed.is_set():
+                return
+            date = ib_time(bars['date'][i].astype('M8[s]').astype(datetime))
+            self.send(message(IN.HISTORICAL_DATA_UPDATE, req_id, 1, date, bars['o'][i], bars['c'][i],
+                              bars['h'][i], bars['l'][i], bars['c'][i], int(bars['v'][i])))
+
+    def cancel_historical_data(self, fields):
+        stop = self.streams.pop(int(fields[2]), None)
+        if stop is not None:
+            stop.set()
+
+    def place_order(self, fields):
+        order_id = int(fields[1])
+        con = self.parse_contract(fields, 2, legs_at = 35, leg_width = 8)
+        order = self.orders.get(order_id) or { 'id' : order_id, 'contract' : con }
+        order.update(action = fields[16], qty = float(fields[17]), type = fields[18],
+                     lmt = float(fields[19] or 0))
+        self.orders[order_id] = order
+        self.next_order_id = max(self.next_order_id, order_id + 1)
+
+        # TWS echoes every placed or modified order in openOrder
+        self.send(self.open_order(order, 'Submitted'))
+        quote = self.scenario.quote(contract_key(con))
+        marketable = (order['lmt'] >= quote['ask'] if order['action'] == 'BUY'
+                      else order['lmt'] <= quote['bid'])
+        if not marketable:
+            self.send(self.order_status(order, 'Submitted'))
+            return
+        order['fill'] = order['lmt']
+        self.fill(order)
+
+    def fill(self, order):
+        con = order['contract']
+        sign = 1 if order['action'] == 'BUY' else -1
+        side = 'BOT' if sign > 0 else 'SLD'
+        now = datetime.now()
+        out = [self.order_status(order, 'Filled')]
+        legs = [(leg.conId, sign * (1 if leg.action == 'BUY' else -1) * leg.ratio)
+                for leg in con.comboLegs or []] if con.secType == 'BAG' else [(con.conId, sign)]
+        for con_id, qty in legs:
+            self.next_exec_id += 1
+            exec_id = f'0000e{self.next_exec_id:04d}.01'
+            leg_con = self.scenario.contract(con_id) if con.secType == 'BAG' else con
+            out.append(self.execution(-1, order['id'], leg_con, 'BOT' if qty > 0 else 'SLD',
+                                      abs(qty) * order['qty'], 0.0, exec_id, now))
+            out.append(message(IN.COMMISSION_REPORT, 1, exec_id, self.scenario.commission,
+                               'USD', 0.0, 0.0, 0))
+            self.scenario.executions.append({ 'order_id' : order['id'], 'contract' : leg_con,
+                                              'side' : 'BOT' if qty > 0 else 'SLD',
+                                              'shares' : abs(qty) * order['qty'], 'price' : 0.0,
+                                              'exec_id' : exec_id, 'time' : now,
+                                              'commission' : self.scenario.commission })
+            position = self.scenario.positions.get(con_id, 0) + qty * order['qty']
+            self.scenario.positions[con_id] = position
+            if self.account_updates:
+                out.append(self.portfolio(con_id, position))
+        if con.secType == 'BAG':
+            self.next_exec_id += 1
+            exec_id = f'0000e{self.next_exec_id:04d}.01'
+            out.append(self.execution(-1, order['id'], con, side, order['qty'], order['fill'], exec_id, now))
+            self.scenario.executions.append({ 'order_id' : order['id'], 'contract' : con, 'side' : side,
+                                              'shares' : order['qty'], 'price' : order['fill'],
+                                              'exec_id' : exec_id, 'time' : now })
+        self.send(b''.join(out))
+
+    def cancel_order(self, fields):
+        order = self.orders.get(int(fields[2]))
+        if order is not None:
+            self.send(self.order_status(order, 'Cancelled')
+                      + message(IN.ERR_MSG, 2, order['id'], 202, 'Order Canceled - reason:'))
+
+    def global_cancel(self, fields):
+        for order_id in list(self.orders):
+            self.cancel_order([None, None, order_id])
+
+class FakeTWS:
+    ''' Listens on host:port (port 0 picks a free one, see self.port) and
+    answers every API connection from the scenario '''
+
+    def __init__(self, scenario = None, host = '127.0.0.1', port = 0, next_order_id = 1):
+        self.scenario = scenario or Scenario()
+        self.next_order_id = next_order_id
+        self.sessions = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen()
+        self.host, self.port = self.sock.getsockname()
+        Thread(target = self.accept, daemon = True).start()
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = Session(self, sock)
+            self.sessions.append(session)
+            Thread(target = session.serve, daemon = True).start()
+
+    def close(self):
+        self.sock.close()
+        for session in self.sessions:
+            try:
+                session.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def firehose(self, req_id, n, kind = 'tick', batch = 10000):
+        ''' Push n messages to every connection as fast as the socket takes
+        them: tickPrice ('tick'), historicalDataUpdate ('bar') or
+        execDetails ('exec') for req_id. Returns the seconds spent sending '''
+        if kind == 'tick':
+            one = lambda i: message(IN.TICK_PRICE, 6, req_id, 1 + i % 2, 400 + (i % 100) * 0.01, 1, 0)
+        elif kind == 'bar':
+            one = lambda i: message(IN.HISTORICAL_DATA_UPDATE, req_id, 1, '20231006 10:00:00',
+                                    400.0, 400 + (i % 100) * 0.01, 401.0, 399.0, 400.0, 100)
+        else:
+            con = Contract()
+            con.conId, con.symbol, con.secType, con.currency = 756733, 'SPY', 'STK', 'USD'
+            one = lambda i: execution_message(req_id, 1, con, 'BOT', 1, 400.0, f'e{i}',
+                                              datetime(2023, 10, 6, 10), self.scenario.account)
+        start = time.perf_counter()
+        for first in range(0, n, batch):
+            data = b''.join(one(i) for i in range(first, min(first + batch, n)))
+            for session in self.sessions:
+                if not session.closed.is_set():
+                    session.send(data)
+        return time.perf_counter() - start
+
+if __name__ == '__main__':
+    import sys
+    from utils.spy_client import Client
+
+    class Counter:
+        ''' Counts the firehose callbacks routed to it '''
+        def __init__(self, n):
+            self.n, self.count, self.done = n, 0, Event()
+        def tickPrice(self, req_id, tick_type, price, attrib):
+            self.count += 1
+            if self.count == self.n:
+                self.done.set()
+        def error(self, req_id, error_code, error_string):
+            pass
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for dispatch in (False, True):
+        server = FakeTWS()
+        client = Client(server.host, server.port, 0, dispatch = dispatch)
+        client.id_event.wait(5)
+        counter = Counter(n)
+        client.req_handlers[1] = counter
+        start = time.perf_counter()
+        server.firehose(1, n)
+        counter.done.wait(600)
+        elapsed = time.perf_counter() - start
+        print(f'dispatch={dispatch}: {counter.count} tickPrice callbacks in {elapsed:.2f}s, '
+              f'{counter.count / elapsed:,.0f}/s')
+        client.disconnect()
+        server.close()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:02:37 2026
+
+@author: alex shakaev
+"""
+
+''' Append-only binary journal of decoded callbacks and its replayer '''
+
+import os
+import pickle
+import queue
+import struct
+import time
+import zlib
+from threading import Thread, Event
+
+from ibapi.wrapper import EWrapper
+
+magic = b'IBJ1'
+frame_header = struct.Struct('<I')
+
+# every callback EWrapper defines, logAnswer is its logging helper
+callback_names = [name for name in dir(EWrapper)
+                  if not name.startswith('_') and name != 'logAnswer' and callable(getattr(EWrapper, name))]
+
+class Journal:
+    ''' Records (receive time, callback name, args) of every callback.
+    The reader thread only stamps the call and puts it on a queue; a writer
+    thread pickles what has queued up as one batch, compresses it and
+    appends it to path as a length prefixed frame, flushing after each one.
+    A crash loses at most the batch being written and a torn last frame is
+    ignored by read. Sessions written to the same path are appended '''
+
+    def __init__(self, path, max_batch = 5000, level = 1):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        self.path = path
+        self.max_batch = max_batch
+        self.level = level
+        self.queue = queue.SimpleQueue()
+        self.records = 0
+        self.bytes = 0
+        self.closed = Event()
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(magic)
+        self.thread = Thread(target = self.write, daemon = True)
+        self.thread.start()
+
+    def attach(self, client, names = callback_names):
+        ''' Wrap the callbacks of client so they are recorded before they run.
+        Attach after a Dispatcher so stamps are taken on the reader thread '''
+        for name in names:
+            setattr(client, name, self.recorder(name, getattr(client, name)))
+
+    def recorder(self, name, callback):
+        put = self.queue.put
+        now = time.time
+        def record(*args):
+            put((now(), name, args))
+            return callback(*args)
+        return record
+
+    def write(self):
+        get = self.queue.get
+        get_nowait = self.queue.get_nowait
+        while True:
+            batch = [get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(get_nowait())
+                except queue.Empty:
+                    break
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            if batch:
+                blob = zlib.compress(pickle.dumps(batch, pickle.HIGHEST_PROTOCOL), self.level)
+                self.file.write(frame_header.pack(len(blob)) + blob)
+                self.file.flush()
+                self.records += len(batch)
+                self.bytes += frame_header.size + len(blob)
+            if done:
+                self.file.close()
+                self.closed.set()
+                return
+
+    def close(self, timeout = 10):
+        ''' Write what is queued and close the file '''
+        self.queue.put(None)
+        self.closed.wait(timeout)
+
+def read(path):
+    ''' Yield (time, name, args) records in the order they were received '''
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f'{path} is not a callback journal')
+        while True:
+            header = f.read(frame_header.size)
+            if len(header) < frame_header.size:
+                return
+            size, = frame_header.unpack(header)
+            blob = f.read(size)
+            if len(blob) < size:
+                return
+            yield from pickle.loads(zlib.decompress(blob))
+
+class Replayer:
+    ''' Calls the recorded callbacks on target, a Client or anything with
+    the same callback methods, in recorded order. With speed None records
+    are fed as fast as possible, otherwise the recorded gaps are kept,
+    divided by speed. names restricts replay to those callbacks '''
+
+    def __init__(self, path, target, speed = None, names = None):
+        self.path = path
+        self.target = target
+        self.speed = speed
+        self.names = None if names is None else set(names)
+        self.replayed = 0
+        self.elapsed = 0.0
+        self.done = Event()
+
+    def run(self):
+        ''' Replay the journal, returns the number of callbacks fed '''
+        start = time.perf_counter()
+        first = None
+        for stamp, name, args in read(self.path):
+            if self.names is not None and name not in self.names:
+                continue
+            callback = getattr(self.target, name, None)
+            if callback is None:
+                continue
+            if self.speed is not None:
+                if first is None:
+                    first = stamp
+                delay = (stamp - first) / self.speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                callback(*args)
+            except Exception as e:
+                # as on the live client thread, a failing callback is reported and skipped
+                print(f'Error in {name} callback: {e!r}')
+            self.replayed += 1
+        self.elapsed = time.perf_counter() - start
+        self.done.set()
+        return self.replayed
+
+    def start(self):
+        ''' Replay on a thread, done is set when it finishes '''
+        thread = Thread(target = self.run, daemon = True)
+        thread.start()
+        return thread
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:36:02 2026
+
+@author: alex shakaev
+"""
+
+''' In-process latency histograms and counters, served as Prometheus text '''
+
+import math
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+import numpy as np
+
+from utils.journal import callback_names
+
+quantiles = (0.5, 0.9, 0.99, 0.999)
+
+class Histogram:
+    ''' Log-linear buckets over integer nanoseconds, as in HdrHistogram:
+    values below 2 * 2**sub_bits get a bucket each, above that every power
+    of two is split into 2**sub_bits buckets, so quantiles are within
+    2**-sub_bits of the true value (3% with the default) from 1 ns to days.
+    Recording is a bit_length and a few integer increments without a lock:
+    each histogram is meant to be written by one thread, a concurrent write
+    can at worst lose a count. Quantiles are only computed when read '''
+
+    def __init__(self, sub_bits = 5):
+        self.sub_bits = sub_bits
+        self.sub = 1 << sub_bits
+        self.counts = [0] * (64 * self.sub)
+        self.count = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    @property
+    def sum(self):
+        return self.sum_ns * 1e-9
+
+    @property
+    def max(self):
+        return self.max_ns * 1e-9
+
+    def lower(self, i):
+        ''' Smallest value in ns of bucket i '''
+        if i < 2 * self.sub:
+            return i
+        shift = i // self.sub - 1
+        return (i - shift * self.sub) << shift
+
+    def record_ns(self, ns):
+        if ns < 2 * self.sub:
+            i = ns if ns > 0 else 0
+        else:
+            shift = ns.bit_length() - self.sub_bits - 1
+            i = min(shift * self.sub + (ns >> shift), len(self.counts) - 2)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def record(self, seconds):
+        self.record_ns(int(seconds * 1e9))
+
+    def quantile(self, q):
+        ''' Value in seconds below which a fraction q of the records fall,
+        taken as the middle of its bucket '''
+        counts = np.array(self.counts)
+        total = counts.sum()
+        if not total:
+            return math.nan
+        i = int(np.searchsorted(np.cumsum(counts), q * total))
+        return (self.lower(i) + self.lower(i + 1)) / 2 * 1e-9
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, n = 1):
+        with self.lock:
+            self.value += n
+
+class Gauge:
+    ''' Set directly, or read from fn when the metrics are rendered '''
+
+    def __init__(self, fn = None):
+        self.value = math.nan
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.fn() if self.fn is not None else self.value
+
+class Timer:
+    ''' Context manager recording its duration into a histogram '''
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record_ns(time.perf_counter_ns() - self.start)
+
+def instrument(client, registry, names):
+    ''' Time the callbacks in names where they run: in the dispatcher's
+    workers when the client has one, otherwise on the client thread. Names
+    that aren't EWrapper callbacks are skipped, and a callback shows up in
+    the metrics once it has been called. The dispatcher's queue depth and
+    lag are exported as gauges '''
+    names = [name for name in names if name in callback_names]
+    dispatcher = client.dispatcher
+    if dispatcher is None:
+        for name in names:
+            setattr(client, name, registry.timed(getattr(client, name), 'callback_seconds', callback = name))
+        return
+    for name in names:
+        dispatcher.callbacks[name] = registry.timed(dispatcher.callbacks[name], 'callback_seconds', callback = name)
+    registry.gauge('dispatch_queue_depth', 'callbacks waiting for a worker', fn = dispatcher.depth)
+    for key in ('max_depth', 'last_lag', 'max_lag', 'mean_lag', 'busy'):
+        registry.gauge(f'dispatch_{key}', fn = lambda key = key: dispatcher.metrics()[key])
+    registry.gauge('dispatch_processed', fn = lambda: dispatcher.metrics()['processed'])
+
+def label_text(labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}' if labels else ''
+
+class Registry:
+    ''' Metrics by name and labels. histogram, counter and gauge create the
+    metric on first use and return the same object afterwards, so hot paths
+    should keep the returned object rather than look it up every time '''
+
+    def __init__(self, prefix = 'spy_'):
+        self.prefix = prefix
+        self.metrics = {} # (name, labels) -> metric
+        self.help = {}
+        self.lock = Lock()
+        self.server = None
+
+    def get(self, cls, name, help, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(key, cls(*args))
+                if help:
+                    self.help.setdefault(name, help)
+        return metric
+
+    def histogram(self, name, help = '', **labels):
+        return self.get(Histogram, name, help, labels)
+
+    def counter(self, name, help = '', **labels):
+        return self.get(Counter, name, help, labels)
+
+    def gauge(self, name, help = '', fn = None, **labels):
+        return self.get(Gauge, name, help, labels, fn)
+
+    def timer(self, name, **labels):
+        ''' with registry.timer('loop_stage_seconds', stage = 'bocd'): ... '''
+        return Timer(self.histogram(name, **labels))
+
+    def timed(self, fn, name, **labels):
+        ''' fn wrapped so every call is recorded in the histogram, which is
+        created by the first call '''
+        record = None
+        clock = time.perf_counter_ns
+        def call(*args):
+            nonlocal record
+            start = clock()
+            try:
+                return fn(*args)
+            finally:
+                if record is None:
+                    record = self.histogram(name, **labels).record_ns
+                record(clock() - start)
+        return call
+
+    def render(self):
+        ''' All metrics in the Prometheus text format. Histograms are
+        exported as summaries with quantiles, sum, count and max '''
+        with self.lock:
+            items = sorted(self.metrics.items(), key = lambda item: item[0])
+        lines, typed = [], set()
+        for (name, labels), metric in items:
+            full = self.prefix + name
+            kind = { Histogram : 'summary', Counter : 'counter', Gauge : 'gauge' }[type(metric)]
+            if full not in typed:
+                typed.add(full)
+                if name in self.help:
+                    lines.append(f'# HELP {full} {self.help[name]}')
+                lines.append(f'# TYPE {full} {kind}')
+            if isinstance(metric, Histogram):
+                for q in quantiles:
+                    lines.append(f'{full}{label_text(labels + (("quantile", q),))} {metric.quantile(q):.9g}')
+                lines.append(f'{full}_sum{label_text(labels)} {metric.sum:.9g}')
+                lines.append(f'{full}_count{label_text(labels)} {metric.count}')
+            elif isinstance(metric, Counter):
+                lines.append(f'{full}{label_text(labels)} {metric.value}')
+            else:
+                lines.append(f'{full}{label_text(labels)} {metric.get():.9g}')
+        # max has to be its own gauge family in the text format
+        maxima = [(self.prefix + name + '_max', labels, metric.max) for (name, labels), metric in items
+                  if isinstance(metric, Histogram)]
+        for full in sorted({ full for full, _, _ in maxima }):
+            lines.append(f'# TYPE {full} gauge')
+            lines.extend(f'{full}{label_text(labels)} {value:.9g}' for name, labels, value in maxima if name == full)
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port = 9100, host = '127.0.0.1'):
+        ''' Serve render() at http://host:port/metrics from a daemon thread '''
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        Thread(target = self.server.serve_forever, daemon = True).start()
+        return self.server.server_address[1]
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
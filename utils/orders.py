@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:05:52 2026
+
+@author: alex shakaev
+"""
+
+''' Order manager driven by orderStatus/execDetails callbacks '''
+
+import math
+import time
+from threading import Thread, Event, RLock
+
+import pandas as pd
+
+from ibapi.order import Order
+
+from utils.async_client import is_warning
+
+done_states = ('Filled', 'Cancelled', 'ApiCancelled', 'Inactive', 'Rejected')
+
+def cap(order, price, limit):
+    ''' Keep price on our side of limit '''
+    if limit is None:
+        return price
+    return min(price, limit) if order.sign > 0 else max(price, limit)
+
+class TimeSchedule:
+    ''' Move the limit step toward the other side every interval seconds
+    without a fill, never past limit and at most max_steps times '''
+
+    def __init__(self, step = 0.01, interval = 15.0, max_steps = None, limit = None):
+        self.step = step
+        self.interval = interval
+        self.max_steps = max_steps
+        self.limit = limit
+
+    def reprice(self, order, quote, now):
+        if now - order.priced_time < self.interval:
+            return None
+        if self.max_steps is not None and len(order.replaces) >= self.max_steps:
+            return None
+        return cap(order, round(order.limit + order.sign * self.step, 2), self.limit)
+
+class PegSchedule:
+    ''' Follow the quote: the limit is kept at mid plus offset toward the
+    other side, and offset grows by step every interval seconds without a
+    fill. Reprices as soon as a tick moves the target, but not more often
+    than min_interval seconds '''
+
+    def __init__(self, offset = 0.0, step = 0.01, interval = 15.0, limit = None, min_interval = 1.0):
+        self.offset = offset
+        self.step = step
+        self.interval = interval
+        self.limit = limit
+        self.min_interval = min_interval
+
+    def reprice(self, order, quote, now):
+        if now - order.priced_time < self.min_interval or quote is None or not quote.two_sided():
+            return None
+        offset = self.offset + self.step * int((now - order.submit_time) / self.interval)
+        return cap(order, round(quote.mid() + order.sign * offset, 2), self.limit)
+
+class ManagedOrder:
+    ''' State of one order. Times are time.perf_counter() stamps, replaces
+    holds a dict per cancel/replace with the old and new limit and the
+    times it was sent and acknowledged '''
+
+    def __init__(self, order_id, contract, order, schedule, mid):
+        self.order_id = order_id
+        self.contract = contract
+        self.order = order
+        self.schedule = schedule
+        self.sign = 1 if order.action == 'BUY' else -1
+        self.initial_limit = self.limit = order.lmtPrice
+        self.mid = mid # at submit
+        self.status = 'New'
+        self.filled = 0.0
+        self.avg_fill_price = math.nan
+        self.submit_time = self.priced_time = time.perf_counter()
+        self.ack_time = self.first_fill_time = self.fill_time = None
+        self.replaces = []
+        self.errors = []
+        self.done = Event()
+
+    def is_done(self):
+        return self.done.is_set()
+
+    def wait(self, timeout = None):
+        ''' Block until the order is done, returns True if it was filled '''
+        self.done.wait(timeout)
+        return self.status == 'Filled'
+
+    def replace_pending(self):
+        return bool(self.replaces) and self.replaces[-1]['acked'] is None
+
+    def record(self):
+        ''' Latencies in seconds and slippage against the mid at submit,
+        positive when the fill was worse than mid '''
+        since = lambda start, end: end - start if start is not None and end is not None else math.nan
+        return { 'order_id' : self.order_id, 'action' : self.order.action,
+                 'quantity' : self.order.totalQuantity, 'status' : self.status,
+                 'mid' : self.mid, 'initial_limit' : self.initial_limit, 'limit' : self.limit,
+                 'avg_fill_price' : self.avg_fill_price,
+                 'slippage' : self.sign * (self.avg_fill_price - self.mid),
+                 'n_replaces' : len(self.replaces),
+                 'submit_to_ack' : since(self.submit_time, self.ack_time),
+                 'submit_to_first_fill' : since(self.submit_time, self.first_fill_time),
+                 'submit_to_fill' : since(self.submit_time, self.fill_time),
+                 'ack_to_fill' : since(self.ack_time, self.fill_time),
+                 'replace_to_ack' : [since(r['sent'], r['acked']) for r in self.replaces] }
+
+class OrderManager:
+    ''' Submits limit orders and works them with a repricing schedule.
+    Order state is updated by the callbacks as they arrive; a thread wakes
+    on every callback, and at least every poll seconds, to reprice orders
+    whose schedule says so. A new limit is sent as a modification of the
+    same order id and not repriced again until TWS acknowledges it with an
+    openOrder carrying the new limit '''
+
+    def __init__(self, client, poll = 0.25):
+        self.client = client
+        self.poll = poll
+        self.orders = {}
+        self.lock = RLock()
+        self.wake = Event()
+        self.thread = None
+        client.listeners.append(self)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = Thread(target = self.run, daemon = True)
+            self.thread.start()
+
+    def submit(self, contract, action, lmt_price, quantity = 1, schedule = None, order_id = None):
+        ''' Place a limit order, returns its ManagedOrder '''
+        if order_id is None:
+            order_id = self.client.aio.run(self.client.aio.order_id())
+        order = Order()
+        order.action = action
+        order.orderType = 'LMT'
+        order.totalQuantity = quantity
+        order.lmtPrice = lmt_price
+        order.transmit = True
+
+        # the quote is kept streaming for slippage and pegged schedules
+        quote = self.client.quotes.get(contract)
+        mid = quote.mid() if quote.two_sided() else math.nan
+        managed = ManagedOrder(order_id, contract, order, schedule, mid)
+        with self.lock:
+            self.orders[order_id] = managed
+        self.client.placeOrder(order_id, contract, order)
+        self.start()
+        return managed
+
+    def replace(self, managed, price):
+        with self.lock:
+            managed.replaces.append({ 'old' : managed.limit, 'new' : price,
+                                      'sent' : time.perf_counter(), 'acked' : None })
+            managed.limit = managed.order.lmtPrice = price
+            managed.priced_time = time.perf_counter()
+        print(f'Order {managed.order_id}: limit {managed.replaces[-1]["old"]} -> {price}')
+        self.client.placeOrder(managed.order_id, managed.contract, managed.order)
+
+    def cancel(self, managed):
+        self.client.cancelOrder(managed.order_id, '')
+
+    def active(self):
+        with self.lock:
+            return [order for order in self.orders.values() if not order.is_done()]
+
+    def run(self):
+        while True:
+            self.wake.wait(self.poll)
+            self.wake.clear()
+            now = time.perf_counter()
+            for order in self.active():
+                if order.schedule is None or order.replace_pending() or order.filled:
+                    continue
+                price = order.schedule.reprice(order, self.client.quotes.get(order.contract), now)
+                if price is not None and price != order.limit:
+                    self.replace(order, price)
+
+    def records(self):
+        ''' One row per order with its latencies and slippage '''
+        with self.lock:
+            return pd.DataFrame([order.record() for order in self.orders.values()])
+
+    # callbacks, passed on by the client
+
+    def finish(self, order, status):
+        order.status = status
+        if status == 'Filled' and order.fill_time is None:
+            order.fill_time = time.perf_counter()
+        order.done.set()
+
+    def orderStatus(self, order_id, status, filled, remaining, avg_fill_price, *args):
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                return
+            now = time.perf_counter()
+            if order.ack_time is None and status in ('PreSubmitted', 'Submitted', 'Filled'):
+                order.ack_time = now
+            if filled > order.filled and order.first_fill_time is None:
+                order.first_fill_time = now
+            order.filled = filled
+            if filled:
+                order.avg_fill_price = avg_fill_price
+            if status in done_states:
+                self.finish(order, status)
+            else:
+                order.status = 'PartiallyFilled' if filled else status
+        self.wake.set()
+
+    def openOrder(self, order_id, contract, order, state):
+        with self.lock:
+            managed = self.orders.get(order_id)
+            if managed is None:
+                return
+            if managed.ack_time is None:
+                managed.ack_time = time.perf_counter()
+            # an orderStatus says nothing of which limit is working, only an
+            # openOrder echoing the new one acknowledges a modification
+            if managed.replace_pending() and math.isclose(order.lmtPrice, managed.replaces[-1]['new']):
+                managed.replaces[-1]['acked'] = time.perf_counter()
+        self.wake.set()
+
+    def execDetails(self, req_id, contract, execution):
+        with self.lock:
+            order = self.orders.get(execution.orderId)
+            if order is not None and order.first_fill_time is None:
+                order.first_fill_time = time.perf_counter()
+
+    def error(self, req_id, error_code, error_string):
+        with self.lock:
+            order = self.orders.get(req_id)
+            if order is None:
+                return
+            order.errors.append((error_code, error_string))
+            if is_warning(error_code) or error_code == 399:
+                return
+            if order.replace_pending():
+                # the modification was refused, the old limit is still working
+                replace = order.replaces[-1]
+                replace['acked'] = math.nan
+                order.limit = order.order.lmtPrice = replace['old']
+            if error_code == 201:
+                self.finish(order, 'Rejected')
+            elif error_code == 202:
+                self.finish(order, 'Cancelled')
+        self.wake.set()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:58:06 2026
+
+@author: alex shakaev
+"""
+
+''' Black-Scholes prices and greeks precomputed over a (time, strike, expiry) grid '''
+
+import os
+
+import numpy as np
+from scipy.special import ndtr
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+def black_scholes(call, S, K, t, r, sigma, q = 0.0, greeks = ('price', 'delta')):
+    ''' Prices and greeks of european options, all arguments broadcast.
+    t is in years, vega is per 1.0 of vol and theta per year. Expired
+    options (t <= 0) are worth their intrinsic value. Returns a dict of
+    arrays keyed by the names in greeks '''
+    S, K, t, sigma = np.broadcast_arrays(*(np.asarray(x, dtype = 'f8') for x in (S, K, t, sigma)))
+    live = t > 0
+    t_live = np.where(live, t, 1.0)
+    sqrt_t = np.sqrt(t_live)
+    vol_t = sigma * sqrt_t
+    d1 = (np.log(S / K) + (r - q + 0.5 * sigma * sigma) * t_live) / vol_t
+    d2 = d1 - vol_t
+    sign = 1.0 if call else -1.0
+    div = np.exp(-q * t_live)
+    disc = np.exp(-r * t_live)
+    n_d1 = ndtr(sign * d1)
+    n_d2 = ndtr(sign * d2)
+    values = {}
+    if 'price' in greeks:
+        price = sign * (S * div * n_d1 - K * disc * n_d2)
+        values['price'] = np.where(live, price, np.maximum(sign * (S - K), 0.0))
+    if 'delta' in greeks:
+        values['delta'] = np.where(live, sign * div * n_d1, np.where(sign * (S - K) > 0, sign, 0.0))
+    if 'gamma' in greeks or 'vega' in greeks or 'theta' in greeks:
+        pdf = div * norm_pdf(d1)
+    if 'gamma' in greeks:
+        values['gamma'] = np.where(live, pdf / (S * vol_t), 0.0)
+    if 'vega' in greeks:
+        values['vega'] = np.where(live, S * pdf * sqrt_t, 0.0)
+    if 'theta' in greeks:
+        theta = -S * pdf * sigma / (2 * sqrt_t) - sign * r * K * disc * n_d2 + sign * q * S * div * n_d1
+        values['theta'] = np.where(live, theta, 0.0)
+    return values
+
+class PriceGrid:
+    ''' Option prices and greeks of every strike and expiry at every
+    timestamp, each a float32 array indexed [time, strike, expiry].
+    spots and vols are aligned with timestamps. The grid is filled chunk_cells
+    cells at a time so the float64 temporaries stay bounded; with path the
+    arrays are .npy memory maps in that directory instead of in memory '''
+
+    def __init__(self, timestamps, spots, vols, strikes, expiries, call = True, r = 0.02, q = 0.0,
+                 greeks = ('price', 'delta'), chunk_cells = 1 << 20, path = None):
+        self.timestamps = np.asarray(timestamps).astype('M8[s]')
+        self.strikes = np.sort(np.asarray(strikes, dtype = 'f8'))
+        self.expiries = np.sort(np.asarray(expiries).astype('M8[s]'))
+        self.call = call
+        self.strike_index = { strike : j for j, strike in enumerate(self.strikes.tolist()) }
+        self.expiry_index = { expiry : k for k, expiry in enumerate(self.expiries.view('i8').tolist()) }
+        spots = np.asarray(spots, dtype = 'f8')
+        vols = np.asarray(vols, dtype = 'f8')
+
+        shape = (len(self.timestamps), len(self.strikes), len(self.expiries))
+        if path is not None:
+            os.makedirs(path, exist_ok = True)
+        self.arrays = { name : np.empty(shape, dtype = 'f4') if path is None else
+                        np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), 'w+', 'f4', shape)
+                        for name in greeks }
+
+        rows = max(1, chunk_cells // max(1, shape[1] * shape[2]))
+        K = self.strikes[None, :, None]
+        for start in range(0, shape[0], rows):
+            chunk = slice(start, start + rows)
+            t = (self.expiries[None, None, :] - self.timestamps[chunk, None, None]) / np.timedelta64(1, 'D') / 365.0
+            values = black_scholes(call, spots[chunk, None, None], K, t, r, vols[chunk, None, None], q, greeks)
+            for name, array in self.arrays.items():
+                array[chunk] = values[name]
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def get(self, i, strike, expiry, name = 'price'):
+        ''' Value at time index i of the option with this strike and expiry '''
+        k = self.expiry_index[np.datetime64(expiry, 's').astype('i8').item()]
+        return float(self.arrays[name][i, self.strike_index[float(strike)], k])
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:21:09 2026
+
+@author: alex shakaev
+"""
+
+''' Long lived market data subscriptions with a top of book cache '''
+
+import math
+import time
+from collections import OrderedDict
+from threading import Event, Lock
+
+from utils.async_client import RequestError, is_warning
+
+def contract_key(con):
+    ''' conId when known, otherwise the fields that identify the contract.
+    Combos are keyed by their legs '''
+    if con.secType == 'BAG':
+        return ('BAG', con.symbol) + tuple((leg.conId, leg.ratio, leg.action) for leg in con.comboLegs or [])
+    if con.conId:
+        return con.conId
+    return (con.symbol, con.secType, con.lastTradeDateOrContractMonth, con.strike, con.right, con.exchange)
+
+class Quote:
+    ''' Top of book of one subscription, updated from the client thread.
+    Times are time.time() of the last update of each side '''
+
+    def __init__(self, req_id):
+        self.req_id = req_id
+        self.bid = self.ask = self.last = math.nan
+        self.bid_time = self.ask_time = self.last_time = 0.0
+        self.failed = None
+        self.updated = Event()
+
+    def mid(self):
+        return round((self.bid + self.ask) / 2, 2)
+
+    def two_sided(self):
+        return not (math.isnan(self.bid) or math.isnan(self.ask))
+
+    def tickPrice(self, req_id, tick_type, price, attrib):
+        # -1 means there is no order on that side
+        price = math.nan if price == -1 else price
+        now = time.time()
+        if tick_type in (1, 66):
+            self.bid, self.bid_time = price, now
+        elif tick_type in (2, 67):
+            self.ask, self.ask_time = price, now
+        elif tick_type in (4, 68):
+            self.last, self.last_time = price, now
+        else:
+            return
+        self.updated.set()
+
+    def error(self, req_id, error_code, error_string):
+        if not is_warning(error_code):
+            self.failed = (error_code, error_string)
+            self.updated.set()
+
+class QuoteCache:
+    ''' Keeps a market data subscription open for every contract asked for,
+    so reading a quote is a dict lookup. When more than max_subscriptions
+    are open the least recently read one is cancelled '''
+
+    def __init__(self, client, max_subscriptions = 50, req_id_start = 20000):
+        self.client = client
+        self.max_subscriptions = max_subscriptions
+        self.next_req_id = req_id_start
+        self.quotes = OrderedDict() # contract key -> Quote, least recently used first
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.quotes)
+
+    def get(self, con):
+        ''' Quote of con, subscribing on first use '''
+        key = contract_key(con)
+        with self.lock:
+            quote = self.quotes.get(key)
+            if quote is not None:
+                self.quotes.move_to_end(key)
+                return quote
+            quote = Quote(self.next_req_id)
+            self.next_req_id += 1
+            self.quotes[key] = quote
+            while len(self.quotes) > self.max_subscriptions:
+                _, old = self.quotes.popitem(last = False)
+                self.cancel(old)
+        self.client.req_handlers[quote.req_id] = quote
+        self.client.reqMktData(quote.req_id, con, '', False, False, [])
+        return quote
+
+    subscribe = get
+
+    def cancel(self, quote):
+        self.client.cancelMktData(quote.req_id)
+        self.client.req_handlers.pop(quote.req_id, None)
+
+    def unsubscribe(self, con):
+        with self.lock:
+            quote = self.quotes.pop(contract_key(con), None)
+        if quote is not None:
+            self.cancel(quote)
+
+    def clear(self):
+        with self.lock:
+            quotes, self.quotes = list(self.quotes.values()), OrderedDict()
+        for quote in quotes:
+            self.cancel(quote)
+
+    def wait(self, con, ready, timeout):
+        ''' Block until ready(quote) holds. A subscription that failed is
+        dropped so the next call subscribes again '''
+        quote = self.get(con)
+        deadline = time.monotonic() + timeout
+        while not ready(quote):
+            if quote.failed is not None:
+                self.unsubscribe(con)
+                raise RequestError(quote.req_id, *quote.failed)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'no quote for {contract_key(con)} within {timeout}s')
+            quote.updated.clear()
+            if not ready(quote):
+                quote.updated.wait(remaining)
+        return quote
+
+    def mid(self, con, timeout = 30):
+        ''' Bid/ask midpoint, waits for a two sided quote on first use '''
+        return self.wait(con, Quote.two_sided, timeout).mid()
+
+    def last(self, con, timeout = 30):
+        return self.wait(con, lambda quote: not math.isnan(quote.last), timeout).last
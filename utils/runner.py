@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:04:51 2026
+
+@author: alex shakaev
+"""
+
+''' The call spread strategy of main.py on many underlyings over one connection '''
+
+import asyncio
+import math
+import time
+from datetime import datetime
+from functools import partial
+from itertools import count
+from threading import Event, Lock
+
+import numpy as np
+import pandas as pd
+import pyqstrat as pq
+import pytz
+
+from ibapi.contract import Contract
+from ibapi.execution import ExecutionFilter
+
+from utils.async_client import RequestError
+from utils.bocd import BOCDBank, constant_hazard
+from utils.chains import OptionChain, monthly_expiries
+from utils.metrics import Registry
+from utils.orders import TimeSchedule
+from utils.spy_client import bar_table
+from utils.streaming import BarStream
+from utils.tables import table_property
+from utils.utils import create_combo
+
+calendar = pq.Calendar.get_calendar(pq.Calendar.NYSE)
+ny = pytz.timezone('America/New_York')
+
+default_params = {
+    'lambda_' : 150,
+    'max_run_length' : 1000, # about 5 trading days of 2 min bars
+    'alpha' : 0.1,
+    'kappa' : 1,
+    'mu' : 0,
+    'cp_threshold' : 0.35,
+    'lookback' : 50, # sma bars
+    'take_profit' : 1.5, # exit when the spread is worth this many times the premium
+    'max_hold' : pd.Timedelta(25, 'd'),
+    'days_out' : 30, # trading days to the expiry at least
+    'bar_interval' : 120, # seconds
+}
+
+def stock(symbol, exchange = 'SMART', currency = 'USD'):
+    con = Contract()
+    con.symbol = symbol
+    con.secType = 'STK'
+    con.exchange = exchange
+    con.currency = currency
+    return con
+
+def call(symbol, expiry, exchange = 'BOX', currency = 'USD'):
+    ''' Every call of symbol expiring on expiry, for contract details '''
+    con = Contract()
+    con.symbol = symbol
+    con.secType = 'OPT'
+    con.currency = currency
+    con.exchange = exchange
+    con.right = 'C'
+    con.lastTradeDateOrContractMonth = expiry
+    return con
+
+def next_expiry(now, days_out = 30):
+    ''' First monthly expiry at least days_out trading days after now, as YYYYMMDD '''
+    current_date = np.datetime64(now.replace(tzinfo = None)).astype('M8[s]')
+    max_expiry = calendar.add_trading_days(current_date, days_out)
+    expiries = monthly_expiries(calendar, current_date, max_expiry)
+    return expiries[np.searchsorted(expiries, max_expiry)].item().strftime('%Y%m%d')
+
+class RequestIds:
+    ''' reqIds from one counter for the requests of the runner, above the
+    ranges of AsyncClient (10000) and QuoteCache (20000). Historical data
+    streams are also counted, TWS allows only max_streams of them open on
+    a connection '''
+
+    def __init__(self, start = 30000, max_streams = 50):
+        self.ids = count(start)
+        self.max_streams = max_streams
+        self.streams = {} # req_id -> owner
+        self.lock = Lock()
+
+    def next(self):
+        with self.lock:
+            return next(self.ids)
+
+    def open_stream(self, owner):
+        with self.lock:
+            if len(self.streams) >= self.max_streams:
+                raise RuntimeError(f'{self.max_streams} historical data streams are open already')
+            req_id = next(self.ids)
+            self.streams[req_id] = owner
+            return req_id
+
+    def close_stream(self, req_id):
+        with self.lock:
+            self.streams.pop(req_id, None)
+
+class Instrument:
+    ''' Strategy state of one underlying: its bars and indicators, its row
+    in the detector bank and the call spread it holds. Its BarStream writes
+    into it the way the single stream of main.py writes into the client '''
+
+    data = table_property('data')
+
+    def __init__(self, symbol, width = 5, bar_store = None):
+        self.symbol = symbol
+        self.width = width # strikes between the legs at most
+        self.contract = stock(symbol)
+        self.tables = { 'data' : bar_table() }
+        self.bar_store = bar_store
+        self.bar_event = Event()
+        self.signal = False
+        self.stream = None
+        self.row = None # in the BOCD bank
+        self.fed = 0 # bars seen by the detector
+        self.fed_close = math.nan
+        self.chain = None
+        self.entered = False
+        self.strikes = {}
+        self.con_ids = {}
+        self.bag = None
+        self.premium = math.nan
+        self.trade_time = None
+        self.order = None # entry or exit being worked
+
+    def __repr__(self):
+        return f'Instrument({self.symbol})'
+
+    def load_history(self, n_bars = 1000):
+        ''' Seed the bars from the bar store, as Client.load_history '''
+        if self.bar_store is None:
+            return
+        bars = self.bar_store.tail(n_bars, ['date', 'o', 'h', 'l', 'c', 'v'])
+        if len(bars):
+            bars['diff'] = np.nan
+            self.data = bars
+
+    def n_bars(self):
+        return len(self.tables['data'])
+
+    def closes(self, k):
+        ''' The last k closes, read from the table without building a DataFrame '''
+        table = self.tables['data']
+        with table.lock:
+            return table.columns['c'][max(table.n - k, 0) : table.n].copy()
+
+    def pick_legs(self, price):
+        ''' ATM long leg and a short leg at most width above it, as get_legs_info '''
+        atm_strike = self.chain.closest(round(price))
+        otm_strike = self.chain.floor(atm_strike + self.width)
+        if otm_strike == atm_strike:
+            raise KeyError(f'no strike above {atm_strike}')
+        self.set_legs(atm_strike, otm_strike, self.chain.con_id(atm_strike), self.chain.con_id(otm_strike))
+
+    def set_legs(self, long_strike, short_strike, long_con_id, short_con_id):
+        self.strikes = { 'long_leg' : long_strike, 'short_leg' : short_strike }
+        self.con_ids = { 'long_leg' : int(long_con_id), 'short_leg' : int(short_con_id) }
+        self.bag = create_combo(None, self.symbol, self.con_ids)
+
+    def describe(self):
+        return f"{self.symbol} {self.strikes['long_leg']}-{self.strikes['short_leg']} call spread"
+
+class Runner:
+    ''' Trades the strategy of main.py on every instrument from one client.
+
+    Candles of all instruments close at the same moment. The scheduler
+    wakes on the first one, gives the others up to gather seconds to come
+    in and then does the work of the round for all of them at once: one
+    BOCDBank step updates every detector, the quotes of all spreads to
+    price are subscribed before any is waited on, and orders are sent
+    without waiting for their fills, which are taken up at the start of the
+    next round. So a round costs about as much for fifty instruments as
+    for one. An instrument whose bar missed the round gets a zero change
+    there and the whole move in the next round '''
+
+    def __init__(self, client, instruments, params = None, metrics = None, req_ids = None,
+                 max_lines = 100, gather = 3.0, quote_timeout = 10.0, schedule = None):
+        self.client = client
+        self.instruments = list(instruments)
+        self.params = { **default_params, **(params or {}) }
+        self.metrics = Registry() if metrics is None else metrics
+        self.req_ids = RequestIds() if req_ids is None else req_ids
+        # a subscription per spread quote, TWS allows max_lines per connection
+        client.quotes.max_subscriptions = max_lines
+        self.gather = gather
+        self.quote_timeout = quote_timeout
+        # unfilled orders are moved a cent toward the other side every 5 seconds
+        self.schedule = TimeSchedule(step = 0.01, interval = 5) if schedule is None else schedule
+        self.bar_event = Event() # set by every stream
+        self.stopped = Event()
+        self.expiry = None
+        self.bank = None
+        self.order_ids = None
+
+        self.round_time = self.metrics.histogram('runner_round_seconds', 'work per round of candles')
+        self.overruns = self.metrics.counter('runner_overruns_total', 'rounds longer than the bar interval')
+        self.missed = self.metrics.counter('runner_missed_total', 'bar intervals without a candle')
+        self.metrics.gauge('runner_instruments', 'instruments traded', fn = lambda: len(self.instruments))
+        self.metrics.gauge('runner_positions', 'spreads held', fn = lambda: sum(i.entered for i in self.instruments))
+
+    def stage(self, name):
+        return self.metrics.timer('loop_stage_seconds', stage = name)
+
+    # startup
+
+    def setup(self, timeout = 60):
+        ''' Positions, chains and history of every instrument, then the streams and detectors '''
+        client = self.client
+        ib = client.aio
+        option_filter = ExecutionFilter()
+        option_filter.secType = ['OPT', 'BAG']
+        client.exec_df = client.exec_df[0:0]
+        _, _, order_id = ib.gather(ib.portfolio(), ib.executions(option_filter), ib.order_id())
+        self.order_ids = count(order_id)
+        self.restore_positions()
+
+        self.expiry = next_expiry(datetime.now(ny), self.params['days_out'])
+        self.load_chains()
+        self.start_streams(timeout)
+        self.build_bank()
+        print(f'Trading {len(self.instruments)} instruments, expiry {self.expiry}')
+
+    def restore_positions(self):
+        ''' Take up spreads already held, one long and one short call per symbol '''
+        acc = self.client.acc_df
+        execs = self.client.exec_df
+        options = acc[(acc['SecType'] == 'OPT') & (acc['position'] != 0)]
+        for inst in self.instruments:
+            held = options[options['Symbol'] == inst.symbol]
+            if not len(held):
+                continue
+            long, short = held[held['position'] == 1], held[held['position'] == -1]
+            if len(long) != 1 or len(short) != 1:
+                print(f'{inst.symbol}: positions are not one call spread, left alone')
+                continue
+            inst.set_legs(long.Strike.values[0], short.Strike.values[0], long.ConID.values[0], short.ConID.values[0])
+            inst.premium = round(np.abs(short.AvgCost.values[0] - long.AvgCost.values[0]), 2)
+            inst.entered = True
+            # trade time from the executions of the long leg
+            mask = execs['ConID'] == inst.con_ids['long_leg']
+            if any(mask):
+                inst.trade_time = execs[mask].iloc[-1]['Time']
+            else:
+                print(f'{inst.symbol}: no execution of the long leg, holding from now')
+                inst.trade_time = datetime.now(ny)
+            print(f'Got position in {inst.describe()}')
+
+    def load_chains(self):
+        ''' Chains from the cache, the missing ones are requested together '''
+        client = self.client
+        missing = []
+        for inst in self.instruments:
+            inst.chain = client.chains.get((inst.symbol, self.expiry, 'C'))
+            if inst.chain is None:
+                missing.append(inst)
+        if not missing:
+            return
+        print(f'Getting {len(missing)} option chains...')
+
+        async def request(inst):
+            try:
+                return await client.aio.contract_details(call(inst.symbol, self.expiry))
+            except (RequestError, asyncio.TimeoutError) as e:
+                print(f'{inst.symbol}: no option chain, {e}')
+                return []
+
+        for inst, details in zip(missing, client.aio.gather(*(request(inst) for inst in missing))):
+            if not details:
+                continue
+            contracts = [d.contract for d in details]
+            inst.chain = OptionChain(inst.symbol, self.expiry, 'C', [c.strike for c in contracts],
+                                     [c.conId for c in contracts], [c.localSymbol for c in contracts])
+            client.chains.put(inst.chain)
+
+    def start_streams(self, timeout):
+        ''' Bar streams of every instrument. Those that fail or have no
+        history by timeout are dropped '''
+        for inst in self.instruments:
+            inst.load_history()
+            inst.bar_event = self.bar_event
+            inst.stream = BarStream(self.client, inst.contract, self.req_ids.open_stream(inst),
+                                    lookback = self.params['lookback'], target = inst)
+            inst.stream.start()
+        deadline = time.monotonic() + timeout
+        done = lambda inst: inst.stream.loaded or inst.stream.failed is not None
+        while not all(done(inst) for inst in self.instruments) and time.monotonic() < deadline:
+            self.bar_event.clear()
+            self.bar_event.wait(1)
+        for inst in [inst for inst in self.instruments if not inst.stream.loaded]:
+            print(f'{inst.symbol}: no bars, dropped')
+            self.stop_stream(inst)
+            self.instruments.remove(inst)
+        if not self.instruments:
+            raise RuntimeError('no instrument has bars')
+
+    def stop_stream(self, inst):
+        inst.stream.stop()
+        self.req_ids.close_stream(inst.stream.req_id)
+
+    def build_bank(self):
+        ''' One detector row per instrument, beta scaled to its own variance '''
+        p = self.params
+        betas = []
+        for row, inst in enumerate(self.instruments):
+            inst.row = row
+            inst.fed = inst.n_bars()
+            inst.fed_close = inst.closes(1)[-1]
+            var = np.var(inst.closes(p['lookback']), ddof = 1)
+            betas.append(p['alpha'] * var if np.isfinite(var) and var > 0 else p['alpha'])
+        self.bank = BOCDBank(partial(constant_hazard, p['lambda_']), len(self.instruments), p['max_run_length'],
+                             p['alpha'], np.array(betas), p['kappa'], p['mu'], p['cp_threshold'])
+
+    # rounds
+
+    def wait_round(self, timeout):
+        ''' Instruments with a bar closed since the last round, once all have
+        one or gather seconds after the first. Empty after timeout '''
+        if not self.bar_event.wait(timeout):
+            return []
+        deadline = time.monotonic() + self.gather
+        while True:
+            self.bar_event.clear()
+            fresh = [inst for inst in self.instruments if inst.n_bars() > inst.fed]
+            remaining = deadline - time.monotonic()
+            if len(fresh) == len(self.instruments) or remaining <= 0:
+                return fresh
+            self.bar_event.wait(remaining)
+
+    def settle(self):
+        ''' Take up the orders that are done '''
+        for inst in self.instruments:
+            order = inst.order
+            if order is None or not order.is_done():
+                continue
+            inst.order = None
+            action = order.order.action
+            if order.status != 'Filled':
+                print(f'{inst.symbol}: {action} order {order.order_id} {order.status}')
+                continue
+            if action == 'BUY':
+                inst.entered = True
+                inst.premium = round(abs(order.avg_fill_price) * 100, 2)
+                inst.trade_time = datetime.now(ny)
+                print(f'Bought {inst.describe()} for {inst.premium}')
+            else:
+                inst.entered = False
+                print(f'Sold {inst.describe()} for {round(abs(order.avg_fill_price) * 100, 2)}')
+
+    def step_bank(self):
+        ''' Feed every detector the change of its close since the last round '''
+        x = np.empty(len(self.instruments))
+        for inst in self.instruments:
+            close = inst.closes(1)[-1]
+            x[inst.row] = (close - inst.fed_close) * 100
+            inst.fed_close = close
+            inst.fed = inst.n_bars()
+        self.bank.update(x)
+
+    def price(self, instruments):
+        ''' Spread mids by instrument. Every quote is subscribed before any
+        is waited on, spreads without a positive mid within quote_timeout
+        are left out '''
+        quotes = self.client.quotes
+        for inst in instruments:
+            quotes.get(inst.bag)
+        deadline = time.monotonic() + self.quote_timeout
+        mids = {}
+        for inst in instruments:
+            try:
+                mid = quotes.mid(inst.bag, timeout = max(deadline - time.monotonic(), 0.001))
+            except (TimeoutError, RequestError) as e:
+                print(f'{inst.symbol}: no spread quote, {e}')
+                continue
+            if mid > 0:
+                mids[inst] = mid
+        return mids
+
+    def round(self, fresh):
+        ''' The work of one candle for the instruments in fresh '''
+        p = self.params
+        now = datetime.now(ny)
+        with self.stage('bocd_update'):
+            self.step_bank()
+        cp_detected = self.bank.cp_detected
+
+        held, entries = [], []
+        for inst in fresh:
+            if inst.order is not None:
+                continue
+            if inst.entered:
+                held.append(inst)
+            elif inst.signal and inst.chain is not None:
+                try:
+                    inst.pick_legs(inst.closes(1)[-1])
+                except KeyError as e:
+                    print(f'{inst.symbol}: {e}')
+                    continue
+                entries.append(inst)
+            inst.signal = False
+
+        with self.stage('spread_price'):
+            mids = self.price(held + entries)
+
+        orders = []
+        for inst in held:
+            c = inst.closes(3)
+            falling = cp_detected[inst.row] and len(c) == 3 and c[-1] < c[-3]
+            pnl = inst in mids and abs(mids[inst] * 100) >= inst.premium * p['take_profit']
+            if pnl or falling or now - inst.trade_time > p['max_hold']:
+                orders.append((inst, 'SELL'))
+        orders += [(inst, 'BUY') for inst in entries]
+
+        with self.stage('order_submit'):
+            for inst, action in orders:
+                if inst not in mids:
+                    continue
+                print(f'{inst.symbol}: {action} {inst.describe()} at {mids[inst]}')
+                inst.order = self.client.orders.submit(inst.bag, action, mids[inst], schedule = self.schedule,
+                                                       order_id = next(self.order_ids))
+                if action == 'SELL':
+                    cp_detected[inst.row] = False
+        return orders
+
+    def run(self, end):
+        ''' Rounds until end, an aware datetime, or until stop is called '''
+        interval = self.params['bar_interval']
+        while not self.stopped.is_set() and datetime.now(ny) < end:
+            fresh = self.wait_round(1.25 * interval)
+            start = time.perf_counter()
+            self.settle()
+            if not fresh:
+                self.missed.inc()
+                continue
+            orders = self.round(fresh)
+            elapsed = time.perf_counter() - start
+            self.round_time.record(elapsed)
+            if elapsed > interval:
+                self.overruns.inc()
+            print(f'{datetime.now(ny):%X} {len(fresh)}/{len(self.instruments)} bars, {len(orders)} orders, '
+                  f'{sum(inst.entered for inst in self.instruments)} held, round {elapsed * 1e3:.0f} ms')
+        self.settle()
+
+    def stop(self):
+        self.stopped.set()
+        self.bar_event.set()
+
+    def close(self):
+        ''' Stop the streams and cancel working orders '''
+        for inst in self.instruments:
+            if inst.stream is not None:
+                self.stop_stream(inst)
+            if inst.order is not None and not inst.order.is_done():
+                self.client.orders.cancel(inst.order)
+
+    def positions(self):
+        ''' One row per instrument with its spread '''
+        return pd.DataFrame([{ 'symbol' : inst.symbol, 'entered' : inst.entered,
+                               'long_leg' : inst.strikes.get('long_leg'), 'short_leg' : inst.strikes.get('short_leg'),
+                               'premium' : inst.premium, 'trade_time' : inst.trade_time,
+                               'working' : inst.order is not None } for inst in self.instruments])
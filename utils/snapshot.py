@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:58:36 2026
+
+@author: alex shakaev
+"""
+
+''' Strategy state kept on disk between runs, so a restart picks up the
+position, recent bars and detector where the last run left them '''
+
+import os
+import pickle
+import time
+
+import numpy as np
+
+version = 1
+
+def detector_state(bocd):
+    ''' Run length posterior and model statistics of the active run lengths
+    of a TruncatedBOCD with a PreallocatedStudentT, without scratch buffers '''
+    model = bocd.observation_likelihood
+    return { 't' : bocd.t, 'n' : bocd.n, 'log_R' : bocd.log_R[: bocd.n].copy(),
+             'theta' : model.theta[:, model.head : model.head + model.n].copy(),
+             'prior' : model.prior.copy(), 'max_run_length' : bocd.length,
+             'changepoints' : list(bocd.changepoints), 'cp_detected' : bool(bocd.cp_detected) }
+
+def restore_detector(bocd, state):
+    ''' Load detector_state into a TruncatedBOCD made with the same
+    max_run_length and hazard, the prior comes from the state '''
+    if state['max_run_length'] != bocd.length:
+        raise ValueError(f"snapshot has max_run_length {state['max_run_length']}, detector {bocd.length}")
+    n = state['n']
+    bocd.t = state['t']
+    bocd.n = n
+    bocd.log_R[:] = -np.inf
+    bocd.log_R[:n] = state['log_R']
+    bocd.R[:] = 0
+    np.exp(bocd.log_R[:n], out = bocd.R[:n])
+    bocd.changepoints = list(state['changepoints'])
+    bocd.cp_detected = state['cp_detected']
+
+    model = bocd.observation_likelihood
+    theta = state['theta']
+    while theta.shape[1] >= model.capacity:
+        model.expand()
+    model.head = model.capacity
+    model.theta[:, model.head : model.head + theta.shape[1]] = theta
+    model.n = theta.shape[1]
+    model.prior = state['prior'].copy()
+    model.mu0, model.kappa0, model.alpha0, model.beta0 = (np.array([v]) for v in model.prior[:4])
+
+def account_matches(state, acc_df, exec_df, symbol = 'SPY'):
+    ''' True if the option positions of symbol in acc_df are the legs of the
+    snapshot and nothing was executed since it was taken, exec_df holding
+    only the executions after the snapshot '''
+    options = acc_df[(acc_df['Symbol'] == symbol) & (acc_df['SecType'] == 'OPT') & (acc_df['position'] != 0)]
+    held = dict(zip(options['ConID'].astype(int), options['position']))
+    expected = ({ state['con_ids']['long_leg'] : 1, state['con_ids']['short_leg'] : -1 }
+                if state['entered'] else {})
+    return held == expected and not len(exec_df)
+
+class Snapshot:
+    ''' State dict pickled to one file. It is written aside and renamed, so
+    a crash while saving leaves the previous snapshot. Snapshots older than
+    max_age seconds, from another version or unreadable are ignored '''
+
+    def __init__(self, path, max_age = 4 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+
+    def save(self, state):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump({ 'version' : version, 'time' : time.time(), **state }, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + '.tmp', self.path)
+
+    def load(self):
+        ''' The saved state, None if there is no usable one '''
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            print(f'Snapshot {self.path} unreadable: {e}')
+            return None
+        if state.get('version') != version:
+            print(f'Snapshot {self.path} is from another version, ignored')
+            return None
+        if time.time() - state['time'] > self.max_age:
+            print(f'Snapshot {self.path} is too old, ignored')
+            return None
+        return state
@@ -20,6 +20,16 @@ from ibapi.wrapper import EWrapper
 from ibapi.utils import iswrapper
 from ibapi.contract import Contract
 
+from utils.tables import AppendTable, KeyedTable, SpillLog, table_property
+from utils.async_client import AsyncClient
+from utils.dispatch import Dispatcher
+from utils.quotes import QuoteCache
+from utils.orders import OrderManager
+from utils.journal import Journal, callback_names
+from utils.chains import ChainCache
+from utils.metrics import instrument
+from utils.bar_store import parse_ib_dates
+
 spy_con = Contract()
 spy_con.symbol = 'SPY'
 spy_con.secType = 'STK'
@@ -35,10 +45,32 @@ def process_date(date_string):
     date_string = pd.to_datetime(date_string)
     return date_string
 
+# rows kept in memory per table when the client spills to disk
+default_retention = { 'data' : 20000, 'order_status_df' : 5000, 'open_df' : 5000, 'pos_df' : 5000,
+                      'exec_df' : 5000, 'comm_df' : 5000, 'pnl_df' : 5000 }
+
+def bar_table():
+    ''' 2 min bars with their indicators, one row per date '''
+    f8 = 'f8'
+    return KeyedTable('date', ['date', 'o', 'h', 'l', 'c', 'v', 'diff', 'sma', 'signal'],
+                      { 'date' : 'M8[ns]', 'o' : f8, 'h' : f8, 'l' : f8, 'c' : f8, 'v' : f8,
+                        'diff' : f8, 'sma' : f8, 'signal' : 'i8' })
+
 class Client(EWrapper, EClient):
     ''' Serves as the client and the wrapper '''
 
-    def __init__(self, addr, port, client_id):
+    data = table_property('data')
+    chain = table_property('chain')
+    order_status_df = table_property('order_status_df')
+    open_df = table_property('open_df')
+    pos_df = table_property('pos_df')
+    exec_df = table_property('exec_df')
+    comm_df = table_property('comm_df')
+    pnl_df = table_property('pnl_df')
+    acc_df = table_property('acc_df')
+
+    def __init__(self, addr, port, client_id, dispatch = False, n_workers = 1, queue_size = 10000,
+                 journal = None, metrics = None, spill = None, retention = None):
         EWrapper.__init__(self)
         EClient.__init__(self, self)
         self.funds = 0.0
@@ -50,30 +82,61 @@ class Client(EWrapper, EClient):
         self.expiry = None   
         
         self.spread = {}
-        self.data = pd.DataFrame(np.nan, index = range(1), columns = ['date', 'o', 'h', 'l', 'c', 'v', 'diff'])
-        self.chain = pd.DataFrame() #columns = ['symbol', 'expiry', 'strike', 'con_id'])
+        self.bar_store = None # completed bars are appended here when set
+        self.raw_bars = [] # bars of a request without a handler, dates parsed at its end
+        # objects that take over the callbacks of their request ids
+        self.req_handlers = {}
+        # objects told about callbacks that carry no request id, see notify
+        self.listeners = []
+        self.chains = ChainCache() # option chains by (symbol, expiry, right)
+        self.option_chain = None # chain the legs are picked from
         self.con_data = {}  
         self.con_ids = {}  
         self.bag_bid = {}
         self.bag_ask = {}
         
-        self.order_status_df = pd.DataFrame(np.nan, index = range(1), columns = ['orderId', 'status', 'filled', 'remaining', 
+        # callback tables, exposed as DataFrames by the properties above
+        f8, i8 = 'f8', 'i8'
+        self.tables = {
+            'data' : bar_table(),
+            'chain' : AppendTable(['symbol', 'expiry', 'strike', 'con_id'], { 'strike' : f8, 'con_id' : i8 }),
+            'order_status_df' : AppendTable(['orderId', 'status', 'filled', 'remaining', 
                                             'avgFillPrice', 'permId', 'parentId', 'lastFillPrice',
-                                            'clientId', 'whyHeld', 'mktCapPrice'])  
-        self.open_df = pd.DataFrame(np.nan, index = range(1), columns = [ 'PermId', 'ClientId', 'OrderId', 'Symbol',
-                                              'SecType', 'Action', 'OrderType', 'TotalQty', 'CashQty', 'LmtPrice',
-                                              'AuxPrice', 'Status'])                 
-        self.pos_df = pd.DataFrame(np.nan, index = range(1), columns = [ 'Symbol', 'SecType', 'ConID', 'Expiry',
-                                              'Strike', 'Currency', 'Position', 'Avg cost']) 
-        self.exec_df = pd.DataFrame(np.nan, index = range(1), columns = ['ReqId', 'PermId', 'Symbol', 'ConID', 'OrderID',
-                                                  'SecType', 'Currency', 'ExecId',
-                                                  'Time', 'Account', 'Exchange',
-                                                  'Side', 'Shares', 'Price',
-                                                  'AvPrice', 'cumQty', 'OrderRef'])
-        self.comm_df = pd.DataFrame(np.nan, index = range(1), columns = [ 'execId', 'commission', 'currency', 'realizedPNL'])                                                             
-        self.pnl_df = pd.DataFrame(np.nan, index = range(1), columns=['ReqId', 'DailyPnL', 'UnrealizedPnL', 'RealizedPnL'])
-        self.acc_df = pd.DataFrame(np.nan, index = range(1), columns=['Symbol', 'SecType',  'ConID', 'Expiry', 'Strike', 'Right', 
-                                            'position', 'MktPrice','MktValue', 'AvgCost', 'unrealized', 'realized' ])
+                                            'clientId', 'whyHeld', 'mktCapPrice'],
+                                            { 'orderId' : i8, 'filled' : f8, 'remaining' : f8, 'avgFillPrice' : f8,
+                                              'permId' : i8, 'parentId' : i8, 'lastFillPrice' : f8,
+                                              'clientId' : i8, 'mktCapPrice' : f8 }),
+            'open_df' : AppendTable([ 'PermId', 'ClientId', 'OrderId', 'Symbol',
+                                      'SecType', 'Action', 'OrderType', 'TotalQty', 'CashQty', 'LmtPrice',
+                                      'AuxPrice', 'Status'],
+                                    { 'PermId' : i8, 'ClientId' : i8, 'OrderId' : i8, 'TotalQty' : f8,
+                                      'CashQty' : f8, 'LmtPrice' : f8, 'AuxPrice' : f8 }),
+            'pos_df' : AppendTable([ 'Symbol', 'SecType', 'ConID', 'Expiry',
+                                     'Strike', 'Currency', 'Position', 'Avg cost'],
+                                   { 'ConID' : i8, 'Strike' : f8, 'Position' : f8, 'Avg cost' : f8 }),
+            'exec_df' : AppendTable(['ReqId', 'PermId', 'Symbol', 'ConID', 'OrderID',
+                                     'SecType', 'Currency', 'ExecId',
+                                     'Time', 'Account', 'Exchange',
+                                     'Side', 'Shares', 'Price',
+                                     'AvPrice', 'cumQty', 'OrderRef'],
+                                    { 'ReqId' : i8, 'PermId' : i8, 'ConID' : i8, 'OrderID' : i8,
+                                      'Shares' : f8, 'Price' : f8, 'AvPrice' : f8, 'cumQty' : f8 }),
+            'comm_df' : AppendTable([ 'execId', 'commission', 'currency', 'realizedPNL'],
+                                    { 'commission' : f8, 'realizedPNL' : f8 }),
+            'pnl_df' : AppendTable(['ReqId', 'DailyPnL', 'UnrealizedPnL', 'RealizedPnL'],
+                                   { 'ReqId' : i8, 'DailyPnL' : f8, 'UnrealizedPnL' : f8, 'RealizedPnL' : f8 }),
+            'acc_df' : KeyedTable('ConID', ['Symbol', 'SecType',  'ConID', 'Expiry', 'Strike', 'Right', 
+                                            'position', 'MktPrice','MktValue', 'AvgCost', 'unrealized', 'realized' ],
+                                  { 'ConID' : i8, 'Strike' : f8, 'position' : f8, 'MktPrice' : f8, 'MktValue' : f8,
+                                    'AvgCost' : f8, 'unrealized' : f8, 'realized' : f8 }) }
+          
+        # With a spill directory the tables in retention keep only their latest
+        # rows in memory, older ones are appended to files there, see AppendTable.history
+        self.spill = None
+        if spill is not None:
+            self.spill = SpillLog(spill)
+            for name, rows in (default_retention if retention is None else retention).items():
+                self.tables[name].bound(rows, self.spill, name)
           
         self.exec_event = Event()
         self.price_event = Event()
@@ -81,7 +144,33 @@ class Client(EWrapper, EClient):
         self.account_event = Event()
         self.bag_event = Event()
         self.id_event = Event()
+        self.bar_event = Event() # set for every closed bar when streaming
+        self.aio = AsyncClient(self)
+        self.quotes = QuoteCache(self)
+        self.orders = OrderManager(self)
+        
+        # In dispatch mode the client thread only decodes messages and queues
+        # the callbacks below, which are run by the dispatcher's workers
+        names = [name for name in vars(Client) if name in callback_names]
+        self.dispatcher = None
+        if dispatch:
+            self.dispatcher = Dispatcher(self, names, n_workers, queue_size)
+        
+        # With a metrics registry the time spent in each callback is recorded
+        self.metrics = metrics
+        if metrics is not None:
+            instrument(self, metrics, names)
+        
+        # Every callback is recorded to the journal file as it is received
+        self.journal = None
+        if journal is not None:
+            self.journal = Journal(journal)
+            self.journal.attach(self)
     
+        # Without an address the client is not connected, journals can be replayed into it
+        if addr is None:
+            return
+        
         # Connect to TWS
         self.connect(addr, port, client_id)
         
@@ -89,11 +178,26 @@ class Client(EWrapper, EClient):
         thread = Thread(target=self.run)
         thread.start()
     
+    def disconnect(self):
+        super().disconnect()
+        if self.journal is not None:
+            self.journal.close()
+        if self.spill is not None:
+            self.spill.close()
+    
+    def notify(self, name, *args):
+        ''' Pass a callback on to the listeners that implement it '''
+        for listener in self.listeners:
+            method = getattr(listener, name, None)
+            if method is not None:
+                method(*args)
+    
     @iswrapper
     def nextValidId(self, orderId):
         super().nextValidId(orderId)
         self.nextValidOrderId = orderId 
         self.id_event.set()        
+        self.notify('nextValidId', orderId)
         # print("NextValidId:", orderId)
         
     @iswrapper
@@ -101,10 +205,16 @@ class Client(EWrapper, EClient):
         if tag == 'AvailableFunds':
             print('Account {}: available funds = {}'.format(acct, val))
             self.funds = float(val)
+            
+    @iswrapper
+    def accountSummaryEnd(self, req_id):
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].accountSummaryEnd(req_id)
+            
     @iswrapper                
     def accountDownloadEnd(self, accountName):
-        self.acc_df = self.acc_df.iloc[1:, :]
         self.account_event.set()
+        self.notify('accountDownloadEnd', accountName)
         # print("AccountDownloadEnd. Account:", accountName)
     
     @iswrapper
@@ -118,20 +228,13 @@ class Client(EWrapper, EClient):
                         'Expiry'  : con.lastTradeDateOrContractMonth, 'Strike' : con.strike, 'Right' : con.right, 'position' : position, 'MktPrice' : marketPrice,
                       'MktValue' : marketValue, 'AvgCost' : averageCost, 'unrealized' : unrealizedPNL, 
                       'realized' : realizedPNL }       
-        if con.conId in self.acc_df.loc[:, 'ConID'].values:
-            #drop this row and populate with new info 
-            # ind = self.acc_df.index[self.acc_df.loc[:, 'ConID'] == con.conId]
-            ind =  self.acc_df.loc[ :,'ConID'].loc[lambda x: x==con.conId].index
-            self.acc_df = self.acc_df.drop(self.acc_df.iloc[ind].index, axis = 0)
-            self.acc_df = pd.concat([self.acc_df, pd.DataFrame.from_records([acc_info])], ignore_index=True) 
-        else:  
-            self.acc_df = pd.concat([self.acc_df, pd.DataFrame.from_records([acc_info])], ignore_index=True)
+        self.tables['acc_df'].upsert(acc_info)
          
     @iswrapper
     def pnl(self, req_id, dailyPnL, unrealizedPnL, realizedPnL):
         super().pnl(req_id, dailyPnL, unrealizedPnL, realizedPnL)
         pnl_info = {"ReqId":req_id, "DailyPnL": dailyPnL, "UnrealizedPnL": unrealizedPnL, "RealizedPnL": realizedPnL}
-        self.pnl_df = pd.concat([self.pnl_df, pd.DataFrame.from_records([pnl_info])], ignore_index=True) 
+        self.tables['pnl_df'].append(pnl_info)
         
     @iswrapper        
     def pnlSingle(self, req_id, pos, dailyPnL,
@@ -146,31 +249,55 @@ class Client(EWrapper, EClient):
     def currentTime(self, time):        
         self.time = datetime.fromtimestamp(time, tz = ny)  
         print(f'Current time:{self.time : %Y-%m-%d %X}')
+        self.notify('currentTime', time)
     
+    def load_history(self, store, n_bars = 1000):
+        ''' Seed self.data with the last n_bars from a bar store '''
+        bars = store.tail(n_bars, ['date', 'o', 'h', 'l', 'c', 'v'])
+        if len(bars):
+            bars['diff'] = np.nan
+            self.data = bars
+
     @iswrapper
     def historicalData(self, req_id, bar):   
-        hist_bar = { 'date' : bar.date, 'o' : bar.open, 'h' : bar.high, 'l' : bar.low, 'c' : bar.close,
-           'v' : bar.volume, 'diff' : ... }
-        if bar.date not in self.data['date'].values:
-            self.data = pd.concat([self.data, pd.DataFrame.from_records([hist_bar])], ignore_index=True) 
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].historicalData(req_id, bar)
+            return
+        self.raw_bars.append((bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume))
            
     @iswrapper   
     def historicalDataEnd(self, req_id, start, end):        
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].historicalDataEnd(req_id, start, end)
+            return
         self.reqCurrentTime()      
         
-        ind = self.data.index[-1]
-        self.data = self.data.drop(ind, axis = 0) #incomplete candle 
+        bars, self.raw_bars = self.raw_bars, []
+        if bars:
+            table = self.tables['data']
+            for date, (_, o, h, l, c, v) in zip(parse_ib_dates([bar[0] for bar in bars]), bars):
+                table.insert({ 'date' : date, 'o' : o, 'h' : h, 'l' : l, 'c' : c, 'v' : v })
+        self.tables['data'].pop() #incomplete candle 
+        data = self.data.copy()
+        if self.bar_store is not None:
+            self.bar_store.append(data.dropna(subset = ['date']))
        
         # Check if price/implied vol is falling
        
-        differenced = self.data['c'].diff(1).copy(deep = False)
-        self.data['diff'] = differenced*100
+        differenced = data['c'].diff(1).copy(deep = False)
+        data['diff'] = differenced*100
                     
-        self.data['sma'] = self.data['c'].rolling(window = 50).mean()
-        if self.data['sma'].iloc [-1] < self.data['c'].iloc [-1]:
+        data['sma'] = data['c'].rolling(window = 50).mean()
+        if data['sma'].iloc [-1] < data['c'].iloc [-1]:
             self.signal = True
-        self.data['signal'] = np.where(self.data['sma'] < self.data['c'], 1, 0)   
+        data['signal'] = np.where(data['sma'] < data['c'], 1, 0)   
+        self.data = data
         
+    @iswrapper
+    def historicalDataUpdate(self, req_id, bar):
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].historicalDataUpdate(req_id, bar)
+
     @iswrapper
     def openOrder( self, order_id, contract, order, state):         
         super().openOrder(order_id, contract, order, state)
@@ -180,8 +307,9 @@ class Client(EWrapper, EClient):
                           "TotalQty": order.totalQuantity, "CashQty": order.cashQty, 
                           "LmtPrice": order.lmtPrice, "AuxPrice": order.auxPrice, "Status": state.status }       
              
-        self.open_df = pd.concat([self.open_df, pd.DataFrame.from_records([open_order_info])], ignore_index=True) 
+        self.tables['open_df'].append(open_order_info)
         print('Status of {} order: {}'.format(contract.symbol, state.status))
+        self.notify('openOrder', order_id, contract, order, state)
          
     @iswrapper
     def orderStatus(self, orderId , status, filled, remaining, avgFillPrice, permId, 
@@ -197,7 +325,9 @@ class Client(EWrapper, EClient):
             filled_price =  avgFillPrice
             print(f'Order filled at {filled_price}\n')
             
-        self.order_status_df = pd.concat([self.order_status_df, pd.DataFrame.from_records([order_status_info])], ignore_index=True)  
+        self.tables['order_status_df'].append(order_status_info)
+        self.notify('orderStatus', orderId, status, filled, remaining, avgFillPrice, permId, 
+                    parentId, lastFillPrice, clientId, whyHeld, mktCapPrice)
                                
     @iswrapper
     def position(self, acct, con, position, avgCost):
@@ -207,7 +337,7 @@ class Client(EWrapper, EClient):
                     "Expiry" : con.lastTradeDateOrContractMonth, "Strike" : con.strike,
                     "Currency" : con.currency, "Position" : position,
                     "Avg cost" : avgCost }       
-        self.pos_df = pd.concat([self.pos_df, pd.DataFrame.from_records([pos_info])], ignore_index=True) 
+        self.tables['pos_df'].append(pos_info)
         
     @iswrapper
     def positionEnd(self):
@@ -216,6 +346,9 @@ class Client(EWrapper, EClient):
    
     @iswrapper
     def error(self, req_id, errorCode, errorString, advancedOrderRejectJson = ''):        
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].error(req_id, errorCode, errorString)
+        self.notify('error', req_id, errorCode, errorString)
         self.error_code = errorCode
         self.errorString = errorString   
         if errorCode!=2100:
@@ -223,17 +356,25 @@ class Client(EWrapper, EClient):
     
     @iswrapper
     def contractDetails(self, req_id, details):  
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].contractDetails(req_id, details)
+            return
+        self.add_to_chain(details)
+
+    def add_to_chain(self, details):
+        ''' Append the contract of a ContractDetails to client.chain '''
         con_info = { 'symbol' : details.contract.localSymbol, 'expiry' : details.contract.lastTradeDateOrContractMonth,
                     'strike' : details.contract.strike, 'con_id' : details.contract.conId }
              
-        self.chain = pd.concat([self.chain, pd.DataFrame.from_records([con_info ])], ignore_index=True)    
+        self.tables['chain'].append(con_info)
     
     @iswrapper   
     def contractDetailsEnd(self, req_id):
         super().contractDetailsEnd(req_id)
         # print("ContractDetailsEnd. ReqId:", req_id)                    
-        self.strikes = np.array(self.chain.loc[:, 'strike'].sort_values())
         self.chain_event.set()        
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].contractDetailsEnd(req_id)
                
     @iswrapper    
     def execDetails(self, req_id, con, execution):
@@ -246,27 +387,31 @@ class Client(EWrapper, EClient):
                       "Exchange" : execution.exchange, "Side" : execution.side, "Shares" : execution.shares,
                       "Price" : execution.price, "AvPrice" : execution.avgPrice, "cumQty" : execution.cumQty,
                       "OrderRef" : execution.orderRef }        
-        self.exec_df = pd.concat([self.exec_df, pd.DataFrame.from_records([exec_info])], ignore_index=True)        
+        self.tables['exec_df'].append(exec_info)
+        self.notify('execDetails', req_id, con, execution)
         
     @iswrapper
     def execDetailsEnd(self, req_id):
         super().execDetailsEnd(req_id)
         # print("\n\nExecDetailsEnd. ReqId:", req_id)
-        self.exec_df.loc[:, 'Time'] =  self.exec_df.loc[:, 'Time'].apply(process_date)
+        exec_df = self.exec_df.copy()
+        exec_df['Time'] = exec_df['Time'].apply(process_date)
         try:
-            self.exec_df.loc[:, 'Time'] =  pd.to_datetime(self.exec_df.loc[:, 'Time']).dt.tz_localize(ny)
+            exec_df['Time'] = pd.to_datetime(exec_df['Time']).dt.tz_localize(ny)
         except AttributeError:
             print('Execution dataframe is empty. Please open trades tab in activity monitor')
         #     # self.disconnect()
-        self.exec_df = self.exec_df.sort_values(by=['Time'], ascending=True)        
+        self.exec_df = exec_df.sort_values(by=['Time'], ascending=True)        
         self.exec_event.set()
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].execDetailsEnd(req_id)
             
     @iswrapper
     def commissionReport(self, commissionReport):
         super().commissionReport(commissionReport)
         comm_info = { "execId" : commissionReport.execId, "commission" : commissionReport.commission,
                            "currency" : commissionReport.currency, "realizedPNL" : commissionReport.realizedPNL }
-        self.comm_df =  pd.concat([self.comm_df, pd.DataFrame.from_records([comm_info])], ignore_index=True) 
+        self.tables['comm_df'].append(comm_info)
         # print("CommissionReport.", commissionReport)
         
     @iswrapper
@@ -280,6 +425,9 @@ class Client(EWrapper, EClient):
     @iswrapper            
     def tickPrice(self, req_id, tickType, price, attrib):
         super().tickPrice(req_id, tickType, price, attrib)
+        if req_id in self.req_handlers:
+            self.req_handlers[req_id].tickPrice(req_id, tickType, price, attrib)
+            return
         if req_id == 3:
             if tickType == 4:                
                 self.current_price = price    
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:10:36 2026
+
+@author: alex shakaev
+"""
+
+''' Streaming 2 min bars with incrementally updated indicators '''
+
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.spy_client import process_date
+from utils.bar_store import parse_ib_dates
+from utils.async_client import is_warning
+
+def bar_epoch(date):
+    ''' Seconds since the epoch of an IB bar date, e.g. "20231006 09:32:00 US/Eastern" '''
+    parts = date.split()
+    stamp = pd.Timestamp(' '.join(parts[:2]))
+    return stamp.tz_localize(parts[2] if len(parts) > 2 else 'US/Eastern').timestamp()
+
+class BarIndicators:
+    ''' diff, sma and signal of the latest close in O(1) per bar. The last
+    lookback closes are kept in a ring buffer with their running sum '''
+
+    def __init__(self, lookback = 50):
+        self.lookback = lookback
+        self.closes = np.zeros(lookback)
+        self.i = 0
+        self.count = 0
+        self.total = 0.0
+        self.prev = math.nan
+
+    def seed(self, closes):
+        for close in closes[-self.lookback:]:
+            self.update(close)
+
+    def update(self, close):
+        ''' Returns (diff, sma, signal) for the new close '''
+        diff = (close - self.prev) * 100
+        self.total += close - self.closes[self.i]
+        self.closes[self.i] = close
+        self.i += 1
+        if self.i == self.lookback:
+            # resum once per lap so rounding errors don't build up
+            self.i = 0
+            self.total = self.closes.sum()
+        self.count += 1
+        self.prev = close
+        sma = self.total / self.lookback if self.count >= self.lookback else math.nan
+        return diff, sma, int(sma < close)
+
+class BarStream:
+    ''' Keeps client.data up to date from a keepUpToDate historical data
+    request. IB resends the forming bar every few seconds; a bar is closed
+    when the first update of the next one arrives. Each closed bar is
+    appended to client.data with its indicators, written to the bar store
+    and announced by setting client.bar_event. With a target the bars go to
+    its data, bar_store, signal and bar_event instead of the client's, so
+    several streams can share one client '''
+
+    def __init__(self, client, contract, req_id = 4, duration = '2 D',
+                 bar_size = '2 mins', what_to_show = 'TRADES', lookback = 50, target = None):
+        self.client = client
+        self.target = client if target is None else target
+        self.contract = contract
+        self.req_id = req_id
+        self.duration = duration
+        self.bar_size = bar_size
+        self.what_to_show = what_to_show
+        self.indicators = BarIndicators(lookback)
+        self.loaded = False
+        self.failed = None # (code, message) of an error that ended the request
+        self.bars = []
+        self.pending = None # bar still forming
+
+    def start(self):
+        self.client.req_handlers[self.req_id] = self
+        # endDateTime has to be empty when keepUpToDate is set
+        self.client.reqHistoricalData(self.req_id, self.contract, '', self.duration,
+                                      self.bar_size, self.what_to_show, 1, 1, True, [])
+
+    def stop(self):
+        self.client.cancelHistoricalData(self.req_id)
+        self.client.req_handlers.pop(self.req_id, None)
+
+    @staticmethod
+    def to_row(bar):
+        return { 'date' : process_date(bar.date), 'o' : bar.open, 'h' : bar.high,
+                 'l' : bar.low, 'c' : bar.close, 'v' : float(bar.volume) }
+
+    # callbacks, called from the client thread
+
+    def historicalData(self, req_id, bar):
+        self.bars.append(bar)
+
+    def historicalDataEnd(self, req_id, start, end):
+        ''' Indicators are computed over the whole history once, updates
+        only touch the newest bar '''
+        client = self.target
+        bars, self.bars = self.bars, []
+        if not bars:
+            return
+        self.pending = bars.pop()
+        table = client.tables['data']
+        for date, bar in zip(parse_ib_dates([bar.date for bar in bars]), bars):
+            table.insert({ 'date' : date, 'o' : bar.open, 'h' : bar.high,
+                           'l' : bar.low, 'c' : bar.close, 'v' : float(bar.volume) })
+
+        data = client.data.copy()
+        if client.bar_store is not None:
+            client.bar_store.append(data.dropna(subset = ['date']))
+        data['diff'] = data['c'].diff(1) * 100
+        data['sma'] = data['c'].rolling(window = self.indicators.lookback).mean()
+        data['signal'] = np.where(data['sma'] < data['c'], 1, 0)
+        if len(data) and data['signal'].iloc[-1]:
+            client.signal = True
+        client.data = data
+
+        self.indicators.seed(data['c'].values)
+        self.loaded = True
+        client.bar_event.set()
+
+    def historicalDataUpdate(self, req_id, bar):
+        if not self.loaded:
+            return
+        # only a new date is parsed, updates of the forming bar are just kept
+        if self.pending is not None and bar.date != self.pending.date:
+            self.close_bar(self.to_row(self.pending))
+            if self.client.metrics is not None:
+                # how long after its start the first update of a new bar arrived
+                self.client.metrics.histogram('bar_arrival_delay_seconds').record(time.time() - bar_epoch(bar.date))
+        self.pending = bar
+
+    def close_bar(self, bar):
+        client = self.target
+        if bar['date'] in client.tables['data']:
+            return
+        bar['diff'], bar['sma'], bar['signal'] = self.indicators.update(bar['c'])
+        client.tables['data'].insert(bar)
+        if client.bar_store is not None:
+            client.bar_store.append({ 'date' : np.array([bar['date'].to_datetime64()]),
+                                      'o' : [bar['o']], 'h' : [bar['h']], 'l' : [bar['l']],
+                                      'c' : [bar['c']], 'v' : [bar['v']] })
+        if bar['signal']:
+            client.signal = True
+        client.bar_event.set()
+
+    def error(self, req_id, error_code, error_string):
+        # the client prints errors, a broken stream is restarted by the caller
+        if not is_warning(error_code):
+            self.failed = (error_code, error_string)
+            self.target.bar_event.set()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:12:41 2026
+
+@author: alex shakaev
+"""
+
+''' Runs BOCD and strategy parameter grids over a process pool '''
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from utils.bocd import TruncatedBOCD, PreallocatedStudentT, constant_hazard
+
+default_params = { 'lambda_' : 150, 'alpha' : 1, 'beta' : 1, 'kappa' : 1, 'mu' : 0,
+                   'cp_threshold' : 0.35, 'max_run_length' : 1000,
+                   'lookback_period' : 50, 'hold_bars' : 5 * 195 }
+
+# arrays shared with the worker processes, filled by attach
+shared = {}
+
+def param_grid(**params):
+    ''' All combinations of the given parameter lists, as a list of dicts '''
+    keys = list(params)
+    return [dict(zip(keys, values)) for values in product(*params.values())]
+
+def attach(files):
+    ''' Pool initializer, memory maps the shared arrays in the worker '''
+    for name, path in files.items():
+        shared[name] = np.load(path, mmap_mode = 'r')
+
+def detect_changepoints(diff, params):
+    ''' Changepoint indices of the differenced series '''
+    max_run_length = params['max_run_length']
+    bocd = TruncatedBOCD(partial(constant_hazard, params['lambda_']),
+                         PreallocatedStudentT(params['alpha'], params['beta'], params['kappa'],
+                                              params['mu'], max_run_length + 1),
+                         max_run_length, cp_threshold = params['cp_threshold'])
+    return bocd.fit(diff).changepoints
+
+def evaluate_strategy(data, params):
+    ''' Changepoint counts and a quick backtest on the underlying: enter when
+    close > sma, exit on a downtrend changepoint or after hold_bars '''
+    close = np.asarray(data['c'], dtype = np.float64)
+    diff = np.diff(close, prepend = close[0]) * 100
+    cps = detect_changepoints(diff, params)
+    up = close[cps] > close[cps - 2]
+
+    sma = pd.Series(close).rolling(window = params['lookback_period']).mean().values
+    signal = np.nan_to_num(sma) < close
+    down = np.zeros(len(close), dtype = bool)
+    down[cps[~up]] = True
+
+    pnl = []
+    entry = None
+    for i in range(len(close)):
+        if entry is None:
+            if signal[i]:
+                entry = i
+        elif down[i] or i - entry >= params['hold_bars']:
+            pnl.append(close[i] - close[entry])
+            entry = None
+    pnl = np.array(pnl)
+
+    return { 'n_changepoints' : len(cps), 'n_up' : int(up.sum()), 'n_down' : int((~up).sum()),
+             'signal_frac' : signal.mean(), 'n_trades' : len(pnl),
+             'total_pnl' : pnl.sum(), 'win_rate' : (pnl > 0).mean() if len(pnl) else np.nan }
+
+def run_params(evaluate, params):
+    ''' Runs in the worker on the shared arrays '''
+    return evaluate(shared, { **default_params, **params })
+
+def run_sweep(data, grid, evaluate = evaluate_strategy, n_workers = None, chunksize = 1):
+    ''' Evaluate every parameter combination in grid over a process pool.
+    data is a dict of arrays, e.g. {'c' : close}. The arrays are written to
+    .npy files once and memory mapped by the workers instead of being
+    pickled with every task. evaluate must be a module level function
+    taking (data, params) and returning a dict of metrics '''
+    tmp_dir = tempfile.mkdtemp(prefix = 'sweep_')
+    try:
+        files = {}
+        for name, values in data.items():
+            files[name] = os.path.join(tmp_dir, f'{name}.npy')
+            np.save(files[name], np.ascontiguousarray(values))
+
+        with ProcessPoolExecutor(n_workers, initializer = attach, initargs = (files,)) as pool:
+            results = list(pool.map(partial(run_params, evaluate), grid, chunksize = chunksize))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+
+    return pd.DataFrame([{ **params, **metrics } for params, metrics in zip(grid, results)])
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:05:48 2026
+
+@author: alex shakaev
+"""
+
+''' Append buffers for the tables filled by Client callbacks '''
+
+import os
+import pickle
+import queue
+import struct
+import zlib
+from threading import RLock, Thread, Event
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+spill_magic = b'IBT1'
+frame_header = struct.Struct('<I')
+
+def missing(dtype):
+    ''' Fill value for a column of this dtype '''
+    if dtype.kind == 'f':
+        return np.nan
+    if dtype.kind in 'mM':
+        return np.datetime64('NaT') if dtype.kind == 'M' else np.timedelta64('NaT')
+    if dtype.kind in 'iub':
+        return 0
+    return None
+
+def canonical(key):
+    ''' Hashable key that compares equal across numpy/pandas/python types '''
+    if isinstance(key, (np.datetime64, datetime)):
+        return pd.Timestamp(key)
+    if isinstance(key, np.generic):
+        return key.item()
+    return key
+
+class SpillLog:
+    ''' Rows moved out of bounded tables, appended to one file per table
+    under path. Tables hand over chunks of column arrays and return; a
+    writer thread pickles and compresses each chunk and appends it as a
+    length prefixed frame, as the journal does, so a torn last frame is
+    ignored when read. Sessions spilling to the same path are appended '''
+
+    def __init__(self, path, level = 1):
+        os.makedirs(path, exist_ok = True)
+        self.path = path
+        self.level = level
+        self.queue = queue.SimpleQueue()
+        self.files = {}
+        self.rows = 0
+        self.bytes = 0
+        self.closed = Event()
+        self.thread = Thread(target = self.write, daemon = True)
+        self.thread.start()
+
+    def file(self, name):
+        return os.path.join(self.path, f'{name}.spill')
+
+    def put(self, name, columns):
+        self.queue.put((name, columns))
+
+    def write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                for f in self.files.values():
+                    f.close()
+                self.closed.set()
+                return
+            if isinstance(item, Event):
+                item.set()
+                continue
+            name, columns = item
+            f = self.files.get(name)
+            if f is None:
+                f = self.files[name] = open(self.file(name), 'ab')
+                if f.tell() == 0:
+                    f.write(spill_magic)
+            blob = zlib.compress(pickle.dumps(columns, pickle.HIGHEST_PROTOCOL), self.level)
+            f.write(frame_header.pack(len(blob)) + blob)
+            f.flush()
+            self.rows += len(next(iter(columns.values()), []))
+            self.bytes += frame_header.size + len(blob)
+
+    def flush(self, timeout = 10):
+        ''' Wait until every chunk handed over so far is written '''
+        if self.closed.is_set():
+            return
+        done = Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout = 10):
+        self.queue.put(None)
+        self.closed.wait(timeout)
+
+    def read(self, name):
+        ''' Every row spilled by table name, oldest first '''
+        self.flush()
+        return read_spill(self.file(name))
+
+def read_spill(path):
+    ''' DataFrame of the rows in a spill file, empty if there is none '''
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    chunks = []
+    with open(path, 'rb') as f:
+        if f.read(len(spill_magic)) != spill_magic:
+            raise ValueError(f'{path} is not a spill file')
+        while True:
+            header = f.read(frame_header.size)
+            if len(header) < frame_header.size:
+                break
+            size, = frame_header.unpack(header)
+            blob = f.read(size)
+            if len(blob) < size:
+                break
+            chunks.append(pd.DataFrame(pickle.loads(zlib.decompress(blob))))
+    return pd.concat(chunks, ignore_index = True) if chunks else pd.DataFrame()
+
+class AppendTable:
+    ''' Rows accumulate in preallocated numpy columns that double when full,
+    so an append costs the same no matter how long the session runs. The
+    DataFrame is built only when asked for and cached until the next change,
+    callers get copies of it. A bounded table keeps only its latest rows,
+    see bound '''
+
+    def __init__(self, columns, dtypes = None, capacity = 64):
+        dtypes = dtypes or {}
+        self.dtypes = { name : np.dtype(dtypes.get(name, object)) for name in columns }
+        self.capacity = capacity
+        self.n = 0
+        self.columns = { name : np.empty(capacity, dtype) for name, dtype in self.dtypes.items() }
+        self.cache = None
+        self.lock = RLock()
+        self.retain = None # rows kept in memory, all when None
+        self.spill = None
+        self.name = None
+        self.spilled = 0
+
+    def __len__(self):
+        return self.n
+
+    def grow(self):
+        self.capacity *= 2
+        for name, values in self.columns.items():
+            grown = np.empty(self.capacity, values.dtype)
+            grown[: self.n] = values[: self.n]
+            self.columns[name] = grown
+
+    def add_column(self, name, dtype = object):
+        dtype = np.dtype(dtype)
+        self.dtypes[name] = dtype
+        self.columns[name] = np.full(self.capacity, missing(dtype), dtype)
+        self.cache = None
+
+    def extend(self, row):
+        ''' Add the columns of row the table doesn't have, e.g. after a
+        replace with fewer columns, missing in the rows before '''
+        for name, value in row.items():
+            if name not in self.columns:
+                dtype = np.asarray(value).dtype
+                self.add_column(name, dtype if dtype.kind in 'biufmM' else object)
+
+    def bound(self, retain, spill = None, name = None):
+        ''' Keep at least the latest retain rows in memory. When the buffer
+        fills up past twice that, the older rows are handed to spill as one
+        chunk and the rest moved to the front, so memory stays bounded and
+        the copying is spread over retain appends. Without a spill the
+        older rows are dropped '''
+        with self.lock:
+            self.retain = retain
+            self.spill = spill
+            self.name = name
+
+    def compact(self):
+        ''' Move all but the latest retain rows out of memory '''
+        with self.lock:
+            k = self.n - self.retain
+            if k <= 0:
+                return
+            if self.spill is not None:
+                self.spill.put(self.name, { name : values[:k].copy() for name, values in self.columns.items() })
+            for values in self.columns.values():
+                values[: self.retain] = values[k : self.n]
+            self.n = self.retain
+            self.spilled += k
+            self.cache = None
+
+    def history(self):
+        ''' Spilled rows followed by the ones in memory. Rows dropped by
+        clear or replace are in neither '''
+        frames = [self.spill.read(self.name)] if self.spill is not None else []
+        frames = [frame for frame in frames if len(frame)] + [self.frame()]
+        return pd.concat(frames, ignore_index = True) if len(frames) > 1 else frames[0]
+
+    def append(self, row):
+        ''' Append a dict of column values, columns not in row are left missing
+        and new ones are added '''
+        with self.lock:
+            self.extend(row)
+            if self.n == self.capacity:
+                if self.retain is not None and self.n >= 2 * self.retain:
+                    self.compact()
+                else:
+                    self.grow()
+            i = self.n
+            for name, values in self.columns.items():
+                values[i] = row.get(name, missing(values.dtype))
+            self.n += 1
+            self.cache = None
+            return i
+
+    def set_row(self, i, row):
+        ''' Overwrite the columns of row i that are in row '''
+        with self.lock:
+            self.extend(row)
+            for name, value in row.items():
+                self.columns[name][i] = value
+            self.cache = None
+
+    def pop(self):
+        ''' Drop the last row '''
+        with self.lock:
+            if self.n:
+                self.n -= 1
+                self.cache = None
+
+    def clear(self):
+        with self.lock:
+            self.n = 0
+            self.cache = None
+
+    def frame(self):
+        ''' Table contents as a DataFrame, a copy that can be changed without
+        touching the table '''
+        with self.lock:
+            if self.cache is None:
+                self.cache = pd.DataFrame({ name : values[: self.n].copy()
+                                            for name, values in self.columns.items() })
+            return self.cache.copy()
+
+    def replace(self, df):
+        ''' Take over the contents and columns of a DataFrame '''
+        with self.lock:
+            self.capacity = max(64, 2 * len(df))
+            self.n = len(df)
+            self.columns = {}
+            self.dtypes = {}
+            for name in df.columns:
+                dtype = df[name].dtype
+                # tz aware dates and other pandas types are kept as objects
+                dtype = dtype if isinstance(dtype, np.dtype) else np.dtype(object)
+                values = np.empty(self.capacity, dtype)
+                values[: self.n] = df[name].to_numpy(dtype = dtype)
+                self.columns[name] = values
+                self.dtypes[name] = dtype
+            self.cache = df.copy()
+
+class KeyedTable(AppendTable):
+    ''' AppendTable with at most one row per value of the key column. The
+    index maps a key to its row, or to None once the row is spilled, so
+    the key stays taken in history '''
+
+    def __init__(self, key, columns, dtypes = None, capacity = 64):
+        super().__init__(columns, dtypes, capacity)
+        self.key = key
+        self.index = {}
+
+    def __contains__(self, key):
+        return canonical(key) in self.index
+
+    def upsert(self, row):
+        ''' Update the row with the same key or append a new one. A spilled
+        row can't be changed, the update is dropped '''
+        with self.lock:
+            key = canonical(row[self.key])
+            if key not in self.index:
+                self.index[key] = self.append(row)
+            elif self.index[key] is not None:
+                self.set_row(self.index[key], row)
+
+    def insert(self, row):
+        ''' Append the row unless its key is already there, returns True if appended '''
+        with self.lock:
+            key = canonical(row[self.key])
+            if key in self.index:
+                return False
+            self.index[key] = self.append(row)
+            return True
+
+    def pop(self):
+        with self.lock:
+            if self.n:
+                self.index.pop(canonical(self.columns[self.key][self.n - 1]), None)
+                super().pop()
+
+    def spilled_keys(self):
+        return { key : None for key, i in self.index.items() if i is None }
+
+    def compact(self):
+        with self.lock:
+            k = self.n - self.retain
+            if k <= 0:
+                return
+            for key in self.columns[self.key][:k]:
+                self.index[canonical(key)] = None
+            super().compact()
+            for i, key in enumerate(self.columns[self.key][: self.n]):
+                self.index[canonical(key)] = i
+
+    def clear(self):
+        with self.lock:
+            self.index = self.spilled_keys()
+            super().clear()
+
+    def replace(self, df):
+        with self.lock:
+            super().replace(df)
+            keys = self.columns[self.key][: self.n] if self.key in self.columns else []
+            self.index = self.spilled_keys()
+            self.index.update((canonical(k), i) for i, k in enumerate(keys))
+
+def table_property(name):
+    ''' Exposes self.tables[name] as a DataFrame attribute. Reading it gives
+    a copy, assigning a DataFrame replaces the table contents '''
+    def get(self):
+        return self.tables[name].frame()
+    def set(self, df):
+        self.tables[name].replace(df)
+    return property(get, set)
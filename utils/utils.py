@@ -7,15 +7,25 @@ Created on Wed Oct  4 21:24:43 2023
 
 import numpy as np
 import time  
-import pyqstrat as pq
 from ibapi.order import Order
 from ibapi.contract import Contract, ComboLeg
 from ibapi.execution import ExecutionFilter
 from utils.spy_client import spy_con
+from utils.streaming import BarStream
+from utils.chains import OptionChain
+from utils.async_client import RequestError
 
-def check_signal(client, con, event):
+def check_signal(client, con, event, stream = True):
     ''' Check SPY sma and price to determine signal ''' 
     
+    if stream:
+        # bars and indicators are pushed by TWS as candles close
+        bars = BarStream(client, con)
+        bars.start()
+        event.wait()
+        bars.stop()
+        return
+    
     while not event.is_set():
         starttime = time.time()           
         client.reqHistoricalData(2, con, '', '2 D', '2 mins',
@@ -27,10 +37,7 @@ def get_exec_info(client, exec_filter = ExecutionFilter()):
     ''' Get execution dataframe '''    
     
     client.exec_df = client.exec_df[0:0]
-    client.reqExecutions(2, exec_filter)   
-    while not client.exec_event.is_set():
-        client.exec_event.wait() 
-    client.exec_event.clear()     
+    client.aio.run(client.aio.executions(exec_filter))
 
 def get_trade_details(client, flag = True): 
     ''' Get tradetime, commission and premium from execution dataframe '''  
@@ -57,31 +64,31 @@ def get_trade_details(client, flag = True):
 def get_current_price(client):    
     ''' Get current price of SPY '''    
    
-    client.reqMktData(3, spy_con, "", False, False, [])    
-    while not client.price_event.is_set():
-        client.price_event.wait() 
-    client.price_event.clear()  
-    client.cancelMktData(3)      
+    client.current_price = client.quotes.last(spy_con)
     print(f'\nSPY current price - {client.current_price}\n')     
 
 def get_portfolio(client):
     ''' Get account info with current positions '''
     
-    client.reqAccountUpdates(True, "")
-    while not client.account_event.is_set():
-        client.account_event.wait() 
-    client.account_event.clear()  
-    client.reqAccountUpdates(False, "")
+    client.aio.run(client.aio.portfolio())
                 
 def request_chain(client, con):     
-    ''' Get option chain for SPY '''        
+    ''' Get option chain for SPY, downloaded only when the cached one is stale '''        
     
-    client.reqContractDetails(3, con)    
-    while not client.chain_event.is_set():  
+    key = (con.symbol, con.lastTradeDateOrContractMonth, con.right)
+    chain = client.chains.get(key)
+    if chain is None:
         print('Getting option chain for SPY... \n')
-        client.chain_event.wait()     
+        client.chain = client.chain[0:0]
+        client.aio.run(client.aio.chain(con))
+        chain = OptionChain.from_frame(*key, client.chain)
+        if len(chain):
+            client.chains.put(chain)
         print('Received option chain')
-    client.chain_event.clear()  
+    else:
+        print(f'Using cached option chain for SPY, {len(chain)} strikes')
+    client.option_chain = chain
+    client.strikes = chain.strikes
         
 def get_legs_info(client):
     ''' Get strikes and expiry '''
@@ -89,41 +96,39 @@ def get_legs_info(client):
     if client.expiry == None:
         print('No expiry date')
         return 
+    chain = client.option_chain
     stock_price = round(client.current_price)    
-    atm_strike = client.strikes [pq.np_find_closest(client.strikes, stock_price)]
+    atm_strike = chain.closest(stock_price)
     # no more than 5 dollars wide
-    otm_strike = atm_strike + 5
-    if otm_strike not in client.chain.loc[:, 'strike']:
-        otm_strike -= 1
+    otm_strike = chain.floor(atm_strike + 5)
     client.spread['long_leg'] = atm_strike
     client.spread['short_leg'] = otm_strike
         
-    s_mask = client.chain.loc[ :, 'strike'] == otm_strike
-    l_mask = client.chain.loc[ :, 'strike'] == atm_strike
-    client.con_ids['short_leg'] = client.chain.at[client.chain[s_mask].index[0], 'con_id']
-    client.con_ids['long_leg'] = client.chain.at[client.chain[l_mask].index[0], 'con_id']
+    client.con_ids['short_leg'] = chain.con_id(otm_strike)
+    client.con_ids['long_leg'] = chain.con_id(atm_strike)
     print(f"ATM strike - {client.spread['long_leg']} \n"\
                f"OTM strike - {client.spread['short_leg']} \n"\
                f"Expiry     - {client.expiry}")
         
-def create_combo(client):
-    ''' Create combo contract '''
+def create_combo(client, symbol = 'SPY', con_ids = None):
+    ''' Create combo contract, of client.con_ids unless con_ids are given '''
     
+    con_ids = client.con_ids if con_ids is None else con_ids
     bag_con = Contract()
-    bag_con.symbol = "SPY"
+    bag_con.symbol = symbol
     bag_con.secType = "BAG"
     bag_con.currency = "USD"
     bag_con.exchange = "BOX" 
     bag_con.comboLegs = []
     
     leg1 = ComboLeg()
-    leg1.conId = client.con_ids['long_leg'] #long leg  
+    leg1.conId = con_ids['long_leg'] #long leg  
     leg1.ratio = 1
     leg1.action = "BUY"
     leg1.exchange = "BOX"
 
     leg2 = ComboLeg()
-    leg2.conId = client.con_ids['short_leg'] #short leg  
+    leg2.conId = con_ids['short_leg'] #short leg  
     leg2.ratio = 1
     leg2.action = "SELL"
     leg2.exchange = "BOX"
@@ -133,33 +138,33 @@ def create_combo(client):
     bag_con.comboLegs.append(leg2)
     return bag_con
     
-def get_spread_price(client, bag_con):
-    ''' Get mid price of spread '''   
-    
-    bag_price = 0
-    while not (bag_price > 0):        
-        client.reqMktData(11, bag_con, "", False, False, [])    
-        while not client.bag_event.is_set():
-            # print('Getting spread price... \n')
-            client.bag_event.wait()
-                    
-        client.bag_event.clear()
-        bag_price = round((sum([*client.bag_bid.values()] + [*client.bag_ask.values()])/2), 2)  
-        client.cancelMktData(11)    
-        # print('  Bid   Ask\n' 
-        #       f'{client.bag_bid[11]}  {client.bag_ask[11]}\n'
-        #       f'Midprice is {bag_price}')   
-    return bag_price   
+def get_spread_price(client, bag_con, timeout = 30):
+    ''' Get mid price of spread, None if there is no positive one within
+    timeout seconds or the subscription failed '''   
+    
+    # the subscription stays open, later calls read the cached quote
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            bag_price = client.quotes.mid(bag_con, max(remaining, 0))
+        except TimeoutError:
+            print(f'No spread quote within {timeout}s')
+            return None
+        except RequestError as e:
+            print(f'Spread quote failed: {e}')
+            return None
+        if bag_price > 0:
+            return bag_price
+        if remaining <= 0:
+            print(f'No positive spread price within {timeout}s')
+            return None
+        client.quotes.get(bag_con).updated.wait(min(remaining, 1))
 
 def get_order_id(client):
     ''' Get next valid order id '''
     
-    client.id_event.clear()
-    client.reqIds(-1)
-    while not client.id_event.is_set():              
-        client.id_event.wait()     
-    client.id_event.clear()  
-    return client.nextValidOrderId    
+    return client.aio.run(client.aio.order_id())
    
 def place_order(client, order_id, con, lmt_price, action = "BUY" ):    
     ''' Place combo order '''